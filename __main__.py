@@ -1,17 +1,42 @@
+import argparse
 import asyncio
 import logging
+import signal
 
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 
 from handlers import main_router
-from config import get_config, BotConfig
-from utils import task_scheduler  # Импортируем планировщик
+from config import (
+    get_config,
+    get_optional_config,
+    BotConfig,
+    CatchUpConfig,
+    ClusterConfig,
+    DeliveryConfig,
+    FSMConfig,
+    JournalConfig,
+    MetricsConfig,
+    StorageConfig,
+    WebhookConfig,
+    watch_config
+)
+from delivery import Delivery
+from delivery_journal import DeliveryJournal
+from fsm_storage import SQLiteStorage
+from leases import LeaseManager
+from metrics import start_metrics_server
+from middlewares import AdminMiddleware
+from webhook import run_webhook
+from scheduler import task_scheduler  # Импортируем планировщик
+from utils import start_write_behind, stop_write_behind
 
 logger = logging.getLogger(__name__)
 
-async def main():
+async def main(scheduler_only: bool = False):
     logging.basicConfig(
         level=logging.INFO,
         format='%(filename)s:%(lineno)d #%(levelname)-8s '
@@ -25,23 +50,124 @@ async def main():
         logger.error("Bot token is missing in the configuration.")
         return
     
-    bot = Bot(token=bot_config.token.get_secret_value(),
-              default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    dp = Dispatcher()
+    def make_bot(token: str) -> Bot:
+        session = None
+        if bot_config.api_url:
+            session = AiohttpSession(api=TelegramAPIServer.from_base(bot_config.api_url))
+        return Bot(token=token, session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+
+    cluster_config = get_optional_config(ClusterConfig, "cluster")
+    # Дополнительный воркер кластера только отправляет по расписанию: апдейты одного токена
+    # может получать лишь один процесс (getUpdates отвечает 409, webhook у бота один)
+    scheduler_only = scheduler_only or cluster_config.scheduler_only
+    if scheduler_only and not cluster_config.enabled:
+        logger.error("Scheduler-only mode requires cluster.enabled, otherwise tasks would be sent twice.")
+        return
+    # Ошибка в секции webhook (например, enabled без url) должна остановить запуск до старта планировщика
+    webhook_config = get_optional_config(WebhookConfig, "webhook")
+    polling = not scheduler_only and not webhook_config.enabled
+
+    bot = make_bot(bot_config.token.get_secret_value())
+    # Основной бот обслуживает меню, отправки распределяются между ним и дополнительными ботами
+    senders = [make_bot(token.get_secret_value()) for token in bot_config.senders]
+    fsm_config = get_optional_config(FSMConfig, "fsm")
+    storage = None
+    if fsm_config.backend == "sqlite" and not scheduler_only:
+        # Незавершённые диалоги (например, создание задачи) переживают перезапуск бота
+        storage = SQLiteStorage(fsm_config.path, fsm_config.cache_size, fsm_config.ttl, fsm_config.flush_interval)
+    # FSM-middleware подключаем вручную, чтобы проверка админа шла раньше обращения к хранилищу
+    dp = Dispatcher(storage=storage, disable_fsm=True)
+    dp.update.outer_middleware(AdminMiddleware())
+    dp.update.outer_middleware(dp.fsm)
 
     dp.include_routers(main_router)
- 
-    await bot.delete_webhook(drop_pending_updates=True)
-    logger.info("Webhook deleted, ready for polling.")
-    
+
+    # Очередь отправки с ограничением скорости
+    delivery = Delivery(bot, get_optional_config(DeliveryConfig, "delivery"), senders)
+    delivery.start()
+    dp["delivery"] = delivery
+
+    # Несколько экземпляров бота делят расписание через аренду шардов в общей SQLite-базе
+    leases = None
+    if cluster_config.enabled:
+        storage_config = get_optional_config(StorageConfig, "storage")
+        if storage_config.backend != "sqlite":
+            logger.error("Cluster mode requires the sqlite storage backend.")
+            return
+        leases = LeaseManager(storage_config.path, cluster_config.node_id,
+                              cluster_config.shards, cluster_config.lease_ttl)
+
+    # Журнал отправок: после перезапуска уже отправленные сообщения не дублируются
+    journal = None
+    journal_config = get_optional_config(JournalConfig, "journal")
+    if journal_config.enabled:
+        journal = DeliveryJournal(journal_config.path, journal_config.keep_days)
+
+    # Задачи пишутся на диск в отдельном потоке, изменения за write_delay объединяются в одну запись
+    start_write_behind()
+
     # Запускаем планировщик в отдельной задаче
-    asyncio.create_task(task_scheduler(bot))
-    
-    await dp.start_polling(bot)
+    # Пропущенные за простой срабатывания отправляются по политике catch_up с ограничением скорости
+    scheduler_task = asyncio.create_task(task_scheduler(
+        delivery, leases, journal, get_optional_config(CatchUpConfig, "catch_up")
+    ))
+    # Каналы и админы подхватываются из config.yaml без перезапуска
+    config_watcher = asyncio.create_task(watch_config())
+
+    metrics_runner = None
+    metrics_config = get_optional_config(MetricsConfig, "metrics")
+    if metrics_config.enabled:
+        metrics_runner = await start_metrics_server(metrics_config)
+
+    try:
+        if scheduler_only:
+            logger.info("Scheduler-only mode: updates are received by another instance.")
+            # Как polling в aiogram: по SIGINT/SIGTERM останавливаемся штатно и сразу отпускаем аренды
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(sig, scheduler_task.cancel)
+            await asyncio.wait([scheduler_task])
+            if not scheduler_task.cancelled():
+                scheduler_task.result()  # Планировщик упал — ошибка уйдёт в лог
+        elif not polling:
+            await run_webhook(dp, bot, webhook_config)
+        else:
+            await bot.delete_webhook(drop_pending_updates=True)
+            logger.info("Webhook deleted, ready for polling.")
+            await dp.start_polling(bot)
+    finally:
+        scheduler_task.cancel()
+        config_watcher.cancel()
+        # Дожидаемся остановки планировщика, чтобы он не писал в уже закрытый журнал
+        await asyncio.gather(scheduler_task, config_watcher, return_exceptions=True)
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await delivery.stop()
+        try:
+            # Несохранённые изменения задач записываем до закрытия журнала отправок
+            await stop_write_behind()
+        except Exception as e:
+            logger.error(f"Failed to save task changes on shutdown: {e}")
+        for sender in senders:
+            await sender.session.close()
+        if not polling:
+            # После polling сессию основного бота закрывает dispatcher
+            await bot.session.close()
+        if leases is not None:
+            leases.release_all()
+            leases.close()
+        if journal is not None:
+            journal.close()
     return bot
 
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Telegram channel mailer bot")
+    parser.add_argument("--scheduler-only", action="store_true",
+                        help="Cluster worker: only send scheduled tasks, do not receive updates")
+    return parser.parse_args(argv)
+
 if __name__ == '__main__':
     try:
-        asyncio.run(main())
+        asyncio.run(main(parse_args().scheduler_only))
     except Exception as e:
         logger.error(f"Error while starting bot: {e}")
\ No newline at end of file
@@ -0,0 +1,281 @@
+"""Нагрузочные бенчмарки против локального fake Bot API.
+
+Запуск: python benchmark.py --sizes 1000,10000,100000 --output bench.json
+Результат — JSON, чтобы сравнивать версии между собой.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from typing import Any, Callable, Dict, List
+
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SOURCE_DIR)
+
+BENCH_TOKEN = "123456:benchmark"
+ADMIN_ID = 1
+CHANNELS = 50
+
+CONFIG_TEMPLATE = """
+bot:
+  token: "{token}"
+admins:
+  - id: "{admin_id}"
+channels:
+{channels}
+"""
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+
+    def pick(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {
+        "count": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": pick(0.50) * 1000,
+        "p95_ms": pick(0.95) * 1000,
+        "p99_ms": pick(0.99) * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def _progress(text: str):
+    print(text, file=sys.stderr, flush=True)
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SOURCE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _make_bot(api_url: str):
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+
+    return Bot(token=BENCH_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(api_url)))
+
+
+def _channel_id(index: int) -> str:
+    return f"-100{1000000 + index % CHANNELS}"
+
+
+async def bench_scheduler(api_url: str, size: int) -> Dict[str, Any]:
+    """Сколько задач в секунду планировщик успевает отправить через очередь доставки."""
+    from config import DeliveryConfig
+    from delivery import Delivery
+    from scheduler import TaskScheduler
+    from storage import SQLiteTaskStore
+    from utils import get_repository, set_store
+
+    set_store(SQLiteTaskStore(f"scheduler_{size}.db"))
+    repository = get_repository()
+    repository.replace_all([
+        {"id": i + 1, "message": f"benchmark #{i + 1}", "channel_id": _channel_id(i),
+         "schedule_type": "immediate", "schedule_time": None, "status": "pending", "last_sent_date": None}
+        for i in range(size)
+    ])
+
+    bot = _make_bot(api_url)
+    # Лимиты Telegram здесь не нужны: меряем собственную пропускную способность бота
+    delivery = Delivery(bot, DeliveryConfig(workers=64, global_rate=1e9, chat_rate=1e9, chat_burst=10 ** 9))
+    delivery.start()
+    started = time.perf_counter()
+    runner = asyncio.create_task(TaskScheduler(delivery).run())
+    try:
+        while len(repository.sorted_ids("pending")) > 0:
+            if runner.done():
+                runner.result()
+            await asyncio.sleep(0.02)
+        elapsed = time.perf_counter() - started
+    finally:
+        runner.cancel()
+        await asyncio.gather(runner, return_exceptions=True)
+        await delivery.stop()
+        await bot.session.close()
+        set_store(None)
+    return {
+        "tasks": size,
+        "seconds": elapsed,
+        "tasks_per_second": size / elapsed,
+        "done": len(repository.sorted_ids("done")),
+        "failed": len(repository.sorted_ids("failed")),
+    }
+
+
+def _time_ops(operation: Callable[[int], Any], count: int) -> Dict[str, float]:
+    started = time.perf_counter()
+    for i in range(count):
+        operation(i)
+    elapsed = time.perf_counter() - started
+    return {"ops": count, "seconds": elapsed, "us_per_op": elapsed / count * 1e6, "ops_per_second": count / elapsed}
+
+
+def bench_store(backend: str, count: int) -> Dict[str, Any]:
+    """Стоимость операций utils.py на выбранном хранилище."""
+    import utils
+    from storage import JsonTaskStore, SQLiteTaskStore
+
+    store = SQLiteTaskStore(f"store_{count}.db") if backend == "sqlite" else JsonTaskStore(f"store_{count}.json")
+    utils.set_store(store)
+    ids: List[int] = []
+    try:
+        results = {
+            "add_task": _time_ops(lambda i: ids.append(utils.add_task(
+                f"message {i}", _channel_id(i), "delayed", "2030-01-01 10:00:00")), count),
+            "get_task": _time_ops(lambda i: utils.get_task(ids[i]), count),
+            "update_task": _time_ops(lambda i: utils.update_task(ids[i], last_sent_date="2030-01-01"), count),
+            "edit_task": _time_ops(lambda i: utils.edit_task(ids[i], new_message=f"edited {i}"), count),
+            "load_tasks_by_status": _time_ops(lambda i: utils.load_tasks(status="pending"), max(1, count // 100)),
+            "delete_task": _time_ops(lambda i: utils.delete_task(ids[i]), count),
+        }
+    finally:
+        store.close()
+        utils.set_store(None)
+    return {"backend": backend, "tasks": count, "operations": results}
+
+
+async def bench_clicks(api_url: str, clicks: int, tasks: int) -> Dict[str, Any]:
+    """Задержка от нажатия кнопки админом до ответа бота через main_router."""
+    from aiogram import Dispatcher
+    from aiogram.fsm.storage.memory import MemoryStorage
+    from aiogram.types import Update
+
+    from callbacks import pack, StartMenu, TaskOpen, TasksPage
+    from handlers import main_router
+    from middlewares import AdminMiddleware
+    from storage import SQLiteTaskStore
+    from utils import get_repository, set_store
+
+    set_store(SQLiteTaskStore("clicks.db"))
+    get_repository().replace_all([
+        {"id": i + 1, "message": f"task {i + 1}", "channel_id": _channel_id(i),
+         "schedule_type": "delayed", "schedule_time": "2030-01-01 10:00:00", "status": "pending",
+         "last_sent_date": None}
+        for i in range(tasks)
+    ])
+
+    bot = _make_bot(api_url)
+    dp = Dispatcher(storage=MemoryStorage(), disable_fsm=True)
+    dp.update.outer_middleware(AdminMiddleware())
+    dp.update.outer_middleware(dp.fsm)
+    dp.include_router(main_router)
+
+    buttons = [
+        pack(StartMenu("manage")),
+        pack(TasksPage("", "", "n", tasks // 2)),
+        pack(TasksPage("pending", _channel_id(3), "n", 0)),
+        pack(TaskOpen(tasks // 3)),
+    ]
+    samples = []
+    try:
+        for i in range(clicks):
+            update = Update.model_validate({
+                "update_id": i + 1,
+                "callback_query": {
+                    "id": str(i + 1),
+                    "chat_instance": "benchmark",
+                    "from": {"id": ADMIN_ID, "is_bot": False, "first_name": "Admin"},
+                    "data": buttons[i % len(buttons)],
+                    "message": {"message_id": 1, "date": 0, "text": "menu",
+                                "chat": {"id": ADMIN_ID, "type": "private"}},
+                },
+            })
+            started = time.perf_counter()
+            await dp.feed_update(bot, update)
+            samples.append(time.perf_counter() - started)
+    finally:
+        await bot.session.close()
+        set_store(None)
+    return {"clicks": clicks, "tasks": tasks, "latency": _percentiles(samples)}
+
+
+async def run(args) -> Dict[str, Any]:
+    from fake_bot_api import FakeBotAPI
+
+    api = FakeBotAPI(latency=args.latency, flood_rate=args.flood_rate, error_rate=args.error_rate, seed=1)
+    server = await api.start()
+    results: List[Dict[str, Any]] = []
+    try:
+        for size in args.sizes:
+            api.reset()
+            result = await bench_scheduler(server.base_url, size)
+            result.update(api_requests=api.requests, api_floods=api.floods, api_errors=api.errors)
+            results.append({"name": "scheduler_throughput", **result})
+            _progress(f"scheduler {size}: {result['tasks_per_second']:.0f} tasks/s")
+        for backend in args.backends:
+            result = bench_store(backend, args.store_ops)
+            results.append({"name": "store_operations", **result})
+            _progress(f"store {backend}: add_task {result['operations']['add_task']['us_per_op']:.0f} us/op")
+        # Задержку нажатий меряем без сбоев API: обработчики не повторяют запросы
+        api.reset()
+        api.flood_rate = api.error_rate = 0.0
+        result = await bench_clicks(server.base_url, args.clicks, args.click_tasks)
+        results.append({"name": "admin_click_latency", **result})
+        _progress(f"clicks: p95 {result['latency']['p95_ms']:.1f} ms")
+    finally:
+        await server.close()
+
+    return {
+        "meta": {
+            "revision": _git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "api_latency": args.latency,
+            "api_flood_rate": args.flood_rate,
+            "api_error_rate": args.error_rate,
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="tg_mailer load benchmarks against a local fake Bot API")
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        type=lambda value: [int(size) for size in value.split(",")],
+                        help="Task counts for the scheduler throughput benchmark")
+    parser.add_argument("--backends", default="sqlite,json", type=lambda value: value.split(","))
+    parser.add_argument("--store-ops", type=int, default=2000, help="Operations per store benchmark")
+    parser.add_argument("--clicks", type=int, default=500)
+    parser.add_argument("--click-tasks", type=int, default=1000, help="Tasks in the store during click benchmark")
+    parser.add_argument("--latency", type=float, default=0.0, help="Fake API response delay, seconds")
+    parser.add_argument("--flood-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--output", help="Write JSON here instead of stdout")
+    args = parser.parse_args()
+    # Логи бота (повторы отправки и т.п.) не нужны, прогресс пишем в stderr
+    logging.basicConfig(level=logging.CRITICAL)
+
+    with tempfile.TemporaryDirectory(prefix="tg_mailer_bench_") as workdir:
+        # Модули бота читают config.yaml и файлы задач из текущего каталога
+        os.chdir(workdir)
+        channels = "\n".join(f'  - {{url: "@bench{i}", id: "{_channel_id(i)}"}}' for i in range(CHANNELS))
+        with open("config.yaml", "w") as file:
+            file.write(CONFIG_TEMPLATE.format(token=BENCH_TOKEN, admin_id=ADMIN_ID, channels=channels))
+        report = asyncio.run(run(args))
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from delivery import Delivery, PRIORITY_SCHEDULED
+from media import send_post
+
+logger = logging.getLogger(__name__)
+
+# Префикс группы каналов в списке адресатов задачи: "group:<имя>"
+GROUP_PREFIX = "group:"
+
+
+def group_target(name: str) -> str:
+    return f"{GROUP_PREFIX}{name}"
+
+
+def resolve_targets(targets: List[str], groups: Dict[str, List[str]]) -> List[str]:
+    """Раскрываем группы в ID каналов, сохраняя порядок и убирая повторы."""
+    resolved: Dict[str, None] = {}
+    for target in targets:
+        if target.startswith(GROUP_PREFIX):
+            name = target[len(GROUP_PREFIX):]
+            if name not in groups:
+                logger.warning(f"Unknown channel group {name!r}, skipping")
+            for channel_id in groups.get(name, ()):
+                resolved.setdefault(channel_id, None)
+        else:
+            resolved.setdefault(target, None)
+    return list(resolved)
+
+
+def sent_status(message_ids: List[int]) -> Dict:
+    status = {"status": "sent", "message_id": message_ids[0] if message_ids else None}
+    if len(message_ids) > 1:
+        status["message_ids"] = message_ids
+    return status
+
+
+def _copied_ids(result) -> List[int]:
+    results = result if isinstance(result, list) else [result]
+    return [item.message_id for item in results if getattr(item, "message_id", None) is not None]
+
+
+async def broadcast(delivery: Delivery, task: Dict, targets: List[str],
+                    previous: Optional[Dict[str, Dict]] = None,
+                    on_sent: Optional[Callable[[str, List[int]], Awaitable[None]]] = None,
+                    priority: int = PRIORITY_SCHEDULED) -> Dict[str, Dict]:
+    """Рассылаем задачу по каналам и возвращаем статус по каждому.
+
+    Сообщение (или альбом) отправляется один раз, в остальные каналы оно копируется
+    через copy_message/copy_messages параллельно. Каналы, куда сообщение уже ушло (previous),
+    повторно не получают его — это позволяет дослать только упавшие адресаты.
+    Статус адресата: {"status": "sent", "message_id": ...} или {"status": "failed", "error": ...}.
+    await on_sent(chat_id, message_ids) вызывается сразу после каждой успешной отправки.
+    """
+    deliveries = {chat_id: status for chat_id, status in (previous or {}).items()
+                  if chat_id in targets and status.get("status") == "sent"}
+    source = next(((chat_id, deliveries[chat_id].get("message_ids") or [deliveries[chat_id]["message_id"]])
+                   for chat_id in targets
+                   if chat_id in deliveries and deliveries[chat_id].get("message_id") is not None), None)
+    remaining = [chat_id for chat_id in targets if chat_id not in deliveries]
+
+    # Исходное сообщение: пробуем адресатов по очереди, пока одна отправка не пройдёт
+    while source is None and remaining:
+        chat_id = remaining.pop(0)
+        try:
+            message_ids = await send_post(delivery, chat_id, task, priority)
+        except Exception as e:
+            deliveries[chat_id] = {"status": "failed", "error": str(e)}
+            continue
+        deliveries[chat_id] = sent_status(message_ids)
+        if on_sent is not None:
+            await on_sent(chat_id, message_ids)
+        if message_ids:
+            source = (chat_id, message_ids)
+
+    if source is not None and remaining:
+        from_chat_id, message_ids = source
+        if len(message_ids) == 1:
+            copies = (delivery.send(chat_id, method="copy_message", priority=priority, from_chat_id=from_chat_id,
+                                    message_id=message_ids[0]) for chat_id in remaining)
+        else:
+            # Альбом копируется одним запросом, группировка сохраняется
+            copies = (delivery.send(chat_id, method="copy_messages", priority=priority, from_chat_id=from_chat_id,
+                                    message_ids=message_ids) for chat_id in remaining)
+        results = await asyncio.gather(*copies, return_exceptions=True)
+        for chat_id, result in zip(remaining, results):
+            if isinstance(result, Exception):
+                deliveries[chat_id] = {"status": "failed", "error": str(result)}
+            else:
+                message_ids = _copied_ids(result)
+                deliveries[chat_id] = sent_status(message_ids)
+                if on_sent is not None:
+                    await on_sent(chat_id, message_ids)
+    return {chat_id: deliveries[chat_id] for chat_id in targets if chat_id in deliveries}
@@ -0,0 +1,217 @@
+import inspect
+import logging
+import time
+
+from datetime import date
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional, Tuple, Type
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+from aiogram.types import CallbackQuery
+
+from metrics import handler_seconds
+
+logger = logging.getLogger(__name__)
+
+# Версия формата: кнопки из старых сообщений с другой версией просто игнорируются
+CALLBACK_VERSION = "1"
+SEPARATOR = ":"
+MAX_CALLBACK_LENGTH = 64
+
+
+# Типизированные данные кнопок. Время хранится в минутах от полуночи, дата — как date.
+class Back(NamedTuple):
+    pass
+
+class Noop(NamedTuple):
+    pass
+
+class StartMenu(NamedTuple):
+    action: str  # "create", "manage", "failed"
+
+class ScheduleTypePick(NamedTuple):
+    schedule_type: str
+
+class DateShift(NamedTuple):
+    day: date
+    delta: int
+
+class DateConfirm(NamedTuple):
+    day: date
+
+class TimeShift(NamedTuple):
+    minutes: int
+    delta: int
+
+class TimeConfirm(NamedTuple):
+    minutes: int
+
+class ChannelPick(NamedTuple):
+    channel_id: str
+
+class GroupPick(NamedTuple):
+    name: str
+
+class TasksPage(NamedTuple):
+    status: str
+    channel_id: str
+    direction: str  # "n" — ID больше cursor, "p" — меньше
+    cursor: int
+
+class TasksChannelFilter(NamedTuple):
+    status: str
+
+class TaskOpen(NamedTuple):
+    task_id: int
+
+class TaskEdit(NamedTuple):
+    task_id: int
+
+class TaskDelete(NamedTuple):
+    task_id: int
+
+class EditMessage(NamedTuple):
+    task_id: int
+
+class EditTime(NamedTuple):
+    task_id: int
+
+class FailedOpen(NamedTuple):
+    task_id: int
+
+class TaskRequeue(NamedTuple):
+    task_id: int
+
+
+# Короткие коды действий; коды не переиспользуются, новые добавляются в конец
+CALLBACK_CODES: Dict[str, Type[NamedTuple]] = {
+    "b": Back,
+    "n": Noop,
+    "s": StartMenu,
+    "y": ScheduleTypePick,
+    "d": DateShift,
+    "D": DateConfirm,
+    "t": TimeShift,
+    "T": TimeConfirm,
+    "c": ChannelPick,
+    "p": TasksPage,
+    "f": TasksChannelFilter,
+    "o": TaskOpen,
+    "e": TaskEdit,
+    "x": TaskDelete,
+    "m": EditMessage,
+    "h": EditTime,
+    "F": FailedOpen,
+    "r": TaskRequeue,
+    "g": GroupPick,
+}
+_CODE_BY_TYPE = {cls: code for code, cls in CALLBACK_CODES.items()}
+
+
+def _encode_value(value: Any) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int):
+        return _to_base36(value)
+    if isinstance(value, date):
+        return _to_base36(value.toordinal())
+    value = str(value)
+    if SEPARATOR in value:
+        raise ValueError(f"Callback field must not contain {SEPARATOR!r}: {value!r}")
+    return value
+
+
+def _to_base36(number: int) -> str:
+    if number < 0:
+        return "-" + _to_base36(-number)
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    result = ""
+    while True:
+        number, remainder = divmod(number, 36)
+        result = digits[remainder] + result
+        if number == 0:
+            return result
+
+
+_DECODERS: Dict[type, Callable[[str], Any]] = {
+    int: lambda value: int(value, 36),
+    bool: lambda value: value == "1",
+    date: lambda value: date.fromordinal(int(value, 36)),
+    str: str,
+}
+# Для каждого кода заранее готовим список функций разбора полей
+_FIELD_DECODERS: Dict[str, Tuple[Callable[[str], Any], ...]] = {
+    code: tuple(_DECODERS[field_type] for field_type in cls.__annotations__.values())
+    for code, cls in CALLBACK_CODES.items()
+}
+
+
+def pack(payload: NamedTuple) -> str:
+    """Упаковываем данные кнопки в callback_data: <версия><код>:<поле>:<поле>..."""
+    code = _CODE_BY_TYPE[type(payload)]
+    data = SEPARATOR.join([CALLBACK_VERSION + code] + [_encode_value(value) for value in payload])
+    if len(data.encode()) > MAX_CALLBACK_LENGTH:
+        raise ValueError(f"Callback data is too long: {data!r}")
+    return data
+
+
+def unpack(data: Optional[str]) -> Optional[NamedTuple]:
+    """Разбираем callback_data; None — чужой или устаревший формат."""
+    if not data or not data.startswith(CALLBACK_VERSION):
+        return None
+    head, *values = data.split(SEPARATOR)
+    code = head[len(CALLBACK_VERSION):]
+    decoders = _FIELD_DECODERS.get(code)
+    if decoders is None or len(decoders) != len(values):
+        return None
+    try:
+        return CALLBACK_CODES[code](*(decode(value) for decode, value in zip(decoders, values)))
+    except ValueError:
+        return None
+
+
+class CallbackRouter:
+    """Маршрутизация колбэков по типу данных и состоянию FSM через поиск в словаре.
+
+    Обработчик получает callback, а также по имени параметров: cb (данные кнопки),
+    state (FSMContext) и любые данные диспетчера (например, delivery).
+    Кнопки, которые что-то меняют, доступны только роли "admin"; readonly-маршруты
+    открыты всем ролям.
+    """
+
+    def __init__(self):
+        self._routes: Dict[Tuple[type, Optional[str]], Tuple[Callable[..., Awaitable], Tuple[str, ...], bool]] = {}
+
+    def route(self, payload_type: Type[NamedTuple], *states: State, readonly: bool = False):
+        """Регистрируем обработчик; без состояний — для любого состояния."""
+        def decorator(handler: Callable[..., Awaitable]):
+            params = tuple(inspect.signature(handler).parameters)[1:]
+            for state in states or (None,):
+                key = (payload_type, state.state if state is not None else None)
+                if key in self._routes:
+                    raise ValueError(f"Duplicate callback route: {key}")
+                self._routes[key] = (handler, params, readonly)
+            return handler
+        return decorator
+
+    async def dispatch(self, callback: CallbackQuery, state: FSMContext, **data: Any):
+        cb = unpack(callback.data)
+        if cb is None:
+            await callback.answer("Кнопка устарела, откройте меню заново: /start")
+            return
+        current_state = await state.get_state()
+        route = self._routes.get((type(cb), current_state)) or self._routes.get((type(cb), None))
+        if route is None:
+            # Кнопка из другого шага диалога
+            await callback.answer()
+            return
+        handler, params, readonly = route
+        if not readonly and data.get("admin_role") != "admin":
+            await callback.answer("Недостаточно прав")
+            return
+        available = {"cb": cb, "state": state, **data}
+        started = time.monotonic()
+        try:
+            await handler(callback, **{name: available[name] for name in params if name in available})
+        finally:
+            handler_seconds.observe(time.monotonic() - started, type(cb).__name__)
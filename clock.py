@@ -0,0 +1,49 @@
+import asyncio
+
+from datetime import datetime, timedelta
+from typing import Collection
+
+
+class Clock:
+    """Источник времени для планировщика: системные часы или виртуальные (для симуляции)."""
+
+    def now(self) -> datetime:
+        return datetime.now()
+
+    async def wait(self, event: asyncio.Event, timeout: float, busy: Collection[asyncio.Task] = ()):
+        """Ждём события не дольше timeout секунд. busy — фоновые отправки планировщика."""
+        # Не wait_for: в Python 3.11 он теряет отмену, если событие наступило одновременно с ней,
+        # и планировщик не останавливается при завершении бота
+        waiter = asyncio.ensure_future(event.wait())
+        try:
+            await asyncio.wait([waiter], timeout=timeout)
+        finally:
+            waiter.cancel()
+
+
+class SimulationFinished(Exception):
+    """Виртуальное время дошло до конца симуляции."""
+
+
+class VirtualClock(Clock):
+    """Виртуальные часы: ожидание не занимает реального времени.
+
+    Время сдвигается только когда планировщику больше нечего делать: сначала
+    дожидаемся всех фоновых отправок, потом перескакиваем сразу на конец ожидания.
+    """
+
+    def __init__(self, start: datetime, end: datetime):
+        self._now = start
+        self.end = end
+
+    def now(self) -> datetime:
+        return self._now
+
+    async def wait(self, event: asyncio.Event, timeout: float, busy: Collection[asyncio.Task] = ()):
+        if busy:
+            await asyncio.wait(list(busy))
+        if event.is_set():
+            return
+        self._now += timedelta(seconds=timeout)
+        if self._now >= self.end:
+            raise SimulationFinished()
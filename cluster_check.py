@@ -0,0 +1,185 @@
+"""Проверка кластера на нескольких процессах: два воркера делят шарды расписания,
+а после падения одного второй забирает его шарды не позже чем через lease_ttl.
+
+Запуск: python cluster_check.py [--lease-ttl 3] [--shards 8] [--channels 16] [--output cluster.json]
+Поднимает локальный fake Bot API и два процесса `__main__.py --scheduler-only` во временном
+каталоге с общими tasks.db и config.yaml. Первый воркер убивается через SIGKILL (аренды не
+отпускаются, как при настоящем падении). Результат — JSON; код возврата 1, если проверка не прошла.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from typing import Callable, Dict, List, Optional
+
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SOURCE_DIR)
+
+from fake_bot_api import FakeBotAPI
+from storage import SQLiteTaskStore
+
+CHECK_TOKEN = "123456:cluster"
+# Запас на запуск процессов и медленные heartbeat (секунды)
+SLACK = 2.0
+
+CONFIG_TEMPLATE = """
+bot:
+  token: "{token}"
+  api_url: "{api_url}"
+admins:
+  - id: "1"
+channels:
+{channels}
+storage:
+  backend: sqlite
+  path: tasks.db
+cluster:
+  enabled: true
+  shards: {shards}
+  lease_ttl: {lease_ttl}
+fsm:
+  backend: memory
+"""
+
+
+def _channel_id(index: int) -> str:
+    return f"-100{1000000 + index}"
+
+
+def _node_id(process: subprocess.Popen) -> str:
+    # Как leases.default_node_id у запущенного процесса
+    return f"{socket.gethostname()}-{process.pid}"
+
+
+def _shard_owners(path: str) -> Dict[int, Optional[str]]:
+    """Владельцы шардов с действующей арендой (None — шард свободен)."""
+    conn = sqlite3.connect(path, timeout=5)
+    try:
+        rows = conn.execute("SELECT shard, owner, expires_at FROM leases").fetchall()
+    except sqlite3.OperationalError:
+        # Таблицу аренд создаёт первый воркер
+        return {}
+    finally:
+        conn.close()
+    now = time.time()
+    return {shard: owner if owner and expires_at >= now else None for shard, owner, expires_at in rows}
+
+
+async def _wait_until(condition: Callable[[], bool], timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        await asyncio.sleep(0.1)
+    return condition()
+
+
+def _start_worker(workdir: str, name: str) -> subprocess.Popen:
+    log = open(os.path.join(workdir, f"{name}.log"), "w")
+    return subprocess.Popen([sys.executable, os.path.join(SOURCE_DIR, "__main__.py"), "--scheduler-only"],
+                            cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+
+
+def _stop_worker(process: subprocess.Popen):
+    if process.poll() is None:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+async def _served_channels(api: FakeBotAPI, seconds: float) -> List[str]:
+    """Каналы, в которые ушло хотя бы одно сообщение за seconds секунд."""
+    api.reset()
+    await asyncio.sleep(seconds)
+    return sorted({str(send["chat_id"]) for send in api.sent})
+
+
+async def check(workdir: str, shards: int, channels: int, lease_ttl: float, interval: int) -> Dict:
+    api = FakeBotAPI()
+    server = await api.start()
+    with open(os.path.join(workdir, "config.yaml"), "w", encoding="utf-8") as f:
+        f.write(CONFIG_TEMPLATE.format(
+            token=CHECK_TOKEN, api_url=server.base_url, shards=shards, lease_ttl=lease_ttl,
+            channels="\n".join(f'  - url: "@channel{i}"\n    id: "{_channel_id(i)}"' for i in range(channels))
+        ))
+    db_path = os.path.join(workdir, "tasks.db")
+    store = SQLiteTaskStore(db_path)
+    store.insert_many([
+        {"message": f"cluster check {i}", "channel_id": _channel_id(i), "schedule_type": "interval",
+         "schedule_time": str(interval), "status": "pending", "last_sent_date": None, "created_at": time.time()}
+        for i in range(channels)
+    ])
+    store.close()
+
+    all_channels = [_channel_id(i) for i in range(channels)]
+    workers = [_start_worker(workdir, "worker1"), _start_worker(workdir, "worker2")]
+    first, second = (_node_id(worker) for worker in workers)
+    result: Dict = {"shards": shards, "channels": channels, "lease_ttl": lease_ttl}
+    try:
+        # Оба воркера держат аренды, и все шарды заняты
+        split = await _wait_until(lambda: set(_shard_owners(db_path).values()) == {first, second},
+                                  timeout=10 * lease_ttl + 10)
+        owners = _shard_owners(db_path)
+        result["split"] = {node: sum(owner == node for owner in owners.values()) for node in (first, second)}
+        result["served_by_two"] = len(await _served_channels(api, 2 * interval + SLACK))
+
+        workers[0].kill()
+        workers[0].wait()
+        killed_at = time.monotonic()
+        # Аренды убитого истекают через lease_ttl, второй забирает их на ближайшем heartbeat (раз в lease_ttl / 3)
+        limit = lease_ttl + lease_ttl / 3 + SLACK
+        taken_over = await _wait_until(lambda: set(_shard_owners(db_path).values()) == {second}, timeout=limit)
+        result["takeover_seconds"] = round(time.monotonic() - killed_at, 2)
+        result["takeover_limit_seconds"] = round(limit, 2)
+        result["served_by_survivor"] = len(await _served_channels(api, 2 * interval + SLACK))
+    finally:
+        for worker in workers:
+            _stop_worker(worker)
+        await server.close()
+
+    result["ok"] = (split and taken_over and result["served_by_two"] == len(all_channels)
+                    and result["served_by_survivor"] == len(all_channels))
+    return result
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Check shard lease handover between scheduler processes")
+    parser.add_argument("--shards", type=int, default=8)
+    parser.add_argument("--channels", type=int, default=16, help="One interval task per channel")
+    parser.add_argument("--lease-ttl", type=float, default=3.0)
+    parser.add_argument("--interval", type=int, default=5, help="Task interval, seconds")
+    parser.add_argument("--keep", action="store_true", help="Keep the working directory (worker logs)")
+    parser.add_argument("--output", help="Write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="tg_mailer_cluster_")
+    try:
+        result = asyncio.run(check(workdir, args.shards, args.channels, args.lease_ttl, args.interval))
+    finally:
+        if args.keep:
+            print(f"Worker logs: {workdir}", file=sys.stderr)
+        else:
+            subprocess.run(["rm", "-rf", workdir])
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if not result["ok"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
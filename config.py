@@ -1,27 +1,110 @@
-from functools import lru_cache
-from typing import TypeVar, Type, List
+import asyncio
+import logging
+import os
+import re
+import threading
 
-from pydantic import BaseModel, SecretStr
+from typing import Any, Dict, FrozenSet, Literal, TypeVar, Type, List, Optional, Tuple
+
+from pydantic import BaseModel, SecretStr, model_validator
 from yaml import load, SafeLoader
 
+logger = logging.getLogger(__name__)
+
 ConfigType = TypeVar("ConfigType", bound=BaseModel)
 
 class BotConfig(BaseModel):
-    token: SecretStr    
+    token: SecretStr
+    api_url: Optional[str] = None  # Свой Bot API сервер (локальный или fake_bot_api.py), по умолчанию api.telegram.org
+    senders: List[SecretStr] = []  # Токены дополнительных ботов-отправителей (должны быть админами каналов)
 
 class Channel(BaseModel):
     url: str
     id: str
 
+class ChannelGroup(BaseModel):
+    name: str  # Латиница, цифры и "_" — имя попадает в callback_data кнопок
+    channels: List[str]  # ID каналов из секции channels
+
 class Admin(BaseModel):
     id: str
+    role: Literal["admin", "viewer"] = "admin"  # "admin" — полный доступ, "viewer" — только просмотр списков задач
+
+class StorageConfig(BaseModel):
+    backend: str = "sqlite"  # "sqlite" или "json"
+    path: str = "tasks.db"  # Файл базы для SQLite
+    compact_every: int = 1000  # Для json: сколько записей журнала копить до сворачивания в снимок
+    write_delay: float = 0.05  # Окно (секунды), за которое изменения задач объединяются в одну запись
+
+class WebhookConfig(BaseModel):
+    enabled: bool = False  # False — long polling
+    url: str = ""  # Публичный адрес бота, например "https://bot.example.com"
+    path: str = "/webhook"
+    host: str = "0.0.0.0"
+    port: int = 8080
+    secret_token: Optional[SecretStr] = None  # Проверяется в заголовке X-Telegram-Bot-Api-Secret-Token
+    max_concurrent_updates: int = 100  # Сколько апдейтов обрабатывать одновременно
+
+    @model_validator(mode="after")
+    def _check_url(self):
+        # Без адреса webhook не зарегистрировать; молча переходить на polling нельзя
+        if self.enabled and not self.url:
+            raise ValueError("webhook.url is required when webhook.enabled is true")
+        return self
+
+class ClusterConfig(BaseModel):
+    enabled: bool = False  # Несколько воркеров-планировщиков делят задачи через аренду шардов
+    node_id: Optional[str] = None  # По умолчанию "hostname-pid"
+    shards: int = 16  # На сколько частей (по каналам) делится расписание
+    lease_ttl: float = 30  # Через сколько секунд без heartbeat аренда умершего воркера освобождается
+    scheduler_only: bool = False  # Только планировщик, без приёма апдейтов (их получает другой экземпляр)
+
+class FSMConfig(BaseModel):
+    backend: str = "sqlite"  # "sqlite" — состояния переживают перезапуск, "memory" — как раньше
+    path: str = "fsm.db"
+    cache_size: int = 1024  # Сколько состояний держать в памяти
+    ttl: float = 86400  # Через сколько секунд без изменений незавершённый диалог сбрасывается
+    flush_interval: float = 1.0  # Как часто изменения пишутся в базу и проверяются изменения других реплик
 
-@lru_cache(maxsize=1)
-def parse_config_file() -> dict:
+class DeliveryConfig(BaseModel):
+    workers: int = 8  # Количество параллельных отправителей
+    global_rate: float = 30  # Сообщений в секунду на бота (лимит Telegram ~30/с)
+    chat_rate: float = 20 / 60  # Сообщений в секунду в один чат (лимит ~20/мин для групп)
+    chat_burst: int = 3  # Сколько сообщений подряд можно отправить в чат без ожидания
+    max_attempts: int = 5  # Попыток на сообщение, после чего задача попадает в список ошибок
+    retry_base_delay: float = 1  # Начальная задержка повтора (секунды), дальше удваивается
+    retry_max_delay: float = 300  # Максимальная задержка повтора
+    sender_failure_threshold: int = 3  # Ошибок подряд, после которых бот-отправитель выводится из ротации
+    sender_cooldown: float = 30  # На сколько секунд (удваивается при повторных ошибках)
+    eligibility_ttl: float = 3600  # Как долго помнить, какие боты могут писать в канал
+
+class CatchUpConfig(BaseModel):
+    policy: Literal["skip", "coalesce", "replay"] = "coalesce"  # Для задач без своего поля catch_up
+    grace: float = 300  # Опоздание (секунды), после которого срабатывание считается пропущенным
+    rate: float = 5  # Догоняющих отправок в секунду, чтобы после простоя не упереться в flood wait
+    max_replay: int = 100  # Для replay: сколько последних пропусков одной задачи повторять
+
+class JournalConfig(BaseModel):
+    enabled: bool = True  # Журнал отправок: после падения уже отправленное не уходит повторно
+    path: str = "deliveries.db"
+    keep_days: float = 7  # Сколько хранить записи о завершённых отправках
+
+class MediaConfig(BaseModel):
+    cache_path: str = "media_cache.json"  # Кэш file_id загруженных файлов по хешу содержимого
+
+class MetricsConfig(BaseModel):
+    enabled: bool = False  # HTTP-эндпоинт /metrics в формате Prometheus
+    host: str = "127.0.0.1"  # По умолчанию доступен только локально
+    port: int = 9100
+
+CONFIG_FILE = "config.yaml"
+
+def parse_config_file(path: str = CONFIG_FILE) -> dict:
     try:
-        with open("config.yaml", "rb") as file:
+        with open(path, "rb") as file:
             config_data = load(file, Loader=SafeLoader)
-        print("Loaded config:", config_data)  # Для отладки
+        if not isinstance(config_data, dict):
+            raise ValueError("config root must be a mapping")
         return config_data
     except FileNotFoundError:
         raise FileNotFoundError("config.yaml not found. Please ensure the config file is present.")
@@ -35,14 +118,13 @@ def validate_config_data(config_dict: dict, root_key: str, model: Type[ConfigTyp
     # Пропускаем валидацию ключей, если model — это list[Type]
     # Pydantic сам проверит структуру при вызове model_validate
     if model and not (hasattr(model, "__origin__") and model.__origin__ is list):
-        expected_keys = [key for key in model.__annotations__]
+        # Поля со значениями по умолчанию можно не указывать
+        expected_keys = [key for key, field in model.model_fields.items() if field.is_required()]
         for key in expected_keys:
             if key not in config_dict[root_key]:
                 raise ValueError(f"Missing key '{key}' in '{root_key}' configuration.")
 
-@lru_cache
-def get_config(model: Type[ConfigType], root_key: str) -> ConfigType:
-    config_dict = parse_config_file()
+def _validate_section(config_dict: dict, model: Type[ConfigType], root_key: str) -> ConfigType:
     validate_config_data(config_dict, root_key, model)
     
     # Специальная обработка для списков
@@ -51,4 +133,114 @@ def get_config(model: Type[ConfigType], root_key: str) -> ConfigType:
         item_model = model.__args__[0]
         return [item_model.model_validate(item) for item in config_dict[root_key]]
     else:
-        return model.model_validate(config_dict[root_key])
\ No newline at end of file
+        return model.model_validate(config_dict[root_key])
+
+class ConfigSnapshot:
+    """Неизменяемый снимок конфига с готовыми индексами.
+
+    Снимок целиком проверяется при создании, поэтому ошибка в config.yaml не
+    заменяет рабочий конфиг. Разобранные секции кэшируются внутри снимка.
+    """
+
+    def __init__(self, data: dict, version: int):
+        self.data = data
+        self.version = version
+        self._sections: Dict[Tuple, Any] = {}
+        # Обязательные секции проверяем сразу
+        self.bot: BotConfig = self.get(BotConfig, "bot")
+        self.channels: List[Channel] = self.get(list[Channel], "channels")
+        self.channels_by_id: Dict[str, Channel] = {channel.id: channel for channel in self.channels}
+        self.channel_groups: Dict[str, List[str]] = {}
+        if "channel_groups" in data:
+            for group in self.get(list[ChannelGroup], "channel_groups"):
+                # Имя попадает в callback_data кнопки (не больше 64 байт), поэтому только ASCII и не длиннее 40
+                if not re.fullmatch(r"[A-Za-z0-9_]{1,40}", group.name):
+                    raise ValueError(f"Invalid channel group name: {group.name!r} "
+                                     f"(use up to 40 Latin letters, digits and underscores)")
+                unknown = [channel_id for channel_id in group.channels if channel_id not in self.channels_by_id]
+                if unknown:
+                    raise ValueError(f"Channel group {group.name!r} refers to unknown channels: {unknown}")
+                self.channel_groups[group.name] = list(group.channels)
+        # Старый формат с одним "admin" поддерживается наравне со списком "admins"
+        self.admins: List[Admin] = []
+        if "admin" in data:
+            self.admins.append(self.get(Admin, "admin"))
+        if "admins" in data:
+            self.admins.extend(self.get(list[Admin], "admins"))
+        if not self.admins:
+            raise ValueError("No admins configured: add 'admins' to config.yaml")
+        # Роли по числовому ID пользователя: проверка апдейта — один поиск в словаре
+        self.admin_roles: Dict[int, str] = {int(admin.id): admin.role for admin in self.admins}
+        self.admin_ids: FrozenSet[int] = frozenset(self.admin_roles)
+
+    def get(self, model: Type[ConfigType], root_key: str) -> ConfigType:
+        key = (model, root_key)
+        if key not in self._sections:
+            self._sections[key] = _validate_section(self.data, model, root_key)
+        return self._sections[key]
+
+    def get_optional(self, model: Type[ConfigType], root_key: str) -> ConfigType:
+        """Необязательная секция конфига: если её нет, берём значения по умолчанию."""
+        if root_key not in self.data:
+            return model()
+        return self.get(model, root_key)
+
+_snapshot: Optional[ConfigSnapshot] = None
+_snapshot_stamp: Optional[Tuple[int, int]] = None
+_snapshot_lock = threading.Lock()
+
+def _file_stamp(path: str) -> Tuple[int, int]:
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+def reload_config(path: str = CONFIG_FILE) -> bool:
+    """Перечитываем config.yaml, если он изменился. True — подменили снимок.
+
+    При ошибке в файле оставляем последний рабочий снимок (при первой загрузке — падаем).
+    """
+    global _snapshot, _snapshot_stamp
+    with _snapshot_lock:
+        try:
+            stamp = _file_stamp(path)
+        except FileNotFoundError:
+            if _snapshot is None:
+                raise FileNotFoundError("config.yaml not found. Please ensure the config file is present.")
+            return False
+        if stamp == _snapshot_stamp:
+            return False
+        version = _snapshot.version + 1 if _snapshot else 1
+        try:
+            snapshot = ConfigSnapshot(parse_config_file(path), version)
+        except Exception as e:
+            if _snapshot is None:
+                raise ValueError(f"Invalid configuration: {e}")
+            logger.error(f"Config reload rejected, keeping version {_snapshot.version}: {e}")
+            _snapshot_stamp = stamp
+            return False
+        _snapshot, _snapshot_stamp = snapshot, stamp
+        # Секреты в лог не выводим
+        logger.info(f"Loaded config version {version}: {len(snapshot.channels)} channel(s), "
+                    f"{len(snapshot.admin_ids)} admin(s)")
+        return True
+
+def get_snapshot() -> ConfigSnapshot:
+    """Текущий снимок конфига (загружается при первом обращении)."""
+    if _snapshot is None:
+        reload_config()
+    return _snapshot
+
+async def watch_config(interval: float = 2.0, path: str = CONFIG_FILE):
+    """Фоновая задача: следим за mtime config.yaml и подменяем снимок без перезапуска."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(reload_config, path)
+        except Exception as e:
+            logger.error(f"Config watcher error: {e}")
+
+def get_config(model: Type[ConfigType], root_key: str) -> ConfigType:
+    return get_snapshot().get(model, root_key)
+
+def get_optional_config(model: Type[ConfigType], root_key: str) -> ConfigType:
+    """Необязательная секция конфига: если её нет, берём значения по умолчанию."""
+    return get_snapshot().get_optional(model, root_key)
@@ -0,0 +1,248 @@
+import asyncio
+import itertools
+import logging
+import random
+import time
+
+from typing import Dict, List, Optional, Set
+
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+from config import DeliveryConfig
+from metrics import (
+    delivery_failovers_total,
+    delivery_failures_total,
+    delivery_queue_depth,
+    delivery_retries_total,
+    delivery_sent_total,
+    send_seconds
+)
+from senders import is_access_error, Sender, SenderPool
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Token bucket: не больше rate отправок в секунду, с запасом на capacity подряд."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+
+    def reserve(self) -> float:
+        """Резервируем токен и возвращаем, сколько секунд ждать до его появления."""
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= 1
+        if self._tokens >= 0:
+            return 0.0
+        return -self._tokens / self.rate
+
+    def available(self) -> float:
+        """Сколько токенов есть сейчас (без резервирования)."""
+        return min(self.capacity, self._tokens + (time.monotonic() - self._updated) * self.rate)
+
+    async def acquire(self):
+        """Ждём, пока токен станет доступен."""
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class DeliveryFailed(Exception):
+    """Сообщение не удалось отправить за все попытки."""
+
+    def __init__(self, chat_id: str, attempts: int, error: Exception):
+        super().__init__(f"Delivery to {chat_id} failed after {attempts} attempt(s): {error}")
+        self.chat_id = chat_id
+        self.attempts = attempts
+        self.error = error
+
+
+# Классы приоритета очереди: меньше — раньше
+PRIORITY_INTERACTIVE = 0  # Отправки, которых ждёт админ (немедленные задачи)
+PRIORITY_SCHEDULED = 1  # Задачи по расписанию
+PRIORITY_BACKLOG = 2  # Догоняющие отправки после простоя
+
+
+class _Job:
+    __slots__ = ("chat_id", "method", "kwargs", "future", "chat_reserved", "attempts", "priority", "seq", "excluded")
+
+    def __init__(self, chat_id: str, method: str, kwargs: Dict, future: asyncio.Future, priority: int, seq: int):
+        self.chat_id = chat_id
+        self.method = method
+        self.kwargs = kwargs
+        self.future = future
+        self.chat_reserved = False
+        self.attempts = 0
+        self.priority = priority
+        # Порядок постановки: внутри одного класса приоритета очередь остаётся FIFO
+        self.seq = seq
+        # Боты пула, на которых задание уже упало в этом круге попыток
+        self.excluded: Set = set()
+
+    def __lt__(self, other: "_Job") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class Delivery:
+    """Пул отправителей: очередь с приоритетами, ограничение скорости на бота и на каждый чат.
+
+    Все отправки бота идут через одну очередь, поэтому лимиты Telegram общие, а сообщения
+    с более высоким приоритетом (PRIORITY_INTERACTIVE) обгоняют пачки задач по расписанию.
+    Если заданы дополнительные боты (senders), задания распределяются между ними через SenderPool.
+    """
+
+    def __init__(self, bot, config: Optional[DeliveryConfig] = None, senders: Optional[List] = None):
+        self.bot = bot
+        self.config = config or DeliveryConfig()
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+        # Основной бот и дополнительные боты-отправители; лимит global_rate — у каждого свой
+        self.pool = SenderPool([
+            Sender(sender_bot, TokenBucket(self.config.global_rate, self.config.global_rate),
+                   self.config.sender_failure_threshold, self.config.sender_cooldown)
+            for sender_bot in [bot, *(senders or [])]
+        ], self.config.eligibility_ttl)
+        self._chat_buckets: Dict[str, TokenBucket] = {}
+        self._workers: List[asyncio.Task] = []
+
+    def start(self):
+        """Запускаем воркеры."""
+        if self._workers:
+            return
+        delivery_queue_depth.set_function(lambda: self._queue.qsize())
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"delivery-worker-{i}")
+            for i in range(self.config.workers)
+        ]
+
+    async def stop(self):
+        """Останавливаем воркеры, неотправленные сообщения отменяются."""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        while not self._queue.empty():
+            job = self._queue.get_nowait()
+            if not job.future.done():
+                job.future.cancel()
+
+    def submit(self, chat_id: str, method: str = "send_message", priority: int = PRIORITY_SCHEDULED,
+               **kwargs) -> asyncio.Future:
+        """Ставим вызов метода бота в очередь, результат придёт во future."""
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(_Job(chat_id, method, kwargs, future, priority, next(self._seq)))
+        return future
+
+    async def send(self, chat_id: str, method: str = "send_message", priority: int = PRIORITY_SCHEDULED, **kwargs):
+        """Отправляем через очередь и ждём результата."""
+        return await self.submit(chat_id, method, priority, **kwargs)
+
+    @property
+    def queue_size(self) -> int:
+        return self._queue.qsize()
+
+    def _backoff(self, attempts: int) -> float:
+        """Экспоненциальная задержка со случайным разбросом, чтобы повторы не шли пачкой."""
+        delay = min(self.config.retry_max_delay, self.config.retry_base_delay * 2 ** (attempts - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _fail(self, job: _Job, error: Exception):
+        delivery_failures_total.inc()
+        if not job.future.done():
+            job.future.set_exception(DeliveryFailed(job.chat_id, job.attempts, error))
+
+    def _retry(self, job: _Job, delay: float, error: Exception, reason: str):
+        """Повторяем отправку через delay секунд, не занимая воркер; после max_attempts — ошибка."""
+        if job.attempts >= self.config.max_attempts:
+            self._fail(job, error)
+            return
+        delivery_retries_total.inc(reason)
+        logger.warning(f"Retrying delivery to {job.chat_id} in {delay:.1f}s "
+                       f"(attempt {job.attempts}/{self.config.max_attempts}): {error}")
+        job.chat_reserved = False
+        asyncio.get_running_loop().call_later(delay, self._queue.put_nowait, job)
+
+    async def _failover(self, job: _Job, sender: Optional[Sender], error: Exception, reason: str, delay: float):
+        """Повтор после ошибки бота: сразу через другого бота пула, если такой есть, иначе через delay."""
+        if sender is None:
+            self._retry(job, delay, error, reason)
+            return
+        job.excluded.add(sender)
+        if job.attempts < self.config.max_attempts and \
+                await self.pool.pick(job.chat_id, job.method, job.kwargs, job.excluded) is not None:
+            delivery_failovers_total.inc(reason)
+            delivery_retries_total.inc(reason)
+            logger.warning(f"Delivery to {job.chat_id} via bot {sender.name} failed, "
+                           f"switching to another sender: {error}")
+            self._queue.put_nowait(job)
+            return
+        job.excluded.clear()
+        self._retry(job, delay, error, reason)
+
+    def _chat_bucket(self, chat_id: str) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.config.chat_rate, self.config.chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            sender = None
+            try:
+                if job.future.done():
+                    continue
+                if not job.chat_reserved:
+                    job.chat_reserved = True
+                    delay = self._chat_bucket(job.chat_id).reserve()
+                    if delay > 0:
+                        # Не держим воркер ради одного чата — вернём задание в очередь позже
+                        loop.call_later(delay, self._queue.put_nowait, job)
+                        continue
+                sender = await self.pool.pick(job.chat_id, job.method, job.kwargs, job.excluded)
+                if sender is None:
+                    # Все подходящие боты уже пробовали это задание — начинаем круг заново
+                    job.excluded.clear()
+                    sender = await self.pool.pick(job.chat_id, job.method, job.kwargs, job.excluded)
+                await sender.bucket.acquire()
+                job.attempts += 1
+                started = time.monotonic()
+                try:
+                    result = await getattr(sender.bot, job.method)(chat_id=job.chat_id, **job.kwargs)
+                finally:
+                    send_seconds.observe(time.monotonic() - started, job.chat_id)
+                sender.record_success()
+                delivery_sent_total.inc()
+                if not job.future.done():
+                    job.future.set_result(result)
+            except asyncio.CancelledError:
+                if not job.future.done():
+                    job.future.cancel()
+                raise
+            except TelegramRetryAfter as e:
+                # Flood wait: другой бот пула отправит сразу, иначе ждём ровно названное сервером время
+                await self._failover(job, sender, e, "flood_wait", e.retry_after)
+            except (TelegramNetworkError, TelegramServerError, asyncio.TimeoutError) as e:
+                if sender is not None:
+                    sender.record_failure()
+                await self._failover(job, sender, e, "network", self._backoff(job.attempts))
+            except Exception as e:
+                if sender is not None and is_access_error(e) and len(self.pool) > 1:
+                    # У этого бота нет прав в чате — пробуем другого, если он есть
+                    self.pool.revoke(sender, job.chat_id)
+                    job.excluded.add(sender)
+                    if await self.pool.pick(job.chat_id, job.method, job.kwargs, job.excluded) is not None:
+                        delivery_failovers_total.inc("access")
+                        self._queue.put_nowait(job)
+                        continue
+                # Остальные ошибки (нет прав, чат не найден и т.п.) повторять бессмысленно
+                self._fail(job, e)
+            finally:
+                self._queue.task_done()
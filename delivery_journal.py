@@ -0,0 +1,104 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def occurrence_key(task_id: int, occurrence: Optional[float]) -> str:
+    """Ключ идемпотентности срабатывания: ID задачи и запланированное время.
+
+    У разовых задач срабатывание одно, поэтому время в ключ не входит: после повтора
+    из списка ошибок сообщение уходит только в те чаты, куда ещё не ушло.
+    """
+    return f"{task_id}:once" if occurrence is None else f"{task_id}:{occurrence:.0f}"
+
+
+def task_id_of(key: str) -> int:
+    return int(key.split(":", 1)[0])
+
+
+class DeliveryJournal:
+    """Журнал отправок в SQLite для защиты от повторов после падения.
+
+    Перед тем как отметить задачу выполненной, планировщик записывает в журнал ключ
+    срабатывания, чат и ID сообщений Telegram. После перезапуска отправки, которые есть
+    в журнале, не повторяются, а незавершённые срабатывания доводятся до конца (reconcile).
+    Записи с completed = 1 нужны только как история и удаляются через keep_days.
+
+    Методы синхронные (коммит на диск): из цикла событий их вызывают через asyncio.to_thread.
+    """
+
+    def __init__(self, path: str, keep_days: float = 7):
+        self.path = path
+        self.keep_days = keep_days
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # В режиме WAL с NORMAL коммит без fsync переживает падение процесса (от этого журнал и
+        # защищает), теряется только при отключении питания
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS deliveries (
+                    key TEXT NOT NULL,
+                    chat_id TEXT NOT NULL,
+                    message_ids TEXT NOT NULL,
+                    sent_at REAL NOT NULL,
+                    completed INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (key, chat_id)
+                );
+                CREATE INDEX IF NOT EXISTS idx_deliveries_completed ON deliveries (completed, sent_at);
+            """)
+
+    def sent(self, key: str) -> Dict[str, List[int]]:
+        """Чаты, куда срабатывание уже отправлено, и ID сообщений в них."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chat_id, message_ids FROM deliveries WHERE key = ?", (key,)
+            ).fetchall()
+        return {chat_id: json.loads(message_ids) for chat_id, message_ids in rows}
+
+    def record(self, key: str, chat_id: str, message_ids: List[int]):
+        """Записываем отправку сразу после ответа Telegram (с коммитом)."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO deliveries (key, chat_id, message_ids, sent_at) VALUES (?, ?, ?, ?)",
+                (key, chat_id, json.dumps(message_ids), time.time())
+            )
+
+    def complete(self, keys: List[str]):
+        """Статусы задач сохранены — срабатывания завершены (одним коммитом)."""
+        with self._lock, self._conn:
+            self._conn.executemany("UPDATE deliveries SET completed = 1 WHERE key = ?", [(key,) for key in keys])
+
+    def incomplete(self) -> Dict[str, Dict[str, List[int]]]:
+        """Срабатывания, для которых отправка записана, а статус задачи — ещё нет."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, chat_id, message_ids FROM deliveries WHERE completed = 0"
+            ).fetchall()
+        result: Dict[str, Dict[str, List[int]]] = defaultdict(dict)
+        for key, chat_id, message_ids in rows:
+            result[key][chat_id] = json.loads(message_ids)
+        return dict(result)
+
+    def prune(self) -> int:
+        """Удаляем завершённые записи старше keep_days."""
+        cutoff = time.time() - self.keep_days * 86400
+        with self._lock, self._conn:
+            deleted = self._conn.execute(
+                "DELETE FROM deliveries WHERE completed = 1 AND sent_at < ?", (cutoff,)
+            ).rowcount
+        if deleted:
+            logger.info(f"Pruned {deleted} old delivery journal records")
+        return deleted
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
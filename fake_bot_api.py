@@ -0,0 +1,223 @@
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+
+from typing import Any, Dict, List, Optional, Set
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Методы отправки вложений: send<тип>
+MEDIA_METHODS = ("photo", "video", "document", "animation", "audio")
+
+BOT_USER = {"id": 1000000, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+
+
+class FakeBotAPI:
+    """Локальная замена Bot API для нагрузочных тестов.
+
+    Принимает запросы вида /bot<token>/<method>, отвечает в формате Telegram и умеет
+    имитировать задержку, flood wait (429) и ошибки сервера (500). Все успешные
+    отправки сохраняются в sent.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, flood_rate: float = 0.0,
+                 retry_after: int = 1, error_rate: float = 0.0, seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._message_id = 0
+        self._file_id = 0
+        # Админы каналов для пула ботов: chat_id -> ID ботов; каналы не из словаря разрешены всем
+        self.chat_admins: Dict[str, Set[int]] = {}
+        self.sent: List[Dict[str, Any]] = []
+        self.requests = 0
+        self.floods = 0
+        self.errors = 0
+
+    def reset(self):
+        self.sent.clear()
+        self.requests = self.floods = self.errors = 0
+
+    @staticmethod
+    async def _read_params(request: web.Request) -> Dict[str, Any]:
+        if request.content_type == "application/json":
+            return await request.json()
+        params = {}
+        for key, value in (await request.post()).items():
+            if isinstance(value, str):
+                # aiogram кодирует вложенные объекты в JSON-строки
+                try:
+                    value = json.loads(value) if value[:1] in "{[" else value
+                except ValueError:
+                    pass
+                params[key] = value
+            else:
+                # Загруженный файл
+                params[key] = {"filename": value.filename}
+        return params
+
+    def _message(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        self._message_id += 1
+        chat_id = params.get("chat_id", 0)
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            pass
+        message = {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "channel" if str(chat_id).startswith("-100") else "private"},
+        }
+        if "text" in params:
+            message["text"] = params["text"]
+        if params.get("caption"):
+            message["caption"] = params["caption"]
+        return message
+
+    def _media(self, media_type: str, value: Any) -> Any:
+        """Описание файла в ответе: загруженный файл получает новый file_id, отправка по file_id его сохраняет."""
+        if not isinstance(value, str) or value.startswith("attach://"):
+            self._file_id += 1
+            value = f"fake-file-{self._file_id}"
+        item = {"file_id": value, "file_unique_id": value}
+        if media_type == "photo":
+            return [{**item, "width": 1, "height": 1}]
+        if media_type in ("video", "animation"):
+            item.update(width=1, height=1, duration=1)
+        elif media_type == "audio":
+            item.update(duration=1)
+        return item
+
+    def _chat_member(self, bot_id: int, params: Dict[str, Any]) -> Dict[str, Any]:
+        user = {**BOT_USER, "id": bot_id}
+        if not self._is_admin(bot_id, params.get("chat_id")):
+            return {"status": "left", "user": user}
+        rights = ("can_be_edited", "is_anonymous", "can_manage_chat", "can_delete_messages", "can_manage_video_chats",
+                  "can_restrict_members", "can_promote_members", "can_change_info", "can_invite_users",
+                  "can_post_stories", "can_edit_stories", "can_delete_stories", "can_send_welcome_messages")
+        return {"status": "administrator", "user": user, "can_post_messages": True,
+                **{right: False for right in rights}}
+
+    def _is_admin(self, bot_id: int, chat_id: Any) -> bool:
+        admins = self.chat_admins.get(str(chat_id))
+        return admins is None or bot_id in admins
+
+    def _result(self, method: str, params: Dict[str, Any], bot_id: int) -> Any:
+        if method == "getme":
+            return {**BOT_USER, "id": bot_id}
+        if method == "getchatmember":
+            return self._chat_member(bot_id, params)
+        if method in ("sendmessage", "editmessagetext") or method[4:] in MEDIA_METHODS:
+            message = self._message(params)
+            media_type = method[4:]
+            if media_type in MEDIA_METHODS:
+                message[media_type] = self._media(media_type, params.get(media_type))
+            if method != "editmessagetext":
+                self.sent.append({"method": method, "bot_id": bot_id, "chat_id": params.get("chat_id"),
+                                  "message_id": message["message_id"], "at": time.time()})
+            return message
+        if method == "sendmediagroup":
+            messages = []
+            for item in params.get("media", []):
+                message = self._message(params)
+                message[item["type"]] = self._media(item["type"], item.get("media"))
+                self.sent.append({"method": method, "bot_id": bot_id, "chat_id": params.get("chat_id"),
+                                  "message_id": message["message_id"], "at": time.time()})
+                messages.append(message)
+            return messages
+        if method == "copymessages":
+            copies = []
+            for _ in params.get("message_ids", []):
+                self._message_id += 1
+                self.sent.append({"method": method, "bot_id": bot_id, "chat_id": params.get("chat_id"),
+                                  "message_id": self._message_id, "at": time.time()})
+                copies.append({"message_id": self._message_id})
+            return copies
+        if method == "copymessage":
+            self._message_id += 1
+            self.sent.append({"method": method, "bot_id": bot_id, "chat_id": params.get("chat_id"),
+                              "message_id": self._message_id, "at": time.time()})
+            return {"message_id": self._message_id}
+        # answerCallbackQuery, setWebhook, deleteWebhook и т.п.
+        return True
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        method = request.match_info["method"].lower()
+        params = await self._read_params(request)
+
+        delay = self.latency + (self._random.uniform(-self.jitter, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        roll = self._random.random()
+        if roll < self.flood_rate:
+            self.floods += 1
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }, status=429)
+        if roll < self.flood_rate + self.error_rate:
+            self.errors += 1
+            return web.json_response({"ok": False, "error_code": 500, "description": "Internal Server Error"},
+                                     status=500)
+        bot_id = int(request.match_info["token"].split(":", 1)[0] or 0)
+        if method.startswith(("send", "copy")) and not self._is_admin(bot_id, params.get("chat_id")):
+            return web.json_response({"ok": False, "error_code": 403,
+                                      "description": "Forbidden: bot is not a member of the channel chat"},
+                                     status=403)
+        return web.json_response({"ok": True, "result": self._result(method, params, bot_id)})
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        app.router.add_get("/bot{token}/{method}", self.handle)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> "FakeBotAPIServer":
+        """Запускаем сервер; port=0 — свободный порт."""
+        runner = web.AppRunner(self.make_app())
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        # При port=0 порт выбирает система; узнаём его через публичный runner.addresses
+        actual_port = runner.addresses[0][1]
+        return FakeBotAPIServer(runner, f"http://{host}:{actual_port}")
+
+
+class FakeBotAPIServer:
+    def __init__(self, runner: web.AppRunner, base_url: str):
+        self.runner = runner
+        self.base_url = base_url
+
+    async def close(self):
+        await self.runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local fake Telegram Bot API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="Response delay, seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- added to the delay, seconds")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="Share of requests answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after in 429 responses, seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 500")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    api = FakeBotAPI(args.latency, args.jitter, args.flood_rate, args.retry_after, args.error_rate)
+    logger.info(f"Fake Bot API on http://{args.host}:{args.port} (set bot.api_url in config.yaml to use it)")
+    web.run_app(api.make_app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
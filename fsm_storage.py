@@ -0,0 +1,196 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    __slots__ = ("state", "data", "updated_at")
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any], updated_at: float):
+        self.state = state
+        self.data = data
+        self.updated_at = updated_at
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище в SQLite с LRU-кэшем в памяти.
+
+    Чтения обслуживаются из кэша, изменения пишутся в базу фоновой задачей раз в
+    flush_interval секунд. Состояния, которые не менялись дольше ttl, считаются пустыми
+    и удаляются. Раз в flush_interval секунд фоновая задача проверяет, не менял ли базу
+    другой процесс, и если менял — сбрасывает кэш. К базе обращаемся только из потоков
+    (asyncio.to_thread), цикл событий на чтении с диска не блокируется.
+    """
+
+    def __init__(self, path: str, cache_size: int = 1024, ttl: float = 86400, flush_interval: float = 1.0):
+        self.path = path
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._cache: "OrderedDict[str, _Entry]" = OrderedDict()
+        # Изменения, ещё не записанные в базу (не вытесняются из памяти до записи)
+        self._dirty: Dict[str, _Entry] = {}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS fsm (
+                    key TEXT PRIMARY KEY,
+                    state TEXT,
+                    data TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_fsm_updated_at ON fsm (updated_at);
+            """)
+        self._data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        self._flusher: Optional[asyncio.Task] = None
+        self._watcher: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ":".join(str(part) for part in (
+            key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny
+        ))
+
+    def _read_data_version(self) -> int:
+        with self._lock:
+            return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    async def _watch_external_changes(self):
+        """Сбрасываем кэш, если в базу писал другой процесс (реплика бота)."""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                data_version = await asyncio.to_thread(self._read_data_version)
+            except Exception as e:
+                logger.error(f"Failed to check FSM storage for external changes: {e}")
+                continue
+            if data_version != self._data_version:
+                self._data_version = data_version
+                self._cache.clear()
+
+    def _ensure_watcher(self):
+        if self._watcher is None or self._watcher.done():
+            self._watcher = asyncio.create_task(self._watch_external_changes())
+
+    def _select(self, key: str) -> Optional[Tuple[Optional[str], str, float]]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT state, data, updated_at FROM fsm WHERE key = ?", (key,)
+            ).fetchone()
+
+    def _cached(self, key: str) -> Optional[_Entry]:
+        entry = self._dirty.get(key)
+        if entry is None:
+            entry = self._cache.get(key)
+        return entry
+
+    async def _load(self, key: str) -> _Entry:
+        entry = self._cached(key)
+        if entry is None:
+            row = await asyncio.to_thread(self._select, key)
+            # Пока шло чтение, состояние могли загрузить или изменить другие апдейты — их версия новее
+            entry = self._cached(key)
+            if entry is None and row is None:
+                entry = _Entry(None, {}, time.time())
+            elif entry is None:
+                entry = _Entry(row[0], json.loads(row[1]), row[2])
+        if time.time() - entry.updated_at > self.ttl:
+            entry = _Entry(None, {}, time.time())
+        self._remember(key, entry)
+        return entry
+
+    def _remember(self, key: str, entry: _Entry):
+        self._cache[key] = entry
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _get(self, key: StorageKey) -> Tuple[str, _Entry]:
+        self._ensure_watcher()
+        str_key = self._key(key)
+        return str_key, await self._load(str_key)
+
+    def _mark_dirty(self, key: str, entry: _Entry):
+        entry.updated_at = time.time()
+        self._dirty[key] = entry
+        self._remember(key, entry)
+        self._ensure_flusher()
+
+    def _ensure_flusher(self):
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self):
+        """Записываем накопленные изменения в базу и удаляем устаревшие состояния."""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        try:
+            await asyncio.to_thread(self._write, dirty)
+        except Exception as e:
+            logger.error(f"Failed to flush FSM storage: {e}")
+            # Не теряем изменения: вернём их, если за это время не появились более новые
+            for key, entry in dirty.items():
+                self._dirty.setdefault(key, entry)
+            self._ensure_flusher()
+
+    def _write(self, dirty: Dict[str, _Entry]):
+        upserts = []
+        deletes = []
+        for key, entry in dirty.items():
+            if entry.state is None and not entry.data:
+                deletes.append((key,))
+            else:
+                upserts.append((key, entry.state, json.dumps(entry.data, ensure_ascii=False), entry.updated_at))
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM fsm WHERE key = ?", deletes)
+            self._conn.executemany(
+                "INSERT INTO fsm (key, state, data, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data, "
+                "updated_at = excluded.updated_at",
+                upserts
+            )
+            self._conn.execute("DELETE FROM fsm WHERE updated_at < ?", (time.time() - self.ttl,))
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        str_key, entry = await self._get(key)
+        entry.state = state.state if isinstance(state, State) else state
+        self._mark_dirty(str_key, entry)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._get(key))[1].state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        str_key, entry = await self._get(key)
+        entry.data = dict(data)
+        self._mark_dirty(str_key, entry)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return dict((await self._get(key))[1].data)
+
+    async def close(self) -> None:
+        if self._watcher is not None:
+            self._watcher.cancel()
+        if self._flusher is not None and not self._flusher.done():
+            self._flusher.cancel()
+        await self.flush()
+        with self._lock:
+            self._conn.close()
@@ -1,23 +1,35 @@
+import asyncio
 import logging
 
-from aiogram import Router, F
+from aiogram import Router
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.filters import Command
 from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
 
-from config import get_config, Channel, Admin
-from utils import add_task, edit_task, delete_task, load_tasks
+from callbacks import (
+    CallbackRouter, Back, Noop, StartMenu, ScheduleTypePick, DateShift, DateConfirm, TimeShift, TimeConfirm,
+    ChannelPick, GroupPick, TasksPage, TasksChannelFilter, TaskOpen, TaskEdit, TaskDelete, EditMessage, EditTime,
+    FailedOpen, TaskRequeue
+)
+from broadcast import group_target
+from config import get_snapshot
+from media import MAX_ALBUM_SIZE, media_from_message
+from metrics import format_stats
+from utils import add_task_async, edit_task, delete_task, get_synced_repository, get_task, requeue_task
 from keyboards import (
     get_schedule_type_keyboard,
     get_channel_keyboard,
     get_task_management_keyboard,
+    get_task_channel_filter_keyboard,
     get_task_action_keyboard,
     get_date_keyboard,
     get_time_keyboard,
     get_edit_action_keyboard,
     get_start_keyboard,
+    get_failed_task_action_keyboard,
     back_keyboard
 )
 
@@ -29,6 +41,14 @@ logging.basicConfig(
            '[%(asctime)s] - %(name)s - %(message)s')
 
 main_router = Router()
+# Все инлайн-кнопки разбираются один раз и направляются в обработчик по словарю
+callback_router = CallbackRouter()
+main_router.callback_query.register(callback_router.dispatch)
+
+# Сообщения альбомов, которые ещё собираются: media_group_id -> [(message_id, вложение, подпись)]
+_albums: Dict[str, List[Tuple[int, Dict, Optional[str]]]] = {}
+# Сколько ждать остальные сообщения альбома после первого (секунды)
+ALBUM_WAIT = 0.5
 
 # Определяем состояния для создания и редактирования задачи
 class CreateTask(StatesGroup):
@@ -42,68 +62,98 @@ class CreateTask(StatesGroup):
     edit_date = State()  # Для редактирования даты
     edit_time = State()  # Для редактирования времени
 
-# Проверка, что пользователь — админ, и стартовое сообщение
+def _time_of(minutes: int) -> datetime:
+    """Время суток из минут от полуночи (с переходом через полночь)."""
+    return datetime(2000, 1, 1) + timedelta(minutes=minutes % (24 * 60))
+
+# Стартовое сообщение (посторонних отсекает AdminMiddleware)
 @main_router.message(Command("start"))
 async def cmd_start(message: Message):
-    admin_config = get_config(Admin, "admin")
-    if str(message.from_user.id) != admin_config.id:
-        await message.answer("Вы не администратор!")
-        return
     await message.answer(
         "Привет! Я бот для управления каналами. Что хочешь сделать?",
         reply_markup=get_start_keyboard()
     )
 
-# Проверка, что пользователь — админ, и стартовое сообщение
-@main_router.callback_query(F.data == 'back')
-async def cmd_start(callback: CallbackQuery):
-    admin_config = get_config(Admin, "admin")
-    if str(callback.from_user.id) != admin_config.id:
-        await callback.message.edit_text("Вы не администратор!")
-        return
+# Сводка метрик планировщика и отправки
+@main_router.message(Command("stats"))
+async def cmd_stats(message: Message):
+    await message.answer(format_stats(), parse_mode=None)
+
+# Возврат к стартовому сообщению
+@callback_router.route(Back, readonly=True)
+async def process_back(callback: CallbackQuery):
     await callback.message.edit_text(
         "Привет! Я бот для управления каналами. Что хочешь сделать?",
         reply_markup=get_start_keyboard()
     )
 
+@callback_router.route(Noop, readonly=True)
+async def process_noop(callback: CallbackQuery):
+    await callback.answer()
+
 # Обработка кнопок стартового меню
-@main_router.callback_query(F.data.in_(["start_create", "start_manage"]))
-async def process_start_action(callback: CallbackQuery, state: FSMContext):
-    action = callback.data
-    admin_config = get_config(Admin, "admin")
-    if str(callback.from_user.id) != admin_config.id:
-        await callback.message.edit_text("Вы не администратор!")
-        await callback.answer()
+@callback_router.route(StartMenu, readonly=True)
+async def process_start_action(callback: CallbackQuery, cb: StartMenu, state: FSMContext, admin_role: str):
+    if cb.action == "create" and admin_role != "admin":
+        await callback.answer("Недостаточно прав")
         return
 
-    if action == "start_create":
+    if cb.action == "create":
         await callback.message.edit_text("Введите текст сообщения:", reply_markup=back_keyboard())
         await state.set_state(CreateTask.message)
-    elif action == "start_manage":
-        tasks = load_tasks()
-        if not tasks:
+    elif cb.action == "manage":
+        markup = get_task_management_keyboard(get_synced_repository())
+        if markup is None:
             await callback.message.edit_text("Нет активных задач!", reply_markup=back_keyboard())
         else:
-            await callback.message.edit_text("Выберите задачу для управления:", reply_markup=get_task_management_keyboard(tasks))
-    
+            await callback.message.edit_text("Выберите задачу для управления:", reply_markup=markup)
+    elif cb.action == "failed":
+        markup = get_task_management_keyboard(get_synced_repository(), status="failed")
+        if markup is None:
+            await callback.message.edit_text("Ошибок отправки нет!", reply_markup=back_keyboard())
+        else:
+            await callback.message.edit_text("Задачи, которые не удалось отправить:", reply_markup=markup)
+
     await callback.answer()
 
 @main_router.message(CreateTask.message)
 async def process_message(message: Message, state: FSMContext):
-    await state.update_data(message=message.text)
+    item = media_from_message(message)
+    if item is not None and message.media_group_id is not None:
+        # Альбом приходит отдельными сообщениями: собираем их и продолжаем по первому
+        album = _albums.get(message.media_group_id)
+        if album is not None:
+            album.append((message.message_id, item, message.caption))
+            return
+        album = _albums[message.media_group_id] = [(message.message_id, item, message.caption)]
+        await asyncio.sleep(ALBUM_WAIT)
+        del _albums[message.media_group_id]
+        album.sort(key=lambda entry: entry[0])
+        media = [entry[1] for entry in album[:MAX_ALBUM_SIZE]]
+        text = next((entry[2] for entry in album if entry[2]), "")
+    elif item is not None:
+        media = [item]
+        text = message.caption or ""
+    elif message.text:
+        media = None
+        text = message.text
+    else:
+        await message.answer("Отправьте текст, фото, видео, документ или альбом:")
+        return
+
+    await state.update_data(message=text, media=media)
     await message.answer("Выберите тип отправки:", reply_markup=get_schedule_type_keyboard())
     await state.set_state(CreateTask.schedule_type)
 
 
-@main_router.callback_query(CreateTask.schedule_type, F.data.startswith("schedule_"))
-async def process_schedule_type(callback: CallbackQuery, state: FSMContext):
-    schedule_type = callback.data.split("_")[1]  # "immediate", "delayed", "daily"
+@callback_router.route(ScheduleTypePick, CreateTask.schedule_type)
+async def process_schedule_type(callback: CallbackQuery, cb: ScheduleTypePick, state: FSMContext):
+    schedule_type = cb.schedule_type  # "immediate", "delayed", "daily"
     await state.update_data(schedule_type=schedule_type)
-    
+
     if schedule_type == "immediate":
         await state.update_data(schedule_time=None)
-        channels = get_config(list[Channel], "channels")
-        await callback.message.edit_text("Выберите канал:", reply_markup=get_channel_keyboard(channels))
+        await callback.message.edit_text("Выберите канал:", reply_markup=get_channel_keyboard(get_snapshot().channels, get_snapshot().channel_groups))
         await state.set_state(CreateTask.channel)
     elif schedule_type == "delayed":
         await callback.message.edit_text("Выберите дату:", reply_markup=get_date_keyboard())
@@ -114,174 +164,177 @@ async def process_schedule_type(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 
-# Обработка выбора даты (используется только для delayed)
-@main_router.callback_query(CreateTask.schedule_date, F.data.regexp(r"^(date_prev_day_|date_next_day_)\d{4}-\d{2}-\d{2}$"))
-async def process_date_selection(callback: CallbackQuery, state: FSMContext):
-    action = callback.data
-    if action.startswith("date_prev_day_"):
-        current_date_str = action.split("_")[-1]
-        current_date = datetime.strptime(current_date_str, "%Y-%m-%d")
-        new_date = current_date - timedelta(days=1)
-        await callback.message.edit_text("Выберите дату:", reply_markup=get_date_keyboard(new_date))
-    
-    elif action.startswith("date_next_day_"):
-        current_date_str = action.split("_")[-1]
-        current_date = datetime.strptime(current_date_str, "%Y-%m-%d")
-        new_date = current_date + timedelta(days=1)
-        await callback.message.edit_text("Выберите дату:", reply_markup=get_date_keyboard(new_date))
-    
+# Переключение дней (при создании delayed-задачи и при редактировании даты)
+@callback_router.route(DateShift, CreateTask.schedule_date, CreateTask.edit_date)
+async def process_date_selection(callback: CallbackQuery, cb: DateShift):
+    new_date = datetime.combine(cb.day, datetime.min.time()) + timedelta(days=cb.delta)
+    await callback.message.edit_text("Выберите дату:", reply_markup=get_date_keyboard(new_date))
     await callback.answer()
 
 
-# Обработка выбора времени
-@main_router.callback_query(CreateTask.schedule_time, F.data.regexp(r"^(time_prev_hour_|time_next_hour_|time_prev_min_|time_next_min_)\d{2}:\d{2}$"))
-async def process_time_selection(callback: CallbackQuery, state: FSMContext):
-    action = callback.data
-    if action.startswith("time_prev_hour_"):
-        current_time_str = action.split("_")[-1]
-        current_time = datetime.strptime(current_time_str, "%H:%M")
-        new_time = current_time - timedelta(hours=1)
-        await callback.message.edit_text("Выберите время:", reply_markup=get_time_keyboard(new_time))
-    
-    elif action.startswith("time_next_hour_"):
-        current_time_str = action.split("_")[-1]
-        current_time = datetime.strptime(current_time_str, "%H:%M")
-        new_time = current_time + timedelta(hours=1)
-        await callback.message.edit_text("Выберите время:", reply_markup=get_time_keyboard(new_time))
-    
-    elif action.startswith("time_prev_min_"):
-        current_time_str = action.split("_")[-1]
-        current_time = datetime.strptime(current_time_str, "%H:%M")
-        new_time = current_time - timedelta(minutes=5)  # Шаг 5 минут
-        await callback.message.edit_text("Выберите время:", reply_markup=get_time_keyboard(new_time))
-    
-    elif action.startswith("time_next_min_"):
-        current_time_str = action.split("_")[-1]
-        current_time = datetime.strptime(current_time_str, "%H:%M")
-        new_time = current_time + timedelta(minutes=5)  # Шаг 5 минут
-        await callback.message.edit_text("Выберите время:", reply_markup=get_time_keyboard(new_time))
-    
+# Переключение часов и минут (при создании и при редактировании времени)
+@callback_router.route(TimeShift, CreateTask.schedule_time, CreateTask.edit_time)
+async def process_time_selection(callback: CallbackQuery, cb: TimeShift):
+    new_time = _time_of(cb.minutes + cb.delta)
+    await callback.message.edit_text("Выберите время:", reply_markup=get_time_keyboard(new_time))
     await callback.answer()
 
 # Обработка выбора канала
-@main_router.callback_query(CreateTask.channel, F.data.startswith("channel_"))
-async def process_channel(callback: CallbackQuery, state: FSMContext):
-    channel_id = callback.data.split("_")[1]
-    channels = get_config(list[Channel], "channels")
-    selected_channel = next((ch for ch in channels if ch.id == channel_id), None)
-    
+@callback_router.route(ChannelPick, CreateTask.channel)
+async def process_channel(callback: CallbackQuery, cb: ChannelPick, state: FSMContext):
+    snapshot = get_snapshot()
+    selected_channel = snapshot.channels_by_id.get(cb.channel_id)
+
     if not selected_channel:
-        await callback.message.edit_text("Канал не найден! Попробуйте снова:", reply_markup=get_channel_keyboard(channels))
+        await callback.message.edit_text("Канал не найден! Попробуйте снова:", reply_markup=get_channel_keyboard(snapshot.channels, snapshot.channel_groups))
         await callback.answer()
         return
 
     data = await state.get_data()
     schedule_type = data["schedule_type"]
-    
+
+    # Отправку не ждём: задача уходит в планировщик, immediate — с наивысшим приоритетом в очереди
+    task_id = await add_task_async(
+        message=data["message"],
+        channel_id=selected_channel.id,
+        schedule_type=schedule_type,
+        schedule_time=data["schedule_time"],
+        media=data.get("media")
+    )
     if schedule_type == "immediate":
-        # Для immediate отправляем сообщение сразу
-        bot = callback.bot  # Получаем объект Bot из callback
-        await bot.send_message(chat_id=selected_channel.id, text=data["message"])
-        await callback.message.edit_text("Сообщение отправлено сразу!", reply_markup=back_keyboard())
+        await callback.message.edit_text(f"#{task_id} поставлена в очередь на отправку!", reply_markup=back_keyboard())
     else:
-        # Для delayed и daily создаём задачу
-        task_id = add_task(
-            message=data["message"],
-            channel_id=selected_channel.id,
-            schedule_type=schedule_type,
-            schedule_time=data["schedule_time"]
-        )
         await callback.message.edit_text(f"#{task_id} создана!", reply_markup=back_keyboard())
-    
+
+    await state.clear()
+    await callback.answer()
+
+# Рассылка в группу каналов из config.yaml: одна задача на все каналы группы
+@callback_router.route(GroupPick, CreateTask.channel)
+async def process_group(callback: CallbackQuery, cb: GroupPick, state: FSMContext):
+    snapshot = get_snapshot()
+    channel_ids = snapshot.channel_groups.get(cb.name)
+
+    if not channel_ids:
+        await callback.message.edit_text("Группа не найдена! Попробуйте снова:", reply_markup=get_channel_keyboard(snapshot.channels, snapshot.channel_groups))
+        await callback.answer()
+        return
+
+    data = await state.get_data()
+    task_id = await add_task_async(
+        message=data["message"],
+        channel_id=channel_ids[0],
+        schedule_type=data["schedule_type"],
+        schedule_time=data["schedule_time"],
+        targets=[group_target(cb.name)],
+        media=data.get("media")
+    )
+    await callback.message.edit_text(f"#{task_id} создана: рассылка в {len(channel_ids)} каналов группы {cb.name}!", reply_markup=back_keyboard())
     await state.clear()
     await callback.answer()
 
 # Обработка подтверждения даты (используется только для delayed)
-@main_router.callback_query(CreateTask.schedule_date, F.data.regexp(r"^confirm_date_\d{4}-\d{2}-\d{2}$"))
-async def process_confirm_date(callback: CallbackQuery, state: FSMContext):
-    selected_date_str = callback.data.split("_")[-1]
-    await state.update_data(schedule_date=selected_date_str)
+@callback_router.route(DateConfirm, CreateTask.schedule_date)
+async def process_confirm_date(callback: CallbackQuery, cb: DateConfirm, state: FSMContext):
+    await state.update_data(schedule_date=cb.day.isoformat())
     await callback.message.edit_text("Выберите время:", reply_markup=get_time_keyboard())
     await state.set_state(CreateTask.schedule_time)
     await callback.answer()
 
 # Обработка подтверждения времени
-@main_router.callback_query(CreateTask.schedule_time, F.data.regexp(r"^confirm_time_\d{2}:\d{2}$"))
-async def process_confirm_time(callback: CallbackQuery, state: FSMContext):
-    selected_time_str = callback.data.split("_")[-1]
+@callback_router.route(TimeConfirm, CreateTask.schedule_time)
+async def process_confirm_time(callback: CallbackQuery, cb: TimeConfirm, state: FSMContext):
+    selected_time_str = _time_of(cb.minutes).strftime("%H:%M")
     data = await state.get_data()
     schedule_type = data["schedule_type"]
-    
+
     if schedule_type == "daily":
         # Для daily сохраняем только время
         full_datetime = f"{selected_time_str}:00"
     else:  # Для delayed добавляем дату
         selected_date = data["schedule_date"]
         full_datetime = f"{selected_date} {selected_time_str}:00"
-    
+
     await state.update_data(schedule_time=full_datetime)
-    channels = get_config(list[Channel], "channels")
-    await callback.message.edit_text("Выберите канал:", reply_markup=get_channel_keyboard(channels))
+    await callback.message.edit_text("Выберите канал:", reply_markup=get_channel_keyboard(get_snapshot().channels, get_snapshot().channel_groups))
     await state.set_state(CreateTask.channel)
     await callback.answer()
 
-@main_router.callback_query(F.data.startswith("task_"))
-async def process_task_selection(callback: CallbackQuery):
-    logger.info(callback.data.split("_"))
-    task_id = int(callback.data.split("_")[1])
-    await callback.message.edit_text("Выберите действие:", reply_markup=get_task_action_keyboard(task_id))
+# Страницы списка задач с фильтрами по статусу и каналу
+@callback_router.route(TasksPage, readonly=True)
+async def process_tasks_page(callback: CallbackQuery, cb: TasksPage):
+    repository = get_synced_repository()
+    markup = get_task_management_keyboard(repository, cb.status, cb.channel_id, cb.direction, cb.cursor)
+    if markup is None:
+        await callback.message.edit_text("Задач с таким фильтром нет!", reply_markup=get_task_management_keyboard(repository) or back_keyboard())
+    else:
+        await callback.message.edit_text("Выберите задачу для управления:", reply_markup=markup)
+    await callback.answer()
+
+@callback_router.route(TasksChannelFilter, readonly=True)
+async def process_tasks_channel_filter(callback: CallbackQuery, cb: TasksChannelFilter):
+    await callback.message.edit_text("Выберите канал:", reply_markup=get_task_channel_filter_keyboard(get_snapshot().channels, cb.status))
     await callback.answer()
 
-@main_router.callback_query(F.data.startswith("delete_"))
-async def process_delete_task(callback: CallbackQuery):
-    task_id = int(callback.data.split("_")[1])
-    delete_task(task_id)
-    await callback.message.edit_text(f"#{task_id} удалена!", reply_markup=back_keyboard())
+@callback_router.route(TaskOpen, readonly=True)
+async def process_task_selection(callback: CallbackQuery, cb: TaskOpen):
+    await callback.message.edit_text("Выберите действие:", reply_markup=get_task_action_keyboard(cb.task_id))
+    await callback.answer()
+
+@callback_router.route(TaskDelete)
+async def process_delete_task(callback: CallbackQuery, cb: TaskDelete):
+    delete_task(cb.task_id)
+    await callback.message.edit_text(f"#{cb.task_id} удалена!", reply_markup=back_keyboard())
     await callback.answer()
 
 # Обработка редактирования — выбор, что редактировать
-@main_router.callback_query(F.data.regexp(r"^edit_\d+$"))  # Регулярное выражение для "edit_число"
-async def process_edit_task(callback: CallbackQuery, state: FSMContext):
-    logger.info(callback.data.split("_"))
-    task_id = int(callback.data.split("_")[1])
-    await state.update_data(task_id=task_id)
-    await callback.message.edit_text("Что хотите редактировать?", reply_markup=get_edit_action_keyboard(task_id))
+@callback_router.route(TaskEdit)
+async def process_edit_task(callback: CallbackQuery, cb: TaskEdit, state: FSMContext):
+    await state.update_data(task_id=cb.task_id)
+    await callback.message.edit_text("Что хотите редактировать?", reply_markup=get_edit_action_keyboard(cb.task_id))
     await state.set_state(CreateTask.edit_action)
     await callback.answer()
 
-# Обработка выбора действия редактирования
-@main_router.callback_query(CreateTask.edit_action, F.data.regexp(r"^(edit_message_|edit_time_)\d+$"))
-async def process_edit_action(callback: CallbackQuery, state: FSMContext):
-    action = callback.data
+# Обработка выбора действия редактирования: текст
+@callback_router.route(EditMessage, CreateTask.edit_action)
+async def process_edit_message_action(callback: CallbackQuery, state: FSMContext):
+    await callback.message.edit_text("Введите новый текст сообщения (или /skip, чтобы оставить без изменений):")
+    await state.set_state(CreateTask.edit_message)
+    await callback.answer()
+
+# Обработка выбора действия редактирования: время
+@callback_router.route(EditTime, CreateTask.edit_action)
+async def process_edit_time_action(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
     task_id = data["task_id"]
-    
-    if action.startswith("edit_message_"):
-        await callback.message.edit_text("Введите новый текст сообщения (или /skip, чтобы оставить без изменений):")
-        await state.set_state(CreateTask.edit_message)
-    
-    elif action.startswith("edit_time_"):
-        tasks = load_tasks()
-        task = next((t for t in tasks if t["id"] == task_id), None)
-        if task and task["schedule_type"] == "immediate":
-            await callback.message.edit_text("Эта задача отправляется сразу, редактирование времени невозможно!")
-            await state.clear()
-        else:
-            if task["schedule_type"] == "daily":
-                # Для daily задач запрашиваем только время
-                selected_time = datetime.now()
-                if task["schedule_time"]:
-                    selected_time = datetime.strptime(task["schedule_time"], "%H:%M:%S")
-                await callback.message.edit_text("Выберите новое время:", reply_markup=get_time_keyboard(selected_time))
-                await state.set_state(CreateTask.edit_time)
-            else:
-                # Для delayed запрашиваем дату и время
-                selected_date = datetime.now()
-                if task and task["schedule_time"]:
-                    selected_date = datetime.strptime(task["schedule_time"], "%Y-%m-%d %H:%M:%S")
-                await callback.message.edit_text("Выберите новую дату:", reply_markup=get_date_keyboard(selected_date))
-                await state.set_state(CreateTask.edit_date)
-    
+    task = get_task(task_id)
+    if task is None:
+        await callback.message.edit_text(f"#{task_id} не найдена!", reply_markup=back_keyboard())
+        await state.clear()
+    elif task["schedule_type"] == "immediate":
+        await callback.message.edit_text("Эта задача отправляется сразу, редактирование времени невозможно!")
+        await state.clear()
+    elif task["schedule_type"] == "daily":
+        # Для daily задач запрашиваем только время
+        selected_time = datetime.now()
+        if task["schedule_time"]:
+            selected_time = datetime.strptime(task["schedule_time"], "%H:%M:%S")
+        await callback.message.edit_text("Выберите новое время:", reply_markup=get_time_keyboard(selected_time))
+        await state.set_state(CreateTask.edit_time)
+    elif task["schedule_type"] == "delayed":
+        # Для delayed запрашиваем дату и время
+        selected_date = datetime.now()
+        if task["schedule_time"]:
+            selected_date = datetime.strptime(task["schedule_time"], "%Y-%m-%d %H:%M:%S")
+        await callback.message.edit_text("Выберите новую дату:", reply_markup=get_date_keyboard(selected_date))
+        await state.set_state(CreateTask.edit_date)
+    else:
+        # weekly, interval и cron создаются через tasks_cli.py; клавиатуры для них нет
+        await callback.message.edit_text(
+            "Редактирование времени для этого типа расписания не поддерживается.", reply_markup=back_keyboard()
+        )
+        await state.clear()
+
     await callback.answer()
 
 
@@ -298,80 +351,38 @@ async def process_edit_message(message: Message, state: FSMContext):
         await message.answer("Текст оставлен без изменений.")
     await state.clear()
 
-# Обработка переключения дней при редактировании даты
-@main_router.callback_query(CreateTask.edit_date, F.data.regexp(r"^(date_prev_day_|date_next_day_)\d{4}-\d{2}-\d{2}$"))
-async def process_edit_date_selection(callback: CallbackQuery, state: FSMContext):
-    action = callback.data
-    if action.startswith("date_prev_day_"):
-        current_date_str = action.split("_")[-1]
-        current_date = datetime.strptime(current_date_str, "%Y-%m-%d")
-        new_date = current_date - timedelta(days=1)
-        await callback.message.edit_text("Выберите дату:", reply_markup=get_date_keyboard(new_date))
-    
-    elif action.startswith("date_next_day_"):
-        current_date_str = action.split("_")[-1]
-        current_date = datetime.strptime(current_date_str, "%Y-%m-%d")
-        new_date = current_date + timedelta(days=1)
-        await callback.message.edit_text("Выберите дату:", reply_markup=get_date_keyboard(new_date))
-    
-    await callback.answer()
-
 # Обработка подтверждения даты при редактировании
-@main_router.callback_query(CreateTask.edit_date, F.data.regexp(r"^confirm_date_\d{4}-\d{2}-\d{2}$"))
-async def process_confirm_edit_date(callback: CallbackQuery, state: FSMContext):
-    selected_date_str = callback.data.split("_")[-1]
-    await state.update_data(edit_date=selected_date_str)
+@callback_router.route(DateConfirm, CreateTask.edit_date)
+async def process_confirm_edit_date(callback: CallbackQuery, cb: DateConfirm, state: FSMContext):
+    await state.update_data(edit_date=cb.day.isoformat())
     # Используем текущее время задачи или текущее, если его нет
     data = await state.get_data()
     task_id = data["task_id"]
-    tasks = load_tasks()
-    task = next((t for t in tasks if t["id"] == task_id), None)
+    task = get_task(task_id)
     selected_time = datetime.now().replace(hour=0, minute=0, second=0)
-    if task and task["schedule_time"]:
+    if task and task["schedule_type"] == "delayed" and task["schedule_time"]:
         selected_time = datetime.strptime(task["schedule_time"], "%Y-%m-%d %H:%M:%S")
     await callback.message.edit_text("Выберите новое время:", reply_markup=get_time_keyboard(selected_time))
     await state.set_state(CreateTask.edit_time)
     await callback.answer()
 
-# Обработка переключения времени при редактировании
-@main_router.callback_query(CreateTask.edit_time, F.data.regexp(r"^(time_prev_hour_|time_next_hour_|time_prev_min_|time_next_min_)\d{2}:\d{2}$"))
-async def process_edit_time_selection(callback: CallbackQuery, state: FSMContext):
-    action = callback.data
-    if action.startswith("time_prev_hour_"):
-        current_time_str = action.split("_")[-1]
-        current_time = datetime.strptime(current_time_str, "%H:%M")
-        new_time = current_time - timedelta(hours=1)
-        await callback.message.edit_text("Выберите время:", reply_markup=get_time_keyboard(new_time))
-    
-    elif action.startswith("time_next_hour_"):
-        current_time_str = action.split("_")[-1]
-        current_time = datetime.strptime(current_time_str, "%H:%M")
-        new_time = current_time + timedelta(hours=1)
-        await callback.message.edit_text("Выберите время:", reply_markup=get_time_keyboard(new_time))
-    
-    elif action.startswith("time_prev_min_"):
-        current_time_str = action.split("_")[-1]
-        current_time = datetime.strptime(current_time_str, "%H:%M")
-        new_time = current_time - timedelta(minutes=5)  # Шаг 5 минут
-        await callback.message.edit_text("Выберите время:", reply_markup=get_time_keyboard(new_time))
-    
-    elif action.startswith("time_next_min_"):
-        current_time_str = action.split("_")[-1]
-        current_time = datetime.strptime(current_time_str, "%H:%M")
-        new_time = current_time + timedelta(minutes=5)  # Шаг 5 минут
-        await callback.message.edit_text("Выберите время:", reply_markup=get_time_keyboard(new_time))
-    
-    await callback.answer()
-
 # Обработка подтверждения времени при редактировании
-@main_router.callback_query(CreateTask.edit_time, F.data.regexp(r"^confirm_time_\d{2}:\d{2}$"))
-async def process_confirm_edit_time(callback: CallbackQuery, state: FSMContext):
-    selected_time_str = callback.data.split("_")[-1]
+@callback_router.route(TimeConfirm, CreateTask.edit_time)
+async def process_confirm_edit_time(callback: CallbackQuery, cb: TimeConfirm, state: FSMContext):
+    selected_time_str = _time_of(cb.minutes).strftime("%H:%M")
     data = await state.get_data()
     task_id = data["task_id"]
-    tasks = load_tasks()
-    task = next((t for t in tasks if t["id"] == task_id), None)
-    
+    task = get_task(task_id)
+
+    if task is None or task["schedule_type"] not in ("daily", "delayed") or (
+            task["schedule_type"] == "delayed" and "edit_date" not in data):
+        # Задачу удалили или сменили ей расписание, пока админ выбирал время
+        await callback.message.edit_text(
+            "Редактирование времени для этой задачи невозможно.", reply_markup=back_keyboard()
+        )
+        await state.clear()
+        await callback.answer()
+        return
     if task["schedule_type"] == "daily":
         # Для daily сохраняем только время
         full_datetime = f"{selected_time_str}:00"
@@ -379,8 +390,33 @@ async def process_confirm_edit_time(callback: CallbackQuery, state: FSMContext):
         # Для delayed добавляем дату
         selected_date = data["edit_date"]
         full_datetime = f"{selected_date} {selected_time_str}:00"
-    
+
     edit_task(task_id, new_schedule_time=full_datetime)
     await callback.message.edit_text(f"Время задачи #{task_id} обновлено!", reply_markup=back_keyboard())
     await state.clear()
-    await callback.answer()
\ No newline at end of file
+    await callback.answer()
+
+# Просмотр задачи из списка ошибок
+@callback_router.route(FailedOpen, readonly=True)
+async def process_failed_task_selection(callback: CallbackQuery, cb: FailedOpen):
+    task_id = cb.task_id
+    task = get_task(task_id)
+    if not task or task["status"] != "failed":
+        await callback.message.edit_text(f"#{task_id} уже не в списке ошибок.", reply_markup=back_keyboard())
+    else:
+        await callback.message.edit_text(
+            f"#{task_id} не отправлена в {task['channel_id']}:\n{task.get('last_error') or 'неизвестная ошибка'}",
+            parse_mode=None,
+            reply_markup=get_failed_task_action_keyboard(task_id)
+        )
+    await callback.answer()
+
+# Повторная отправка задачи из списка ошибок
+@callback_router.route(TaskRequeue)
+async def process_requeue_task(callback: CallbackQuery, cb: TaskRequeue):
+    task_id = cb.task_id
+    if requeue_task(task_id):
+        await callback.message.edit_text(f"#{task_id} снова в очереди!", reply_markup=back_keyboard())
+    else:
+        await callback.message.edit_text(f"#{task_id} уже не в списке ошибок.", reply_markup=back_keyboard())
+    await callback.answer()
@@ -1,45 +1,140 @@
-from typing import List, Dict
-from aiogram.types import InlineKeyboardButton
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from datetime import datetime, timedelta
 
+from callbacks import (
+    pack, Back, Noop, StartMenu, ScheduleTypePick, DateShift, DateConfirm, TimeShift, TimeConfirm,
+    ChannelPick, GroupPick, TasksPage, TasksChannelFilter, TaskOpen, TaskEdit, TaskDelete, EditMessage, EditTime,
+    FailedOpen, TaskRequeue
+)
+from repository import TaskRepository
+
+# callback_data неизменяемых кнопок считаем один раз
+BACK = pack(Back())
+NOOP = pack(Noop())
+
 def get_schedule_type_keyboard() -> InlineKeyboardBuilder:
     """Инлайн-клавиатура для выбора типа отправки."""
     builder = InlineKeyboardBuilder()
     builder.row(
-        InlineKeyboardButton(text="👍 Сразу", callback_data="schedule_immediate"),
-        InlineKeyboardButton(text="⏳ Позже", callback_data="schedule_delayed")
+        InlineKeyboardButton(text="👍 Сразу", callback_data=pack(ScheduleTypePick("immediate"))),
+        InlineKeyboardButton(text="⏳ Позже", callback_data=pack(ScheduleTypePick("delayed")))
     )
-    builder.row(InlineKeyboardButton(text="🌓 Ежедневно 🌓", callback_data="schedule_daily"))
+    builder.row(InlineKeyboardButton(text="🌓 Ежедневно 🌓", callback_data=pack(ScheduleTypePick("daily"))))
     return builder.as_markup()
 
-def get_channel_keyboard(channels: List[Dict]) -> InlineKeyboardBuilder:
-    """Инлайн-клавиатура для выбора канала."""
+def get_channel_keyboard(channels: List[Dict], groups: Optional[Dict[str, List[str]]] = None) -> InlineKeyboardBuilder:
+    """Инлайн-клавиатура для выбора канала или группы каналов (рассылка)."""
     builder = InlineKeyboardBuilder()
     for channel in channels:
-        builder.row(InlineKeyboardButton(text=channel.url, callback_data=f"channel_{channel.id}"))
+        builder.row(InlineKeyboardButton(text=channel.url, callback_data=pack(ChannelPick(channel.id))))
+    for name, channel_ids in (groups or {}).items():
+        builder.row(InlineKeyboardButton(text=f"📢 {name} ({len(channel_ids)})", callback_data=pack(GroupPick(name))))
     return builder.as_markup()
 
-def get_task_management_keyboard(tasks: List[Dict]) -> InlineKeyboardBuilder:
-    """Инлайн-клавиатура для редактирования/удаления задач."""
+TASKS_PAGE_SIZE = 10
+
+# Фильтры по статусу в меню управления задачами ("" — все)
+STATUS_FILTERS = {
+    "": "Все",
+    "pending": "⏳ Ждут",
+    "done": "✅ Отправлены",
+    "failed": "⚠️ Ошибки",
+    "skipped": "⏭ Пропущены",
+}
+
+# Кэш отрисованных страниц: сбрасывается, когда меняется версия репозитория
+_page_cache: "OrderedDict[Tuple, InlineKeyboardMarkup]" = OrderedDict()
+_page_cache_version = -1
+PAGE_CACHE_SIZE = 256
+
+def get_task_management_keyboard(repository: TaskRepository, status: str = "", channel_id: str = "",
+                                 direction: str = "n", cursor: int = 0) -> Optional[InlineKeyboardMarkup]:
+    """Страница списка задач с фильтрами и кнопками вперёд/назад (None — задач нет)."""
+    global _page_cache_version
+    if _page_cache_version != repository.version:
+        _page_cache.clear()
+        _page_cache_version = repository.version
+
+    key = (status, channel_id, direction, cursor)
+    markup = _page_cache.get(key)
+    if markup is not None:
+        _page_cache.move_to_end(key)
+        return markup
+
+    ids = repository.sorted_ids(status or None, channel_id or None)
+    if not ids:
+        return None
+    if direction == "p":
+        end = bisect_left(ids, cursor)
+        start = max(0, end - TASKS_PAGE_SIZE)
+    else:
+        start = bisect_right(ids, cursor)
+        if start >= len(ids):
+            start = max(0, len(ids) - TASKS_PAGE_SIZE)
+    page = ids[start:start + TASKS_PAGE_SIZE]
+
     builder = InlineKeyboardBuilder()
-    for task in tasks:
-        button_text = f"📄 Задача {task['id']}: {task['message'][:20]}..."
-        builder.row(InlineKeyboardButton(text=button_text, callback_data=f"task_{task['id']}"))
+    builder.row(*(
+        InlineKeyboardButton(
+            text=f"• {label}" if value == status else label,
+            callback_data=pack(TasksPage(value, channel_id, "n", 0))
+        )
+        for value, label in STATUS_FILTERS.items()
+    ))
+    builder.row(InlineKeyboardButton(
+        text=f"📡 Канал: {channel_id or 'все'}", callback_data=pack(TasksChannelFilter(status))
+    ))
+    # Задачи из списка ошибок открываются с кнопкой повтора
+    payload_type, icon = (FailedOpen, "⚠️") if status == "failed" else (TaskOpen, "📄")
+    for task_id in page:
+        task = repository.get(task_id)
+        button_text = f"{icon} Задача {task.id}: {task.message[:20]}..."
+        builder.row(InlineKeyboardButton(text=button_text, callback_data=pack(payload_type(task.id))))
+
+    navigation = []
+    if start > 0:
+        navigation.append(InlineKeyboardButton(
+            text="⬅️", callback_data=pack(TasksPage(status, channel_id, "p", page[0]))
+        ))
+    navigation.append(InlineKeyboardButton(
+        text=f"{start + 1}–{start + len(page)} из {len(ids)}", callback_data=NOOP
+    ))
+    if start + len(page) < len(ids):
+        navigation.append(InlineKeyboardButton(
+            text="➡️", callback_data=pack(TasksPage(status, channel_id, "n", page[-1]))
+        ))
+    builder.row(*navigation)
     builder.row(
-        InlineKeyboardButton(text="◀️ Назад", callback_data="back")
+        InlineKeyboardButton(text="◀️ Назад", callback_data=BACK)
     )
+
+    markup = builder.as_markup()
+    _page_cache[key] = markup
+    if len(_page_cache) > PAGE_CACHE_SIZE:
+        _page_cache.popitem(last=False)
+    return markup
+
+def get_task_channel_filter_keyboard(channels: List[Dict], status: str = "") -> InlineKeyboardBuilder:
+    """Инлайн-клавиатура для фильтра списка задач по каналу."""
+    builder = InlineKeyboardBuilder()
+    builder.row(InlineKeyboardButton(text="Все каналы", callback_data=pack(TasksPage(status, "", "n", 0))))
+    for channel in channels:
+        builder.row(InlineKeyboardButton(text=channel.url, callback_data=pack(TasksPage(status, channel.id, "n", 0))))
     return builder.as_markup()
 
 def get_task_action_keyboard(task_id: int) -> InlineKeyboardBuilder:
     """Инлайн-клавиатура для выбора действия с задачей (редактировать/удалить)."""
     builder = InlineKeyboardBuilder()
     builder.row(
-        InlineKeyboardButton(text="📝 Редактировать", callback_data=f"edit_{task_id}"),
-        InlineKeyboardButton(text="❌ Удалить", callback_data=f"delete_{task_id}")
+        InlineKeyboardButton(text="📝 Редактировать", callback_data=pack(TaskEdit(task_id))),
+        InlineKeyboardButton(text="❌ Удалить", callback_data=pack(TaskDelete(task_id)))
     )
     builder.row(
-        InlineKeyboardButton(text="◀️ Назад", callback_data="back")
+        InlineKeyboardButton(text="◀️ Назад", callback_data=BACK)
     )
 
     return builder.as_markup()
@@ -49,15 +144,17 @@ def get_date_keyboard(selected_date: datetime = None) -> InlineKeyboardBuilder:
     builder = InlineKeyboardBuilder()
     current_date = selected_date or datetime.now()
 
+    day = current_date.date()
+
     # Кнопки для изменения дня
     builder.row(
-        InlineKeyboardButton(text="⬅️ День", callback_data=f"date_prev_day_{current_date.strftime('%Y-%m-%d')}"),
-        InlineKeyboardButton(text=current_date.strftime("%Y-%m-%d"), callback_data="date_noop"),
-        InlineKeyboardButton(text="День ➡️", callback_data=f"date_next_day_{current_date.strftime('%Y-%m-%d')}")
+        InlineKeyboardButton(text="⬅️ День", callback_data=pack(DateShift(day, -1))),
+        InlineKeyboardButton(text=current_date.strftime("%Y-%m-%d"), callback_data=NOOP),
+        InlineKeyboardButton(text="День ➡️", callback_data=pack(DateShift(day, 1)))
     )
 
     # Кнопка подтверждения
-    builder.row(InlineKeyboardButton(text="✅ Подтвердить дату", callback_data=f"confirm_date_{current_date.strftime('%Y-%m-%d')}"))
+    builder.row(InlineKeyboardButton(text="✅ Подтвердить дату", callback_data=pack(DateConfirm(day))))
     return builder.as_markup()
 
 def get_time_keyboard(selected_time: datetime = None) -> InlineKeyboardBuilder:
@@ -65,16 +162,18 @@ def get_time_keyboard(selected_time: datetime = None) -> InlineKeyboardBuilder:
     builder = InlineKeyboardBuilder()
     current_time = selected_time or datetime.now().replace(hour=0, minute=0, second=0)
 
-    # Кнопки для изменения часов и минут
+    minutes = current_time.hour * 60 + current_time.minute
+
+    # Кнопки для изменения часов и минут (шаг 5 минут)
     builder.row(
-        InlineKeyboardButton(text="⬅️ Час", callback_data=f"time_prev_hour_{current_time.strftime('%H:%M')}"),
-        InlineKeyboardButton(text=current_time.strftime("%H:%M"), callback_data="time_noop"),
-        InlineKeyboardButton(text="Час ➡️", callback_data=f"time_next_hour_{current_time.strftime('%H:%M')}")
+        InlineKeyboardButton(text="⬅️ Час", callback_data=pack(TimeShift(minutes, -60))),
+        InlineKeyboardButton(text=current_time.strftime("%H:%M"), callback_data=NOOP),
+        InlineKeyboardButton(text="Час ➡️", callback_data=pack(TimeShift(minutes, 60)))
     )
     builder.row(
-        InlineKeyboardButton(text="⬅️ Мин", callback_data=f"time_prev_min_{current_time.strftime('%H:%M')}"),
-        InlineKeyboardButton(text="Подтвердить время", callback_data=f"confirm_time_{current_time.strftime('%H:%M')}"),
-        InlineKeyboardButton(text="Мин ➡️", callback_data=f"time_next_min_{current_time.strftime('%H:%M')}")
+        InlineKeyboardButton(text="⬅️ Мин", callback_data=pack(TimeShift(minutes, -5))),
+        InlineKeyboardButton(text="Подтвердить время", callback_data=pack(TimeConfirm(minutes))),
+        InlineKeyboardButton(text="Мин ➡️", callback_data=pack(TimeShift(minutes, 5)))
     )
     return builder.as_markup()
 
@@ -82,25 +181,38 @@ def get_edit_action_keyboard(task_id: int) -> InlineKeyboardBuilder:
     """Инлайн-клавиатура для выбора, что редактировать: текст или время."""
     builder = InlineKeyboardBuilder()
     builder.row(
-        InlineKeyboardButton(text="📄 Текст", callback_data=f"edit_message_{task_id}"),
-        InlineKeyboardButton(text="🗓 Время", callback_data=f"edit_time_{task_id}"),
+        InlineKeyboardButton(text="📄 Текст", callback_data=pack(EditMessage(task_id))),
+        InlineKeyboardButton(text="🗓 Время", callback_data=pack(EditTime(task_id))),
     )
     builder.row(
-        InlineKeyboardButton(text="◀️ Назад", callback_data="back")
+        InlineKeyboardButton(text="◀️ Назад", callback_data=BACK)
     )
     return builder.as_markup()
 
 def get_start_keyboard() -> InlineKeyboardBuilder:
     """Инлайн-клавиатура для стартового сообщения."""
     builder = InlineKeyboardBuilder()
-    builder.row(InlineKeyboardButton(text="⭐️ Создать задачу", callback_data="start_create"))
-    builder.row(InlineKeyboardButton(text="📝 Управление задачами", callback_data="start_manage"))
+    builder.row(InlineKeyboardButton(text="⭐️ Создать задачу", callback_data=pack(StartMenu("create"))))
+    builder.row(InlineKeyboardButton(text="📝 Управление задачами", callback_data=pack(StartMenu("manage"))))
+    builder.row(InlineKeyboardButton(text="⚠️ Ошибки отправки", callback_data=pack(StartMenu("failed"))))
+    return builder.as_markup()
+
+def get_failed_task_action_keyboard(task_id: int) -> InlineKeyboardBuilder:
+    """Инлайн-клавиатура для задачи с ошибкой: повторить или удалить."""
+    builder = InlineKeyboardBuilder()
+    builder.row(
+        InlineKeyboardButton(text="🔁 Повторить", callback_data=pack(TaskRequeue(task_id))),
+        InlineKeyboardButton(text="❌ Удалить", callback_data=pack(TaskDelete(task_id)))
+    )
+    builder.row(
+        InlineKeyboardButton(text="◀️ Назад", callback_data=BACK)
+    )
     return builder.as_markup()
 
 def back_keyboard() -> InlineKeyboardBuilder:
 
     builder = InlineKeyboardBuilder()
     builder.row(
-        InlineKeyboardButton(text="◀️ Назад", callback_data="back")
+        InlineKeyboardButton(text="◀️ Назад", callback_data=BACK)
     )
     return builder.as_markup()
\ No newline at end of file
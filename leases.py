@@ -0,0 +1,133 @@
+import logging
+import math
+import os
+import socket
+import sqlite3
+import time
+import zlib
+
+from typing import Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+def shard_of(channel_id: str, shards: int) -> int:
+    """Шард задачи: все задачи одного канала попадают к одному воркеру."""
+    return zlib.crc32(str(channel_id).encode()) % shards
+
+
+def default_node_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class LeaseManager:
+    """Аренда шардов расписания через общую SQLite-базу.
+
+    Каждый воркер периодически продлевает свои аренды (heartbeat) и забирает
+    свободные или просроченные шарды, пока не наберёт свою долю. Если воркер
+    умер, его аренды истекают через ttl секунд и достаются остальным.
+    """
+
+    def __init__(self, path: str, node_id: Optional[str] = None, shards: int = 16, ttl: float = 30):
+        self.path = path
+        self.node_id = node_id or default_node_id()
+        self.shards = shards
+        self.ttl = ttl
+        self._owned: Set[int] = set()
+        self._expires_at = 0.0
+        self._conn = sqlite3.connect(path, timeout=ttl, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS leases (
+                shard INTEGER PRIMARY KEY,
+                owner TEXT,
+                expires_at REAL NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS workers (
+                node_id TEXT PRIMARY KEY,
+                heartbeat_at REAL NOT NULL
+            );
+        """)
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO leases (shard) VALUES (?)", [(shard,) for shard in range(shards)]
+        )
+
+    @property
+    def owned(self) -> Set[int]:
+        return set(self._owned)
+
+    def owns_shard(self, shard: int) -> bool:
+        # Не доверяем аренде, которая вот-вот истечёт: её уже может забрать другой воркер
+        return shard in self._owned and time.time() < self._expires_at - self.ttl / 3
+
+    def owns(self, channel_id: str) -> bool:
+        return self.owns_shard(shard_of(channel_id, self.shards))
+
+    def heartbeat(self) -> bool:
+        """Продлеваем и перераспределяем аренды. Возвращаем True, если набор шардов изменился."""
+        now = time.time()
+        expires_at = now + self.ttl
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO workers (node_id, heartbeat_at) VALUES (?, ?) "
+                "ON CONFLICT(node_id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at",
+                (self.node_id, now)
+            )
+            conn.execute("DELETE FROM workers WHERE heartbeat_at < ?", (now - 10 * self.ttl,))
+            live_workers = conn.execute(
+                "SELECT COUNT(*) FROM workers WHERE heartbeat_at >= ?", (now - self.ttl,)
+            ).fetchone()[0]
+            fair_share = math.ceil(self.shards / max(live_workers, 1))
+
+            conn.execute(
+                "UPDATE leases SET expires_at = ? WHERE owner = ? AND expires_at >= ?",
+                (expires_at, self.node_id, now)
+            )
+            owned = [row[0] for row in conn.execute(
+                "SELECT shard FROM leases WHERE owner = ? AND expires_at >= ? ORDER BY shard",
+                (self.node_id, now)
+            )]
+
+            if len(owned) > fair_share:
+                # Появились новые воркеры — отдаём лишнее
+                extra = owned[fair_share:]
+                conn.executemany(
+                    "UPDATE leases SET owner = NULL, expires_at = 0 WHERE shard = ? AND owner = ?",
+                    [(shard, self.node_id) for shard in extra]
+                )
+                owned = owned[:fair_share]
+            elif len(owned) < fair_share:
+                free = [row[0] for row in conn.execute(
+                    "SELECT shard FROM leases WHERE owner IS NULL OR expires_at < ? ORDER BY shard LIMIT ?",
+                    (now, fair_share - len(owned))
+                )]
+                conn.executemany(
+                    "UPDATE leases SET owner = ?, expires_at = ? WHERE shard = ?",
+                    [(self.node_id, expires_at, shard) for shard in free]
+                )
+                owned.extend(free)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        new_owned = set(owned)
+        changed = new_owned != self._owned
+        if changed:
+            logger.info(f"Node {self.node_id} now owns shards {sorted(new_owned)}")
+        self._owned = new_owned
+        self._expires_at = expires_at
+        return changed
+
+    def release_all(self):
+        """Отдаём все аренды при штатной остановке, чтобы их сразу подхватили другие."""
+        self._conn.execute(
+            "UPDATE leases SET owner = NULL, expires_at = 0 WHERE owner = ?", (self.node_id,)
+        )
+        self._conn.execute("DELETE FROM workers WHERE node_id = ?", (self.node_id,))
+        self._owned = set()
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,204 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram.types import (
+    FSInputFile,
+    InputMediaAnimation,
+    InputMediaAudio,
+    InputMediaDocument,
+    InputMediaPhoto,
+    InputMediaVideo,
+    Message
+)
+
+from config import get_optional_config, MediaConfig
+from delivery import PRIORITY_SCHEDULED
+
+logger = logging.getLogger(__name__)
+
+# Типы вложений задачи и соответствующие InputMedia для альбомов
+INPUT_MEDIA = {
+    "photo": InputMediaPhoto,
+    "video": InputMediaVideo,
+    "document": InputMediaDocument,
+    "animation": InputMediaAnimation,
+    "audio": InputMediaAudio,
+}
+MEDIA_TYPES = tuple(INPUT_MEDIA)
+
+# Максимум вложений в одном альбоме Telegram
+MAX_ALBUM_SIZE = 10
+
+
+def media_from_message(message: Message) -> Optional[Dict[str, str]]:
+    """Вложение из сообщения админа: Telegram уже хранит файл, достаточно его file_id."""
+    if message.photo:
+        # Берём самый большой размер
+        return {"type": "photo", "file_id": message.photo[-1].file_id}
+    for media_type in ("video", "document", "animation", "audio"):
+        item = getattr(message, media_type)
+        if item is not None:
+            return {"type": media_type, "file_id": item.file_id}
+    return None
+
+
+def _sent_file_id(message: Any, media_type: str) -> Optional[str]:
+    """file_id, который Telegram присвоил загруженному файлу."""
+    item = getattr(message, media_type, None)
+    if media_type == "photo" and item:
+        item = item[-1]
+    return getattr(item, "file_id", None)
+
+
+class FileIdCache:
+    """Кэш file_id по хешу содержимого локальных файлов.
+
+    Файл с диска загружается в Telegram один раз; все следующие отправки (ежедневные
+    повторы, другие каналы, другие задачи с тем же файлом) используют file_id.
+    Кэш хранится в JSON-файле: {"<тип>:<sha256>": "<file_id>"}.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._file_ids: Dict[str, str] = {}
+        # Хеш файла по (путь, mtime, размер) — чтобы не перечитывать большие файлы каждый запуск
+        self._digests: Dict[str, Tuple[int, int, str]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # Записи файла кэша идут по очереди, чтобы более старый снимок не перезаписал новый
+        self._save_lock = asyncio.Lock()
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self._file_ids = json.load(f)
+
+    def digest(self, path: str) -> str:
+        stat = os.stat(path)
+        cached = self._digests.get(path)
+        if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha.update(chunk)
+        self._digests[path] = (stat.st_mtime_ns, stat.st_size, sha.hexdigest())
+        return sha.hexdigest()
+
+    async def key(self, item: Dict[str, str]) -> str:
+        # Хеш большого файла считается долго, поэтому не в цикле событий
+        digest = await asyncio.to_thread(self.digest, item["path"])
+        # file_id действителен только для своего типа: фото нельзя отправить как документ
+        return f"{item['type']}:{digest}"
+
+    def get(self, key: str) -> Optional[str]:
+        return self._file_ids.get(key)
+
+    def lock(self, key: str) -> asyncio.Lock:
+        """Один файл одновременно загружает только одна отправка, остальные ждут её file_id."""
+        return self._locks.setdefault(key, asyncio.Lock())
+
+    async def put(self, key: str, file_id: str):
+        self._file_ids[key] = file_id
+        if not self.path:
+            return
+        # Запись на диск — не в цикле событий; в поток отдаём копию, словарь тем временем может меняться
+        snapshot = dict(self._file_ids)
+        async with self._save_lock:
+            await asyncio.to_thread(self._save, snapshot)
+
+    def _save(self, file_ids: Dict[str, str]):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(file_ids, f, indent=4)
+        os.replace(tmp_path, self.path)
+
+
+_cache: Optional[FileIdCache] = None
+
+
+def get_file_id_cache() -> FileIdCache:
+    global _cache
+    if _cache is None:
+        _cache = FileIdCache(get_optional_config(MediaConfig, "media").cache_path)
+    return _cache
+
+
+def set_file_id_cache(cache: Optional[FileIdCache]):
+    global _cache
+    _cache = cache
+
+
+async def send_post(delivery, chat_id: str, task: Dict, priority: int = PRIORITY_SCHEDULED) -> List[int]:
+    """Отправляем задачу в чат (текст, одно вложение или альбом) и возвращаем ID сообщений.
+
+    Вложение задаётся либо file_id, либо путём к локальному файлу ("path"); для файлов
+    используется FileIdCache, так что каждый из них загружается не больше одного раза.
+    """
+    media = task.get("media")
+    if not media:
+        message = await delivery.send(chat_id, priority=priority, text=task["message"])
+        return _message_ids(message)
+
+    cache = get_file_id_cache()
+    uploads = {}  # Индекс вложения -> ключ кэша для файлов, которые придётся загрузить
+    inputs = []
+    for index, item in enumerate(media):
+        if item.get("file_id"):
+            inputs.append(item["file_id"])
+            continue
+        key = await cache.key(item)
+        file_id = cache.get(key)
+        if file_id is None:
+            uploads[index] = key
+            inputs.append(FSInputFile(item["path"]))
+        else:
+            inputs.append(file_id)
+
+    if not uploads:
+        return _message_ids(await _send_media(delivery, chat_id, media, inputs, task["message"], priority))
+
+    # Держим блокировки на время загрузки; ключи сортируем, чтобы не было взаимных блокировок
+    locks = [cache.lock(key) for key in sorted(set(uploads.values()))]
+    for lock in locks:
+        await lock.acquire()
+    try:
+        # Пока ждали блокировку, файл мог загрузить кто-то другой
+        for index, key in list(uploads.items()):
+            file_id = cache.get(key)
+            if file_id is not None:
+                inputs[index] = file_id
+                del uploads[index]
+        result = await _send_media(delivery, chat_id, media, inputs, task["message"], priority)
+        messages = result if isinstance(result, list) else [result]
+        for index, key in uploads.items():
+            message = messages[index] if len(messages) > index else None
+            file_id = _sent_file_id(message, media[index]["type"])
+            if file_id is not None:
+                await cache.put(key, file_id)
+                logger.info(f"Uploaded {media[index]['path']} once, reusing file_id from now on")
+    finally:
+        for lock in locks:
+            lock.release()
+    return _message_ids(result)
+
+
+async def _send_media(delivery, chat_id: str, media: List[Dict], inputs: List[Any], caption: str, priority: int):
+    caption = caption or None
+    if len(media) == 1:
+        media_type = media[0]["type"]
+        return await delivery.send(chat_id, method=f"send_{media_type}", priority=priority, caption=caption,
+                                   **{media_type: inputs[0]})
+    # Подпись альбома — у первого элемента
+    album = [
+        INPUT_MEDIA[item["type"]](media=value, caption=caption if index == 0 else None)
+        for index, (item, value) in enumerate(zip(media, inputs))
+    ]
+    return await delivery.send(chat_id, method="send_media_group", priority=priority, media=album)
+
+
+def _message_ids(result: Any) -> List[int]:
+    messages = result if isinstance(result, list) else [result]
+    return [message.message_id for message in messages if getattr(message, "message_id", None) is not None]
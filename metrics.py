@@ -0,0 +1,276 @@
+import bisect
+import logging
+import math
+import threading
+
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+from config import MetricsConfig
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержек (секунды)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Sequence[str]) -> Tuple[str, ...]:
+        if len(labels) != len(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {labels}")
+        return tuple(str(label) for label in labels)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def total(self) -> float:
+        return sum(self._values.values())
+
+    def items(self) -> List[Tuple[Tuple[str, ...], float]]:
+        with self._lock:
+            return sorted(self._values.items())
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """Значение, которое считывается в момент запроса метрик (например, длина очереди)."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._callback: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, *labels: str):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, callback: Optional[Callable[[], float]]):
+        """Значение без меток, вычисляемое при каждом чтении."""
+        self._callback = callback
+
+    def value(self, *labels: str) -> float:
+        if self._callback is not None and not labels:
+            return self._callback()
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        if self._callback is not None:
+            return [f"{self.name} {_format_value(self._callback())}"]
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in items]
+
+
+class _HistogramState:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self, buckets: int):
+        self.counts = [0] * (buckets + 1)  # Последняя корзина — +Inf
+        self.total = 0.0
+        self.count = 0
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._states: Dict[Tuple[str, ...], _HistogramState] = {}
+
+    def observe(self, value: float, *labels: str):
+        key = self._key(labels)
+        with self._lock:
+            state = self._states.get(key)
+            if state is None:
+                state = self._states[key] = _HistogramState(len(self.buckets))
+            state.counts[bisect.bisect_left(self.buckets, value)] += 1
+            state.total += value
+            state.count += 1
+
+    def _merged(self) -> _HistogramState:
+        merged = _HistogramState(len(self.buckets))
+        with self._lock:
+            for state in self._states.values():
+                merged.counts = [a + b for a, b in zip(merged.counts, state.counts)]
+                merged.total += state.total
+                merged.count += state.count
+        return merged
+
+    def summary(self) -> Tuple[int, float, float]:
+        """(количество, среднее, оценка 95-го перцентиля) по всем меткам."""
+        merged = self._merged()
+        if not merged.count:
+            return 0, 0.0, 0.0
+        rank = 0.95 * merged.count
+        seen = 0
+        p95 = math.inf
+        for bound, count in zip(self.buckets + (math.inf,), merged.counts):
+            seen += count
+            if seen >= rank:
+                p95 = bound
+                break
+        return merged.count, merged.total / merged.count, p95
+
+    def render(self) -> List[str]:
+        lines = []
+        with self._lock:
+            items = [(key, list(state.counts), state.total, state.count) for key, state in self._states.items()]
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus."""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.header())
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+scheduler_tick_seconds = REGISTRY.register(Histogram(
+    "tg_mailer_scheduler_tick_seconds", "Duration of one scheduler loop iteration"
+))
+scheduler_lag_seconds = REGISTRY.register(Histogram(
+    "tg_mailer_scheduler_lag_seconds", "Actual minus planned fire time of dispatched tasks"
+))
+scheduler_heap_size = REGISTRY.register(Gauge(
+    "tg_mailer_scheduler_heap_size", "Entries in the scheduler heap, including stale ones"
+))
+send_seconds = REGISTRY.register(Histogram(
+    "tg_mailer_send_seconds", "Bot API call latency per chat", ("chat_id",)
+))
+delivery_failovers_total = REGISTRY.register(Counter(
+    "tg_mailer_delivery_failovers_total", "Sends moved to another sender bot after an error", ("reason",)
+))
+delivery_sender_healthy = REGISTRY.register(Gauge(
+    "tg_mailer_delivery_sender_healthy", "1 if the sender bot is in rotation, 0 while it cools down", ("sender",)
+))
+delivery_queue_depth = REGISTRY.register(Gauge(
+    "tg_mailer_delivery_queue_depth", "Jobs waiting in the outbound queue"
+))
+delivery_sent_total = REGISTRY.register(Counter(
+    "tg_mailer_delivery_sent_total", "Successful Bot API calls"
+))
+delivery_retries_total = REGISTRY.register(Counter(
+    "tg_mailer_delivery_retries_total", "Retried Bot API calls by reason", ("reason",)
+))
+delivery_failures_total = REGISTRY.register(Counter(
+    "tg_mailer_delivery_failures_total", "Bot API calls that failed permanently"
+))
+handler_seconds = REGISTRY.register(Histogram(
+    "tg_mailer_handler_seconds", "Callback handler latency per callback type", ("callback",)
+))
+
+
+async def _metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(body=REGISTRY.render().encode(),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+async def start_metrics_server(metrics_config: MetricsConfig) -> web.AppRunner:
+    """Запускаем HTTP-сервер с /metrics; вернувшийся runner нужно закрыть через cleanup()."""
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, metrics_config.host, metrics_config.port)
+    await site.start()
+    logger.info(f"Metrics available at http://{metrics_config.host}:{metrics_config.port}/metrics")
+    return runner
+
+
+def format_stats() -> str:
+    """Короткая сводка для команды /stats."""
+    def latency(histogram: Histogram) -> str:
+        count, mean, p95 = histogram.summary()
+        if not count:
+            return "нет данных"
+        p95_text = f"≤{p95:g}с" if not math.isinf(p95) else f">{histogram.buckets[-1]:g}с"
+        return f"{count} шт., среднее {mean * 1000:.0f} мс, p95 {p95_text}"
+
+    retries = ", ".join(f"{key[0]}: {int(value)}" for key, value in delivery_retries_total.items()) or "0"
+    return "\n".join([
+        "📊 Статистика",
+        f"Очередь отправки: {int(delivery_queue_depth.value())}",
+        f"Отправлено: {int(delivery_sent_total.total())}",
+        f"Повторы: {retries}",
+        f"Ошибки: {int(delivery_failures_total.total())}",
+        f"Переключения ботов: {int(delivery_failovers_total.total())}",
+        f"Такт планировщика: {latency(scheduler_tick_seconds)}",
+        f"Опоздание отправки: {latency(scheduler_lag_seconds)}",
+        f"Запрос к Bot API: {latency(send_seconds)}",
+        f"Обработка кнопок: {latency(handler_seconds)}",
+    ])
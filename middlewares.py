@@ -0,0 +1,68 @@
+import logging
+import time
+
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from config import get_snapshot
+
+logger = logging.getLogger(__name__)
+
+
+class AdminMiddleware(BaseMiddleware):
+    """Внешний middleware апдейтов: пропускает дальше только админов из конфига.
+
+    Регистрируется до FSM-middleware, поэтому апдейты посторонних не трогают
+    хранилище состояний и не проходят фильтры. Посторонним отвечаем не чаще
+    раза в notice_interval секунд, остальные их апдейты просто отбрасываются.
+    В данные обработчиков кладётся admin_role.
+    """
+
+    def __init__(self, notice_interval: float = 60, max_tracked_users: int = 10000):
+        self.notice_interval = notice_interval
+        self.max_tracked_users = max_tracked_users
+        self._last_notice: "OrderedDict[int, float]" = OrderedDict()
+        self.dropped = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        role = get_snapshot().admin_roles.get(user.id) if user is not None else None
+        if role is not None:
+            data["admin_role"] = role
+            return await handler(event, data)
+
+        self.dropped += 1
+        if user is not None and self._should_notify(user.id):
+            await self._notify(event)
+        return None
+
+    def _should_notify(self, user_id: int) -> bool:
+        now = time.monotonic()
+        last = self._last_notice.get(user_id)
+        if last is not None and now - last < self.notice_interval:
+            return False
+        self._last_notice[user_id] = now
+        self._last_notice.move_to_end(user_id)
+        while len(self._last_notice) > self.max_tracked_users:
+            self._last_notice.popitem(last=False)
+        return True
+
+    @staticmethod
+    async def _notify(event: TelegramObject):
+        if not isinstance(event, Update):
+            return
+        try:
+            if event.message is not None and event.message.chat.type == "private":
+                await event.message.answer("Вы не администратор!")
+            elif event.callback_query is not None:
+                await event.callback_query.answer("Вы не администратор!")
+        except Exception as e:
+            logger.warning(f"Failed to notify non-admin user: {e}")
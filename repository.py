@@ -0,0 +1,314 @@
+import asyncio
+import logging
+import threading
+
+from concurrent.futures import Executor
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from schedules import Schedule, compile_schedule
+from storage import TaskStore, TASK_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# Поля, от которых зависят списки задач в меню
+LISTED_FIELDS = ("message", "status", "channel_id")
+
+# Поля, при изменении которых расписание задачи компилируется заново
+SCHEDULE_FIELDS = ("schedule_type", "schedule_time")
+
+# Пауза перед повтором отложенной записи, которая не удалась (например, диск переполнен)
+WRITE_RETRY_DELAY = 5
+
+
+class TaskRecord:
+    """Компактная запись задачи в памяти."""
+
+    __slots__ = TASK_COLUMNS + ("extra", "schedule")
+
+    def __init__(self, id: int, message: str, channel_id: str, schedule_type: str,
+                 schedule_time: Optional[str] = None, status: str = "pending",
+                 last_sent_date: Optional[str] = None, extra: Optional[Dict] = None):
+        self.id = id
+        self.message = message
+        self.channel_id = channel_id
+        self.schedule_type = schedule_type
+        self.schedule_time = schedule_time
+        self.status = status
+        self.last_sent_date = last_sent_date
+        # Дополнительные поля задачи, для которых нет отдельного слота
+        self.extra = extra or {}
+        self.schedule: Optional[Schedule] = None
+        self._compile()
+
+    def _compile(self):
+        """Разбираем расписание один раз: при создании записи и при смене schedule_type/schedule_time."""
+        try:
+            self.schedule = compile_schedule(self.schedule_type, self.schedule_time)
+        except ValueError:
+            # Некорректное расписание: задача не срабатывает (см. next_fire_time)
+            self.schedule = None
+
+    @classmethod
+    def from_dict(cls, task: Dict) -> "TaskRecord":
+        fields = {key: task.get(key) for key in TASK_COLUMNS}
+        fields["status"] = fields["status"] or "pending"
+        extra = {key: value for key, value in task.items() if key not in TASK_COLUMNS}
+        return cls(extra=extra, **fields)
+
+    def to_dict(self) -> Dict:
+        task = {key: getattr(self, key) for key in TASK_COLUMNS}
+        task.update(self.extra)
+        return task
+
+    def set(self, key: str, value):
+        if key in TASK_COLUMNS:
+            setattr(self, key, value)
+            if key in SCHEDULE_FIELDS:
+                self._compile()
+        else:
+            self.extra[key] = value
+
+
+class TaskRepository:
+    """Общий для процесса репозиторий задач: данные в памяти, запись сквозная в хранилище.
+
+    Индексы: по ID, по статусу и по каналу.
+
+    После start_write_behind запись становится отложенной: изменения сразу видны в памяти,
+    а в хранилище уходят из отдельного потока (executor) пачкой раз в write_delay секунд,
+    так что несколько изменений одной задачи подряд дают одну запись на диск. Добавление
+    задачи (нужен ID из хранилища) и перечитывание тоже выполняются в этом потоке.
+    await flush() — точка, после которой все сделанные изменения записаны.
+    """
+
+    def __init__(self, store: TaskStore):
+        self.store = store
+        self._lock = threading.RLock()
+        self._tasks: Dict[int, TaskRecord] = {}
+        self._by_status: Dict[str, Set[int]] = {}
+        self._by_channel: Dict[str, Set[int]] = {}
+        # Растёт при каждой полной перезагрузке, чтобы планировщик мог перестроить расписание
+        self.generation = 0
+        # Растёт при изменении набора задач, их текста, статуса или канала (для кэшей списков)
+        self.version = 0
+        self._sorted_ids_cache: Dict[Tuple[Optional[str], Optional[str]], List[int]] = {}
+        self._sorted_ids_version = -1
+        self._executor: Optional[Executor] = None
+        self.write_delay = 0.0
+        # ID -> изменённые поля (None — удаление), ещё не переданные в поток записи
+        self._dirty: Dict[int, Optional[Dict]] = {}
+        # Пачки, которые пишутся прямо сейчас (нужны, чтобы перечитывание их не потеряло)
+        self._writing: List[Dict[int, Optional[Dict]]] = []
+        self._flusher: Optional[asyncio.Task] = None
+        self._last_io: Optional[asyncio.Future] = None
+        self._load(store.load_all())
+
+    def _load(self, tasks: Iterable[Dict]):
+        self.generation += 1
+        self.version += 1
+        self._tasks.clear()
+        self._by_status.clear()
+        self._by_channel.clear()
+        for task in tasks:
+            self._index(TaskRecord.from_dict(task))
+
+    def _reapply_unwritten(self):
+        """После перечитывания возвращаем в память изменения, которые ещё не дошли до хранилища."""
+        for changes in self._writing + [self._dirty]:
+            for task_id, fields in changes.items():
+                record = self._tasks.get(task_id)
+                if record is None:
+                    continue
+                self._unindex(record)
+                if fields is not None:
+                    for key, value in fields.items():
+                        record.set(key, value)
+                    self._index(record)
+
+    def _index(self, record: TaskRecord):
+        self._tasks[record.id] = record
+        self._by_status.setdefault(record.status, set()).add(record.id)
+        self._by_channel.setdefault(record.channel_id, set()).add(record.id)
+
+    def _unindex(self, record: TaskRecord):
+        self._tasks.pop(record.id, None)
+        self._by_status.get(record.status, set()).discard(record.id)
+        self._by_channel.get(record.channel_id, set()).discard(record.id)
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def get(self, task_id: int) -> Optional[TaskRecord]:
+        return self._tasks.get(task_id)
+
+    def find(self, status: Optional[str] = None, channel_id: Optional[str] = None) -> List[TaskRecord]:
+        """Задачи по фильтрам (через индексы), в порядке ID."""
+        with self._lock:
+            if status is None and channel_id is None:
+                # update() переиндексирует запись и сдвигает её в конец словаря, поэтому сортируем
+                return [self._tasks[task_id] for task_id in sorted(self._tasks)]
+            ids: Optional[Set[int]] = None
+            if status is not None:
+                ids = self._by_status.get(status, set())
+            if channel_id is not None:
+                channel_ids = self._by_channel.get(channel_id, set())
+                ids = channel_ids if ids is None else ids & channel_ids
+            return [self._tasks[task_id] for task_id in sorted(ids)]
+
+    def sorted_ids(self, status: Optional[str] = None, channel_id: Optional[str] = None) -> List[int]:
+        """Отсортированные ID задач по фильтрам; кэшируется до следующего изменения набора задач."""
+        with self._lock:
+            if self._sorted_ids_version != self.version:
+                self._sorted_ids_cache.clear()
+                self._sorted_ids_version = self.version
+            key = (status, channel_id)
+            ids = self._sorted_ids_cache.get(key)
+            if ids is None:
+                ids = [record.id for record in self.find(status, channel_id)]
+                self._sorted_ids_cache[key] = ids
+            return ids
+
+    def add(self, task: Dict) -> int:
+        with self._lock:
+            task_id = self.store.insert(task)
+            self._index(TaskRecord.from_dict({"id": task_id, **task}))
+            self.version += 1
+            return task_id
+
+    async def add_async(self, task: Dict) -> int:
+        """Как add, но вставка в хранилище — в потоке записи (если отложенная запись включена)."""
+        if self._executor is None:
+            return self.add(task)
+        task_id = await self._run(self.store.insert, task)
+        with self._lock:
+            self._index(TaskRecord.from_dict({"id": task_id, **task}))
+            self.version += 1
+        return task_id
+
+    def add_many(self, tasks: List[Dict]) -> List[int]:
+        with self._lock:
+            task_ids = self.store.insert_many(tasks)
+            for task_id, task in zip(task_ids, tasks):
+                self._index(TaskRecord.from_dict({"id": task_id, **task}))
+            self.version += 1
+            return task_ids
+
+    def update(self, task_id: int, fields: Dict) -> bool:
+        with self._lock:
+            record = self._tasks.get(task_id)
+            if record is None:
+                return False
+            if self._executor is not None:
+                self._mark_dirty(task_id, {**(self._dirty.get(task_id) or {}), **fields})
+            elif not self.store.update(task_id, fields):
+                return False
+            if any(key in LISTED_FIELDS and getattr(record, key) != value for key, value in fields.items()):
+                self.version += 1
+            self._unindex(record)
+            for key, value in fields.items():
+                record.set(key, value)
+            self._index(record)
+            return True
+
+    def delete(self, task_id: int) -> bool:
+        with self._lock:
+            record = self._tasks.get(task_id)
+            if record is None:
+                return False
+            if self._executor is not None:
+                self._mark_dirty(task_id, None)
+            else:
+                self.store.delete(task_id)
+            self._unindex(record)
+            self.version += 1
+            return True
+
+    def reload(self):
+        """Перечитываем задачи из хранилища (их могли изменить другие процессы)."""
+        with self._lock:
+            self._load(self.store.load_all())
+            self._reapply_unwritten()
+
+    def sync(self) -> bool:
+        """Перечитываем задачи, только если хранилище менял другой процесс.
+
+        При отложенной записи хранилище из цикла событий не читаем: его в фоне проверяет refresh.
+        """
+        if self._executor is None and self.store.has_external_changes():
+            self.reload()
+            return True
+        return False
+
+    async def refresh(self) -> bool:
+        """Как sync, но проверка и чтение хранилища — в потоке записи."""
+        if self._executor is None:
+            return self.sync()
+        if not await self._run(self.store.has_external_changes):
+            return False
+        tasks = await self._run(self.store.load_all)
+        with self._lock:
+            self._load(tasks)
+            self._reapply_unwritten()
+        return True
+
+    def start_write_behind(self, executor: Executor, write_delay: float):
+        """Включаем отложенную запись; вызывается из запущенного цикла событий."""
+        self._executor = executor
+        self.write_delay = write_delay
+
+    def stop_write_behind(self):
+        """Возвращаемся к сквозной записи (после flush, при остановке потока записи)."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+        self._executor = None
+
+    def _run(self, func: Callable, *args) -> "asyncio.Future":
+        # Поток записи один, поэтому операции выполняются в порядке постановки
+        self._last_io = asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        return self._last_io
+
+    def _mark_dirty(self, task_id: int, fields: Optional[Dict]):
+        self._dirty[task_id] = fields
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        while True:
+            await asyncio.sleep(self.write_delay)
+            try:
+                await self.flush()
+                return
+            except Exception:
+                # Ошибка уже в логе, изменения возвращены в _dirty
+                await asyncio.sleep(WRITE_RETRY_DELAY)
+
+    async def flush(self):
+        """Записываем все накопленные изменения; после возврата они в хранилище."""
+        while True:
+            if self._last_io is not None and not self._last_io.done():
+                # Дожидаемся уже начатых записей (в том числе чужого flush)
+                await asyncio.wait([self._last_io])
+            if not self._dirty:
+                return
+            dirty, self._dirty = self._dirty, {}
+            self._writing.append(dirty)
+            try:
+                await self._run(self.store.apply_changes, dirty)
+            except Exception as e:
+                logger.error(f"Failed to write {len(dirty)} task change(s): {e}")
+                # Не теряем изменения: более новые поля тех же задач важнее
+                for task_id, fields in dirty.items():
+                    if task_id not in self._dirty:
+                        self._dirty[task_id] = fields
+                    elif fields is not None and self._dirty[task_id] is not None:
+                        self._dirty[task_id] = {**fields, **self._dirty[task_id]}
+                raise
+            finally:
+                self._writing.remove(dirty)
+
+    def replace_all(self, tasks: List[Dict]):
+        with self._lock:
+            # Полная перезапись делает несохранённые изменения ненужными
+            self._dirty.clear()
+            self.store.save_all(tasks)
+            self._load(tasks)
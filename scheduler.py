@@ -0,0 +1,436 @@
+import asyncio
+import heapq
+import logging
+import time
+
+from collections import deque
+from datetime import datetime
+from functools import partial
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from broadcast import broadcast, resolve_targets, sent_status
+from clock import Clock
+from config import get_snapshot, CatchUpConfig
+from delivery import Delivery, PRIORITY_BACKLOG, PRIORITY_INTERACTIVE, PRIORITY_SCHEDULED, TokenBucket
+from delivery_journal import DeliveryJournal, occurrence_key, task_id_of
+from leases import LeaseManager
+from media import send_post
+from metrics import scheduler_heap_size, scheduler_lag_seconds, scheduler_tick_seconds
+from schedules import Schedule, compile_schedule, missed_occurrences, next_fire_time
+from utils import (
+    flush_tasks,
+    get_repository,
+    get_schedule,
+    get_task,
+    load_tasks,
+    refresh_tasks,
+    update_task,
+    subscribe_task_changes,
+    unsubscribe_task_changes
+)
+
+logger = logging.getLogger(__name__)
+
+# Максимальный сон между проверками кучи — страховка от перевода системных часов
+MAX_SLEEP = 60
+
+# Как часто без кластера проверяем, не добавил ли задачи другой процесс (например, tasks_cli.py)
+STORE_SYNC_INTERVAL = 5
+
+
+class TaskScheduler:
+    """Планировщик на min-heap: спит до ближайшего срабатывания и просыпается при изменении задач.
+
+    Если передан LeaseManager, планировщик работает только с задачами арендованных шардов,
+    а остальные оставляет другим воркерам. Если передан DeliveryJournal, каждая отправка
+    записывается в него до сохранения статуса задачи, и после перезапуска не повторяется.
+    """
+
+    def __init__(self, delivery: Delivery, leases: Optional[LeaseManager] = None, clock: Optional[Clock] = None,
+                 journal: Optional[DeliveryJournal] = None, catch_up: Optional[CatchUpConfig] = None):
+        self.delivery = delivery
+        self.leases = leases
+        self.journal = journal
+        self.catch_up = catch_up or CatchUpConfig()
+        # Пропущенные за простой срабатывания (timestamp) по задачам; такие задачи
+        # попадают в обычное расписание только после того, как их догонят
+        self._backlog: Dict[int, Deque[float]] = {}
+        self.clock = clock or Clock()
+        # Элементы кучи: (время срабатывания, версия, ID задачи)
+        self._heap: List[Tuple[float, int, int]] = []
+        # Актуальная версия расписания каждой задачи; устаревшие элементы кучи пропускаются
+        self._versions: Dict[int, int] = {}
+        self._version_counter = 0
+        self._changed: Set[int] = set()
+        # Задачи, которые сейчас отправляются, и фоновые пачки отправок
+        self._in_flight: Set[int] = set()
+        self._batches: Set[asyncio.Task] = set()
+        # Нужно ли перестроить расписание целиком (сменились шарды или задачи перечитаны)
+        self._resync = False
+        self._generation = get_repository().generation
+        self._wakeup = asyncio.Event()
+
+    def notify(self, task_id: int):
+        """Помечаем задачу изменённой и будим планировщик."""
+        self._changed.add(task_id)
+        self._wakeup.set()
+
+    def _owns(self, task: Dict) -> bool:
+        return self.leases is None or self.leases.owns(task["channel_id"])
+
+    @staticmethod
+    def _compiled(task: Dict) -> Optional[Schedule]:
+        """Расписание, уже скомпилированное в записи репозитория (строка не разбирается заново)."""
+        schedule = get_schedule(task["id"])
+        if schedule is None:
+            try:
+                schedule = compile_schedule(task["schedule_type"], task["schedule_time"])
+            except ValueError:
+                return None
+        return schedule
+
+    def _schedule(self, task: Dict, now: datetime):
+        """Кладём в кучу следующее срабатывание задачи, старые записи становятся неактуальными."""
+        self._version_counter += 1
+        if task["id"] in self._backlog:
+            self._versions.pop(task["id"], None)
+            return
+        fire = next_fire_time(task, now, self._compiled(task)) if self._owns(task) else None
+        if fire is None:
+            self._versions.pop(task["id"], None)
+            return
+        self._versions[task["id"]] = self._version_counter
+        heapq.heappush(self._heap, (fire.timestamp(), self._version_counter, task["id"]))
+
+    def _is_stale(self, entry: Tuple[float, int, int]) -> bool:
+        return self._versions.get(entry[2]) != entry[1]
+
+    def _apply_changes(self, now: datetime):
+        """Пересчитываем расписание только для изменённых задач."""
+        changed, self._changed = self._changed, set()
+        for task_id in changed:
+            if task_id in self._in_flight:
+                # Перепланируем после завершения отправки
+                continue
+            task = get_task(task_id)
+            if task is None:
+                self._versions.pop(task_id, None)
+            else:
+                self._schedule(task, now)
+
+    def _resync_all(self, now: datetime):
+        """Перестраиваем кучу по всем задачам в статусе pending."""
+        self._resync = False
+        self._changed.clear()
+        self._heap = []
+        self._versions = {}
+        for task in load_tasks(status="pending"):
+            if task["id"] not in self._in_flight:
+                self._schedule(task, now)
+        self._generation = get_repository().generation
+
+    async def _heartbeat(self):
+        """Продлеваем аренды шардов и следим за изменениями задач в других процессах."""
+        while True:
+            shards_changed = await asyncio.to_thread(self.leases.heartbeat)
+            await refresh_tasks()
+            if shards_changed or get_repository().generation != self._generation:
+                self._resync = True
+                self._wakeup.set()
+            await asyncio.sleep(self.leases.ttl / 3)
+
+    async def _watch_store(self):
+        """Без кластера аренды не продлеваются, но задачи в хранилище может изменить импорт."""
+        while True:
+            await asyncio.sleep(STORE_SYNC_INTERVAL)
+            if await refresh_tasks():
+                self._resync = True
+                self._wakeup.set()
+
+    def _pop_due(self, now_ts: float) -> List[Tuple[int, float]]:
+        """Достаём из кучи все задачи, время которых наступило, вместе с временем срабатывания."""
+        due = []
+        while self._heap and self._heap[0][0] <= now_ts:
+            entry = heapq.heappop(self._heap)
+            if not self._is_stale(entry):
+                self._versions.pop(entry[2], None)
+                due.append((entry[2], entry[0]))
+                scheduler_lag_seconds.observe(max(0.0, now_ts - entry[0]))
+        return due
+
+    def _start_batch(self, due: List[Tuple[int, float]], now: datetime):
+        """Отправляем пачку в фоне, чтобы цикл не ждал медленные каналы."""
+        task_ids = [task_id for task_id, _ in due]
+        self._in_flight.update(task_ids)
+        batch = asyncio.create_task(self._send_due(due, task_ids, now))
+        self._batches.add(batch)
+        batch.add_done_callback(self._batches.discard)
+
+    async def _send_due(self, due: List[Tuple[int, float]], task_ids: List[int], now: datetime):
+        """Отправляем наступившие задачи и сохраняем их статусы."""
+        try:
+            await self._deliver(due, now)
+        finally:
+            self._in_flight.difference_update(task_ids)
+            # Повторяющиеся задачи получили новое время — пересчитаем, сколько спать
+            self._wakeup.set()
+
+    @staticmethod
+    def _occurrence_key(task: Dict, fire_ts: float) -> str:
+        recurring = TaskScheduler._compiled(task).recurring
+        return occurrence_key(task["id"], fire_ts if recurring else None)
+
+    def _complete(self, task: Dict, fields: Dict, fired_at: datetime, error: Optional[str] = None):
+        """Сохраняем срабатывание задачи; error — отправить не удалось (целиком или в часть каналов).
+
+        fired_at — время срабатывания по расписанию, а не момент отправки: иначе задержка
+        тика и очереди копилась бы в last_run и интервальные задачи уплывали бы.
+        """
+        if self._compiled(task).recurring:
+            # Для повторяющихся задач статус не меняем, запоминаем момент срабатывания:
+            # после ошибки задача ждёт следующего срабатывания, а не уходит в список ошибок
+            if error is not None or task.get("last_error"):
+                fields = {**fields, "last_error": error}
+            update_task(task["id"], last_sent_date=fired_at.date().isoformat(), last_run=fired_at.timestamp(),
+                        **fields)
+        elif error is not None:
+            # Разовая задача уходит в список ошибок: админ может посмотреть её и повторить из меню
+            update_task(task["id"], status="failed", last_error=error, **fields)
+        else:
+            update_task(task["id"], status="done", **fields)
+
+    async def _reconcile(self):
+        """Доводим до конца срабатывания, отправленные до падения процесса, но не сохранённые в задачах."""
+        completed = []
+        incomplete = await asyncio.to_thread(self.journal.incomplete)
+        for key, sent in incomplete.items():
+            task = get_task(task_id_of(key))
+            if task is None or task["status"] in ("done", "skipped"):
+                completed.append(key)
+                continue
+            if task["status"] != "pending" or not self._owns(task):
+                # Задачи из списка ошибок ждут повтора, журнал не даст отправить их дважды
+                continue
+            occurrence = key.rsplit(":", 1)[1]
+            sent_at = self.clock.now() if occurrence == "once" else datetime.fromtimestamp(float(occurrence))
+            if occurrence != "once" and ((task.get("last_run") or 0) >= sent_at.timestamp()
+                                         or (task.get("last_sent_date") or "") >= sent_at.date().isoformat()):
+                # Старое срабатывание (в том числе недосланная рассылка): задача с тех пор уже срабатывала,
+                # с этим ключом больше ничего не отправится
+                completed.append(key)
+                continue
+            targets = (resolve_targets(task["targets"], get_snapshot().channel_groups)
+                       if task.get("targets") else [task["channel_id"]])
+            if any(chat_id not in sent for chat_id in targets):
+                # Рассылка прервалась на середине: при следующем срабатывании с тем же ключом
+                # уйдут только недостающие каналы
+                continue
+            fields = {}
+            if task.get("targets"):
+                fields["deliveries"] = {chat_id: sent_status(sent[chat_id]) for chat_id in targets}
+            self._complete(task, fields, sent_at)
+            completed.append(key)
+            logger.info(f"Task #{task['id']} was sent before restart, not sending it again")
+        await self._complete_journal(completed)
+
+    async def _complete_journal(self, keys: List[str]):
+        """Закрываем срабатывания в журнале, только когда статусы задач уже записаны на диск.
+
+        Иначе после падения задача осталась бы pending без записи в журнале и ушла бы повторно.
+        """
+        if not keys:
+            return
+        try:
+            await flush_tasks()
+        except Exception:
+            # Срабатывания останутся незавершёнными, reconcile доведёт их после перезапуска
+            return
+        await asyncio.to_thread(self.journal.complete, keys)
+
+    def _plan_catch_up(self, now: datetime):
+        """Один проход по всем задачам при старте: решаем, что делать с пропущенным за простой."""
+        skipped = queued = 0
+        for task in load_tasks(status="pending"):
+            if not self._owns(task):
+                continue
+            schedule = self._compiled(task)
+            if schedule is None:
+                continue
+            missed = missed_occurrences(task, now, self.catch_up.grace, self.catch_up.max_replay, schedule)
+            if not missed:
+                continue
+            policy = task.get("catch_up") or self.catch_up.policy
+            if policy == "skip":
+                if schedule.recurring:
+                    # Считаем последнее пропущенное срабатывание состоявшимся, дальше — по расписанию
+                    update_task(task["id"], last_sent_date=missed[-1].date().isoformat(),
+                                last_run=missed[-1].timestamp())
+                else:
+                    update_task(task["id"], status="skipped")
+                skipped += 1
+            else:
+                # coalesce: одна отправка за всё пропущенное, включая срабатывание, наступившее только что
+                occurrences = missed if policy == "replay" else missed_occurrences(task, now, 0, 1, schedule)
+                self._backlog[task["id"]] = deque(fire.timestamp() for fire in occurrences)
+                queued += len(occurrences)
+        if skipped or queued:
+            logger.info(f"Catch-up after downtime: {skipped} task(s) skipped, {queued} missed send(s) queued")
+
+    async def _send_backlog(self):
+        """Отправляем пропущенные срабатывания не быстрее catch_up.rate в секунду.
+
+        Идём раундами: в раунде — следующее пропущенное срабатывание каждой задачи, так что
+        повторы одной задачи уходят по порядку, а обычное расписание работает параллельно.
+        """
+        bucket = TokenBucket(self.catch_up.rate, max(1.0, self.catch_up.rate))
+        while self._backlog:
+            sends = []
+            for task_id, occurrences in list(self._backlog.items()):
+                await bucket.acquire()
+                entry = (task_id, occurrences.popleft())
+                sends.append(asyncio.create_task(self._deliver([entry], self.clock.now(), catch_up=True)))
+            await asyncio.gather(*sends, return_exceptions=True)
+
+            now = self.clock.now()
+            for task_id in [task_id for task_id, occurrences in self._backlog.items() if not occurrences]:
+                del self._backlog[task_id]
+                task = get_task(task_id)
+                if task is not None:
+                    self._schedule(task, now)
+            self._wakeup.set()
+
+    async def _deliver(self, due: List[Tuple[int, float]], now: datetime, catch_up: bool = False):
+        pending = []
+        completed = []
+        for task_id, fire_ts in due:
+            task = get_task(task_id)
+            # Аренду проверяем перед самой отправкой: шард мог уйти другому воркеру
+            if task is not None and task["status"] == "pending" and self._owns(task):
+                pending.append((task, self._occurrence_key(task, fire_ts), fire_ts))
+
+        # Все наступившие задачи уходят в очередь отправки параллельно
+        results = await asyncio.gather(*(self._send_task(task, key, self._priority(task, catch_up))
+                                         for task, key, _ in pending),
+                                       return_exceptions=True)
+
+        for (task, key, fire_ts), result in zip(pending, results):
+            error = None
+            fields = {}
+            if isinstance(result, Exception):
+                error = str(result)
+            elif result is not None:
+                # Рассылка: статус по каждому каналу сохраняем в задаче
+                fields["deliveries"] = result
+                failed = [f"{chat_id}: {status['error']}" for chat_id, status in result.items()
+                          if status["status"] == "failed"]
+                error = "; ".join(failed) or None
+            if error is not None:
+                logger.error(f"Failed to send task #{task['id']} to {task['channel_id']}: {error}")
+            # Отправка засчитывается за своё срабатывание (и догоняющая — за пропущенное), а не за текущий момент
+            self._complete(task, fields, datetime.fromtimestamp(fire_ts), error)
+            if error is None or self._compiled(task).recurring:
+                # Незавершённая в журнале разовая задача при повторе из меню не уйдёт в уже полученные каналы
+                completed.append(key)
+            # Перечитываем задачу: пока шла отправка, админ мог её изменить
+            task = get_task(task["id"])
+            if task is not None:
+                self._schedule(task, now)
+
+        if self.journal is not None:
+            await self._complete_journal(completed)
+
+    @staticmethod
+    def _priority(task: Dict, catch_up: bool) -> int:
+        """Немедленные задачи админа обгоняют расписание, догоняющие отправки идут последними."""
+        if catch_up:
+            return PRIORITY_BACKLOG
+        if task["schedule_type"] == "immediate":
+            return PRIORITY_INTERACTIVE
+        return PRIORITY_SCHEDULED
+
+    async def _send_task(self, task: Dict, key: str, priority: int = PRIORITY_SCHEDULED) -> Optional[Dict[str, Dict]]:
+        """Отправляем задачу; для рассылки возвращаем статусы по каналам."""
+        # Журнал коммитит на диск, поэтому обращаемся к нему из потока, а не из цикла событий
+        sent = await asyncio.to_thread(self.journal.sent, key) if self.journal is not None else {}
+        on_sent = partial(self._record_sent, key) if self.journal is not None else None
+        if not task.get("targets"):
+            if task["channel_id"] in sent:
+                # Уже отправлено до перезапуска — только сохраняем статус
+                return None
+            message_ids = await send_post(self.delivery, task["channel_id"], task, priority)
+            if on_sent is not None:
+                await on_sent(task["channel_id"], message_ids)
+            return None
+        targets = resolve_targets(task["targets"], get_snapshot().channel_groups)
+        # Разовая рассылка после сбоя досылается только в каналы, куда не дошла;
+        # повторяющаяся каждый раз уходит во все каналы
+        recurring = self._compiled(task).recurring
+        previous = {} if recurring else dict(task.get("deliveries") or {})
+        previous.update((chat_id, sent_status(message_ids)) for chat_id, message_ids in sent.items())
+        return await broadcast(self.delivery, task, targets, previous, on_sent, priority)
+
+    async def _record_sent(self, key: str, chat_id: str, message_ids: List[int]):
+        """Записываем отправку в журнал.
+
+        Ошибка журнала — не ошибка отправки: сообщение уже в канале, и разовая задача не должна
+        попасть в список ошибок, иначе повтор из меню отправил бы его ещё раз.
+        """
+        try:
+            await asyncio.to_thread(self.journal.record, key, chat_id, message_ids)
+        except Exception as e:
+            logger.error(f"Failed to record send of {key} to {chat_id} in the delivery journal: {e}")
+
+    async def run(self):
+        """Основной цикл планировщика."""
+        subscribe_task_changes(self.notify)
+        scheduler_heap_size.set_function(lambda: len(self._heap))
+        heartbeat = None
+        try:
+            if self.leases is not None:
+                await asyncio.to_thread(self.leases.heartbeat)
+                heartbeat = asyncio.create_task(self._heartbeat())
+            else:
+                heartbeat = asyncio.create_task(self._watch_store())
+            if self.journal is not None:
+                await self._reconcile()
+                await asyncio.to_thread(self.journal.prune)
+            self._plan_catch_up(self.clock.now())
+            self._resync_all(self.clock.now())
+            if self._backlog:
+                catch_up = asyncio.create_task(self._send_backlog())
+                self._batches.add(catch_up)
+                catch_up.add_done_callback(self._batches.discard)
+
+            while True:
+                self._wakeup.clear()
+                tick_started = time.monotonic()
+                now = self.clock.now()
+                if self._resync:
+                    self._resync_all(now)
+                elif self._changed:
+                    self._apply_changes(now)
+
+                due = self._pop_due(now.timestamp())
+                if due:
+                    self._start_batch(due, now)
+
+                while self._heap and self._is_stale(self._heap[0]):
+                    heapq.heappop(self._heap)
+
+                scheduler_tick_seconds.observe(time.monotonic() - tick_started)
+                timeout = MAX_SLEEP
+                if self._heap:
+                    timeout = min(MAX_SLEEP, max(0.0, self._heap[0][0] - now.timestamp()))
+                await self.clock.wait(self._wakeup, timeout, self._batches)
+        finally:
+            unsubscribe_task_changes(self.notify)
+            if heartbeat is not None:
+                heartbeat.cancel()
+            for batch in list(self._batches):
+                batch.cancel()
+
+
+async def task_scheduler(delivery: Delivery, leases: Optional[LeaseManager] = None,
+                         journal: Optional[DeliveryJournal] = None, catch_up: Optional[CatchUpConfig] = None):
+    """Планировщик: спит до ближайшей задачи и отправляет сообщения через очередь доставки."""
+    await TaskScheduler(delivery, leases, journal=journal, catch_up=catch_up).run()
@@ -0,0 +1,295 @@
+from bisect import bisect_left
+from collections import deque
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+from typing import Dict, FrozenSet, List, Optional
+
+SCHEDULE_TYPES = ("immediate", "delayed", "daily", "weekly", "interval", "cron")
+
+# Политики догоняющей отправки после простоя: пропустить, отправить один раз, повторить все
+CATCH_UP_POLICIES = ("skip", "coalesce", "replay")
+
+# Сколько пропущенных срабатываний одной задачи перебирать при старте (частые interval за долгий простой)
+MAX_MISSED_SCAN = 100000
+
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+
+class Schedule:
+    """Скомпилированное расписание задачи."""
+
+    recurring = False
+
+    def next_after(self, after: datetime) -> Optional[datetime]:
+        """Первое срабатывание строго после after (None — больше не срабатывает)."""
+        raise NotImplementedError
+
+
+class ImmediateSchedule(Schedule):
+    def next_after(self, after: datetime) -> Optional[datetime]:
+        return after
+
+
+class DelayedSchedule(Schedule):
+    def __init__(self, at: datetime):
+        self.at = at
+
+    def next_after(self, after: datetime) -> Optional[datetime]:
+        return self.at if self.at > after else None
+
+
+class DailySchedule(Schedule):
+    recurring = True
+
+    def __init__(self, at: time):
+        self.at = at
+
+    def next_after(self, after: datetime) -> Optional[datetime]:
+        fire = datetime.combine(after.date(), self.at)
+        if fire <= after:
+            fire += timedelta(days=1)
+        return fire
+
+
+class WeeklySchedule(Schedule):
+    """Раз в неделю (или в несколько дней недели) в фиксированное время."""
+
+    recurring = True
+
+    def __init__(self, weekdays: FrozenSet[int], at: time):
+        self.weekdays = weekdays
+        self.at = at
+
+    def next_after(self, after: datetime) -> Optional[datetime]:
+        fire = datetime.combine(after.date(), self.at)
+        if fire <= after:
+            fire += timedelta(days=1)
+        # Не больше 7 шагов: ближайший подходящий день недели
+        while fire.weekday() not in self.weekdays:
+            fire += timedelta(days=1)
+        return fire
+
+
+class IntervalSchedule(Schedule):
+    """Каждые N секунд начиная с момента предыдущей отправки (первый раз — с создания задачи)."""
+
+    recurring = True
+
+    def __init__(self, every: timedelta):
+        self.every = every
+
+    def next_after(self, after: datetime) -> Optional[datetime]:
+        return after + self.every
+
+
+class CronSchedule(Schedule):
+    """Cron-выражение из пяти полей: минута, час, день месяца, месяц, день недели."""
+
+    recurring = True
+
+    # Не ищем дальше нескольких лет (29 февраля бывает раз в 4–8 лет, 30 февраля — никогда)
+    MAX_YEARS = 8
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression must have 5 fields: {expression!r}")
+        self.expression = expression
+        self.minutes = _parse_cron_field(fields[0], 0, 59)
+        self.hours = _parse_cron_field(fields[1], 0, 23)
+        self.days = _parse_cron_field(fields[2], 1, 31)
+        self.months = _parse_cron_field(fields[3], 1, 12)
+        # В cron воскресенье — и 0, и 7
+        self.weekdays = frozenset(day % 7 for day in _parse_cron_field(fields[4], 0, 7))
+        self._sorted_minutes = sorted(self.minutes)
+        self._sorted_hours = sorted(self.hours)
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    def _day_matches(self, day: date) -> bool:
+        day_match = day.day in self.days
+        weekday_match = (day.weekday() + 1) % 7 in self.weekdays
+        # Как в классическом cron: если заданы оба поля, достаточно совпадения любого
+        if self._any_day:
+            return weekday_match
+        if self._any_weekday:
+            return day_match
+        return day_match or weekday_match
+
+    def next_after(self, after: datetime) -> Optional[datetime]:
+        fire = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = after.year + self.MAX_YEARS
+        # Перескакиваем целыми месяцами/днями/часами, а не перебираем минуты
+        while fire.year <= limit:
+            if fire.month not in self.months:
+                year, month = (fire.year + 1, 1) if fire.month == 12 else (fire.year, fire.month + 1)
+                fire = datetime(year, month, 1)
+                continue
+            if not self._day_matches(fire.date()):
+                fire = datetime.combine(fire.date() + timedelta(days=1), time())
+                continue
+            if fire.hour not in self.hours:
+                hour = _next_value(self._sorted_hours, fire.hour)
+                if hour is None:
+                    fire = datetime.combine(fire.date() + timedelta(days=1), time())
+                else:
+                    fire = fire.replace(hour=hour, minute=0)
+                continue
+            minute = _next_value(self._sorted_minutes, fire.minute)
+            if minute is None:
+                fire = fire.replace(minute=0) + timedelta(hours=1)
+                continue
+            return fire.replace(minute=minute)
+        return None
+
+
+def _next_value(values: List[int], current: int) -> Optional[int]:
+    """Ближайшее значение из отсортированного списка, не меньшее current."""
+    index = bisect_left(values, current)
+    return values[index] if index < len(values) else None
+
+
+def _parse_cron_field(field: str, low: int, high: int) -> FrozenSet[int]:
+    values = set()
+    for part in field.split(","):
+        step = 1
+        if "/" in part:
+            part, step_str = part.split("/", 1)
+            step = int(step_str)
+            if step <= 0:
+                raise ValueError(f"Invalid cron step: {field!r}")
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start_str, end_str = part.split("-", 1)
+            start, end = int(start_str), int(end_str)
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if start < low or end > high or start > end:
+            raise ValueError(f"Cron field {field!r} is out of range {low}-{high}")
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+
+def _parse_weekdays(value: str) -> FrozenSet[int]:
+    weekdays = set()
+    for name in value.lower().split(","):
+        if name not in WEEKDAYS:
+            raise ValueError(f"Unknown weekday: {name!r}")
+        weekdays.add(WEEKDAYS.index(name))
+    return frozenset(weekdays)
+
+
+@lru_cache(maxsize=4096)
+def compile_schedule(schedule_type: str, schedule_time: Optional[str]) -> Schedule:
+    """Разбираем строку расписания один раз; результат кэшируется.
+
+    Форматы schedule_time:
+    - immediate: None
+    - delayed: "YYYY-MM-DD HH:MM:SS"
+    - daily: "HH:MM:SS"
+    - weekly: "mon,wed,fri HH:MM:SS"
+    - interval: число секунд, например "3600"
+    - cron: "*/15 9-18 * * 1-5"
+    """
+    if schedule_type == "immediate":
+        return ImmediateSchedule()
+    if not schedule_time:
+        raise ValueError(f"Schedule type {schedule_type!r} requires schedule_time")
+    if schedule_type == "delayed":
+        return DelayedSchedule(datetime.strptime(schedule_time, "%Y-%m-%d %H:%M:%S"))
+    if schedule_type == "daily":
+        return DailySchedule(datetime.strptime(schedule_time, "%H:%M:%S").time())
+    if schedule_type == "weekly":
+        weekdays, at = schedule_time.split(" ", 1)
+        return WeeklySchedule(_parse_weekdays(weekdays), datetime.strptime(at, "%H:%M:%S").time())
+    if schedule_type == "interval":
+        seconds = int(schedule_time)
+        if seconds <= 0:
+            raise ValueError(f"Interval must be positive: {schedule_time!r}")
+        return IntervalSchedule(timedelta(seconds=seconds))
+    if schedule_type == "cron":
+        return CronSchedule(schedule_time)
+    raise ValueError(f"Unknown schedule type: {schedule_type!r}")
+
+
+def next_fire_time(task: Dict, now: datetime, schedule: Optional[Schedule] = None) -> Optional[datetime]:
+    """Вычисляем ближайшее время срабатывания задачи (None — задача больше не сработает).
+
+    schedule — уже скомпилированное расписание задачи (из TaskRecord), чтобы не разбирать строку заново.
+    """
+    if task["status"] != "pending":
+        return None
+
+    if schedule is None:
+        try:
+            schedule = compile_schedule(task["schedule_type"], task["schedule_time"])
+        except ValueError:
+            return None
+
+    if not schedule.recurring:
+        # Для immediate — сразу, для delayed — в назначенное время, даже если оно уже прошло
+        return now if isinstance(schedule, ImmediateSchedule) else schedule.at
+
+    if isinstance(schedule, DailySchedule):
+        # Если сегодня уже отправляли — следующий запуск завтра,
+        # иначе сегодня (прошедшее время означает, что отправить нужно сразу)
+        fire = datetime.combine(now.date(), schedule.at)
+        if task.get("last_sent_date") == now.date().isoformat():
+            fire += timedelta(days=1)
+        return fire
+
+    # Остальные повторяющиеся расписания считаются от последней отправки или от создания задачи;
+    # от now — только у старых задач без created_at (иначе пересчёт сдвигал бы срабатывание)
+    base = _run_base(task)
+    return schedule.next_after(base if base is not None else now)
+
+
+def _run_base(task: Dict) -> Optional[datetime]:
+    """От какого момента считать следующее срабатывание: последняя отправка, иначе создание задачи."""
+    timestamp = task.get("last_run")
+    if timestamp is None:
+        timestamp = task.get("created_at")
+    return datetime.fromtimestamp(timestamp) if timestamp is not None else None
+
+
+def missed_occurrences(task: Dict, now: datetime, grace: float, limit: int,
+                       schedule: Optional[Schedule] = None) -> List[datetime]:
+    """Срабатывания, опоздавшие больше чем на grace секунд (например, пока бот был выключен).
+
+    Возвращает не больше limit последних пропусков по порядку. Немедленные задачи, ни разу
+    не отправленные ежедневные и старые задачи без created_at пропусков не имеют; остальные
+    повторяющиеся считаются от последней отправки или от создания (как в next_fire_time).
+    """
+    if task["status"] != "pending":
+        return []
+    if schedule is None:
+        try:
+            schedule = compile_schedule(task["schedule_type"], task["schedule_time"])
+        except ValueError:
+            return []
+    cutoff = now - timedelta(seconds=grace)
+
+    if not schedule.recurring:
+        if isinstance(schedule, DelayedSchedule) and schedule.at <= cutoff:
+            return [schedule.at]
+        return []
+
+    if isinstance(schedule, DailySchedule):
+        if not task.get("last_sent_date"):
+            return []
+        fire = datetime.combine(date.fromisoformat(task["last_sent_date"]) + timedelta(days=1), schedule.at)
+    else:
+        base = _run_base(task)
+        if base is None:
+            return []
+        fire = schedule.next_after(base)
+
+    missed = deque(maxlen=limit)
+    scanned = 0
+    while fire is not None and fire <= cutoff and scanned < MAX_MISSED_SCAN:
+        missed.append(fire)
+        scanned += 1
+        fire = schedule.next_after(fire)
+    return list(missed)
@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import time
+
+from typing import Dict, List, Optional, Set, Tuple
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+from metrics import delivery_sender_healthy
+
+logger = logging.getLogger(__name__)
+
+# Методы, которые ссылаются на file_id. file_id принадлежит боту, который получил файл,
+# поэтому такие отправки всегда делает основной бот (он же принимает файлы от админов)
+FILE_METHODS = frozenset((
+    "send_photo", "send_video", "send_document", "send_animation", "send_audio", "send_media_group"
+))
+
+# Статусы участника, при которых бот может писать в чат (в каналах ещё нужен can_post_messages)
+POSTING_STATUSES = ("creator", "administrator", "member")
+
+# Ошибки Telegram, означающие, что у этого бота нет доступа к чату (другой бот может справиться)
+ACCESS_ERRORS = ("not enough rights", "chat not found", "chat_write_forbidden", "need administrator rights")
+
+
+def is_access_error(error: Exception) -> bool:
+    if isinstance(error, TelegramForbiddenError):
+        return True
+    return isinstance(error, TelegramBadRequest) and any(text in str(error).lower() for text in ACCESS_ERRORS)
+
+
+class Sender:
+    """Бот-отправитель пула: свой лимит скорости и состояние здоровья."""
+
+    def __init__(self, bot, bucket, failure_threshold: int, cooldown: float):
+        self.bot = bot
+        self.name = str(bot.id)
+        self.bucket = bucket
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.unhealthy_until = 0.0
+        delivery_sender_healthy.set(1, self.name)
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.unhealthy_until
+
+    def record_success(self):
+        if self.failures:
+            self.failures = 0
+            delivery_sender_healthy.set(1, self.name)
+
+    def record_failure(self):
+        """Сетевые и серверные ошибки подряд выводят бота из ротации на cooldown секунд."""
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            # Каждый следующий провал после порога удваивает паузу
+            pause = min(self.cooldown * 2 ** (self.failures - self.failure_threshold), self.cooldown * 10)
+            self.unhealthy_until = time.monotonic() + pause
+            delivery_sender_healthy.set(0, self.name)
+            logger.warning(f"Sender bot {self.name} marked unhealthy for {pause:.0f}s after {self.failures} failures")
+
+
+class SenderPool:
+    """Несколько токенов ботов для отправки: балансировка по каналам, здоровье, отказоустойчивость.
+
+    Для каждого чата один раз (с кэшем на eligibility_ttl) выясняется, какие боты пула могут
+    в нём писать (getChatMember). Отправка уходит к здоровому подходящему боту с самым большим
+    запасом токенов; при ошибке задание переходит к другому боту. Первый бот пула — основной:
+    только он отправляет вложения по file_id.
+    """
+
+    def __init__(self, senders: List[Sender], eligibility_ttl: float = 3600):
+        self.senders = senders
+        self.primary = senders[0]
+        self.eligibility_ttl = eligibility_ttl
+        self._eligible: Dict[str, Tuple[float, Set[Sender]]] = {}
+        self._checks: Dict[str, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self.senders)
+
+    async def _can_post(self, sender: Sender, chat_id: str) -> bool:
+        try:
+            member = await sender.bot.get_chat_member(chat_id=chat_id, user_id=sender.bot.id)
+        except Exception as e:
+            if is_access_error(e):
+                return False
+            # Проверить не удалось (сеть и т.п.) — считаем подходящим, ошибка отправки покажет правду
+            logger.warning(f"Could not check sender bot {sender.name} in {chat_id}: {e}")
+            return True
+        return member.status in POSTING_STATUSES and getattr(member, "can_post_messages", None) is not False
+
+    async def _check_chat(self, chat_id: str) -> Set[Sender]:
+        results = await asyncio.gather(*(self._can_post(sender, chat_id) for sender in self.senders))
+        eligible = {sender for sender, ok in zip(self.senders, results) if ok}
+        if not eligible:
+            logger.warning(f"No sender bot can post to {chat_id}, trying all of them")
+            eligible = set(self.senders)
+        self._eligible[chat_id] = (time.monotonic() + self.eligibility_ttl, eligible)
+        return eligible
+
+    async def eligible(self, chat_id: str) -> Set[Sender]:
+        """Боты пула, которые могут писать в чат."""
+        if len(self.senders) == 1:
+            return {self.primary}
+        cached = self._eligible.get(chat_id)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        # Одна проверка на чат, даже если отправок в него ждут несколько воркеров
+        check = self._checks.get(chat_id)
+        if check is None:
+            check = asyncio.ensure_future(self._check_chat(chat_id))
+            self._checks[chat_id] = check
+            check.add_done_callback(lambda _: self._checks.pop(chat_id, None))
+        return await check
+
+    def revoke(self, sender: Sender, chat_id: str):
+        """Бот потерял доступ к чату — больше не выбираем его для этого чата."""
+        cached = self._eligible.get(chat_id)
+        if cached is not None and len(cached[1]) > 1:
+            self._eligible[chat_id] = (cached[0], cached[1] - {sender})
+
+    async def candidates(self, chat_id: str, method: str, kwargs: Dict, excluded: Set[Sender]) -> List[Sender]:
+        """Подходящие для задания боты, лучшие первыми."""
+        if method in FILE_METHODS:
+            return [] if self.primary in excluded else [self.primary]
+        eligible = await self.eligible(chat_id) - excluded
+        from_chat_id = kwargs.get("from_chat_id")
+        if from_chat_id is not None:
+            # Копировать сообщение может только бот, у которого есть доступ к исходному каналу
+            both = eligible & await self.eligible(str(from_chat_id))
+            eligible = both or eligible
+        healthy = [sender for sender in eligible if sender.healthy]
+        # Если нездоровы все — всё равно пробуем, чтобы задания не застревали
+        return sorted(healthy or eligible, key=lambda sender: -sender.bucket.available())
+
+    async def pick(self, chat_id: str, method: str, kwargs: Dict, excluded: Set[Sender]) -> Optional[Sender]:
+        candidates = await self.candidates(chat_id, method, kwargs, excluded)
+        return candidates[0] if candidates else None
@@ -0,0 +1,114 @@
+"""Пробный прогон расписания на виртуальных часах: какие сообщения и когда были бы отправлены.
+
+Запуск: python simulation.py --days 30 [--synthetic 10000] [--output sends.jsonl]
+Telegram не вызывается, задачи в хранилище не меняются.
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import utils
+from clock import SimulationFinished, VirtualClock
+from scheduler import TaskScheduler
+from storage import MemoryTaskStore
+
+
+class SimulatedSend(NamedTuple):
+    at: datetime
+    chat_id: str
+    method: str
+    kwargs: Dict[str, Any]
+
+
+class DryRunDelivery:
+    """Вместо отправки записываем вызов с виртуальным временем."""
+
+    def __init__(self, clock: VirtualClock):
+        self.clock = clock
+        self.sends: List[SimulatedSend] = []
+
+    async def send(self, chat_id: str, method: str = "send_message", priority: int = 0, **kwargs):
+        self.sends.append(SimulatedSend(self.clock.now(), chat_id, method, kwargs))
+
+
+async def simulate(tasks: List[Dict], start: datetime, end: datetime) -> List[SimulatedSend]:
+    """Прогоняем планировщик по задачам от start до end и возвращаем отправки по порядку."""
+    clock = VirtualClock(start, end)
+    delivery = DryRunDelivery(clock)
+    # Работаем с копией задач в памяти, настоящее хранилище не трогаем
+    utils.set_store(MemoryTaskStore([dict(task) for task in tasks]))
+    try:
+        await TaskScheduler(delivery, clock=clock).run()
+    except SimulationFinished:
+        pass
+    finally:
+        utils.set_store(None)
+    return [send for send in delivery.sends if send.at < end]
+
+
+def summarize(sends: List[SimulatedSend]) -> Dict[str, Any]:
+    """Пиковые нагрузки: сколько отправок приходится на секунду, минуту и один чат за минуту."""
+    if not sends:
+        return {"sends": 0}
+    per_second = Counter(send.at.replace(microsecond=0) for send in sends)
+    per_minute = Counter(send.at.replace(second=0, microsecond=0) for send in sends)
+    per_chat_minute = Counter((send.chat_id, send.at.replace(second=0, microsecond=0)) for send in sends)
+    peak_second, peak_second_count = per_second.most_common(1)[0]
+    peak_minute, peak_minute_count = per_minute.most_common(1)[0]
+    (peak_chat, peak_chat_minute), peak_chat_count = per_chat_minute.most_common(1)[0]
+    return {
+        "sends": len(sends),
+        "first": sends[0].at.isoformat(),
+        "last": sends[-1].at.isoformat(),
+        "chats": len({send.chat_id for send in sends}),
+        "peak_per_second": {"at": peak_second.isoformat(), "sends": peak_second_count},
+        "peak_per_minute": {"at": peak_minute.isoformat(), "sends": peak_minute_count},
+        "peak_per_chat_minute": {"chat_id": peak_chat, "at": peak_chat_minute.isoformat(), "sends": peak_chat_count},
+    }
+
+
+def synthetic_tasks(count: int, channels: int = 100, seed: int = 1) -> List[Dict]:
+    """Ежедневные задачи со случайным временем, поровну по каналам."""
+    rnd = random.Random(seed)
+    return [
+        {"id": i + 1, "message": f"synthetic #{i + 1}", "channel_id": f"-100{1000000 + i % channels}",
+         "schedule_type": "daily", "schedule_time": f"{rnd.randrange(24):02d}:{rnd.randrange(0, 60, 5):02d}:00",
+         "status": "pending", "last_sent_date": None}
+        for i in range(count)
+    ]
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Dry-run the schedule on a virtual clock")
+    parser.add_argument("--start", type=datetime.fromisoformat, default=None,
+                        help="Start of the simulation (ISO format), default: now")
+    parser.add_argument("--days", type=float, default=7, help="Length of the simulation in days")
+    parser.add_argument("--synthetic", type=int, default=0,
+                        help="Simulate N generated daily tasks instead of the tasks from the store")
+    parser.add_argument("--output", help="Write every send as a JSON line to this file")
+    args = parser.parse_args(argv)
+
+    start = args.start or datetime.now()
+    end = start + timedelta(days=args.days)
+    tasks = synthetic_tasks(args.synthetic) if args.synthetic else utils.load_tasks()
+
+    sends = asyncio.run(simulate(tasks, start, end))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            for send in sends:
+                file.write(json.dumps({"at": send.at.isoformat(), "chat_id": send.chat_id,
+                                       "method": send.method, **send.kwargs}, ensure_ascii=False) + "\n")
+    summary = {"start": start.isoformat(), "end": end.isoformat(), "tasks": len(tasks), **summarize(sends)}
+    json.dump(summary, sys.stdout, indent=2, ensure_ascii=False)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,478 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+from typing import Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Поля задачи, под которые в SQLite есть отдельные колонки; остальные лежат в extra (JSON)
+TASK_COLUMNS = ("id", "message", "channel_id", "schedule_type", "schedule_time", "status", "last_sent_date")
+
+# Сколько строк SQLite читаем за раз при потоковой выгрузке
+ITER_PAGE_SIZE = 1000
+
+
+class TaskStore:
+    """Интерфейс хранилища задач."""
+
+    def load_all(self, status: Optional[str] = None) -> List[Dict]:
+        raise NotImplementedError
+
+    def save_all(self, tasks: List[Dict]):
+        raise NotImplementedError
+
+    def get(self, task_id: int) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def insert(self, task: Dict) -> int:
+        """Сохраняем новую задачу (без id) и возвращаем присвоенный ID."""
+        raise NotImplementedError
+
+    def insert_many(self, tasks: List[Dict]) -> List[int]:
+        """Сохраняем пачку новых задач (одной транзакцией, где это возможно) и возвращаем их ID."""
+        return [self.insert(task) for task in tasks]
+
+    def iter_all(self, status: Optional[str] = None) -> Iterator[Dict]:
+        """Задачи по одной в порядке ID — для выгрузки без копии всех задач в памяти."""
+        yield from sorted(self.load_all(status), key=lambda task: task["id"])
+
+    def update(self, task_id: int, fields: Dict) -> bool:
+        """Обновляем поля задачи, возвращаем False, если задачи нет."""
+        raise NotImplementedError
+
+    def delete(self, task_id: int) -> bool:
+        raise NotImplementedError
+
+    def apply_changes(self, changes: Dict[int, Optional[Dict]]):
+        """Записываем пачку изменений (одной транзакцией, где это возможно): ID -> поля или None для удаления."""
+        for task_id, fields in changes.items():
+            if fields is None:
+                self.delete(task_id)
+            else:
+                self.update(task_id, fields)
+
+    def has_external_changes(self) -> bool:
+        """Изменяли ли хранилище другие процессы с прошлой проверки."""
+        return False
+
+    def close(self):
+        pass
+
+
+class MemoryTaskStore(TaskStore):
+    """Хранилище в памяти процесса (для симуляций, ничего не пишет на диск)."""
+
+    def __init__(self, tasks: Optional[List[Dict]] = None):
+        self._tasks: Dict[int, Dict] = {}
+        self._next_id = 1
+        self.save_all(tasks or [])
+
+    def load_all(self, status: Optional[str] = None) -> List[Dict]:
+        return [dict(task) for task in self._tasks.values() if status is None or task.get("status") == status]
+
+    def save_all(self, tasks: List[Dict]):
+        self._tasks = {task["id"]: dict(task) for task in tasks}
+        self._next_id = max(self._tasks, default=0) + 1
+
+    def get(self, task_id: int) -> Optional[Dict]:
+        task = self._tasks.get(task_id)
+        return dict(task) if task else None
+
+    def insert(self, task: Dict) -> int:
+        task_id = self._next_id
+        self._next_id += 1
+        self._tasks[task_id] = {**task, "id": task_id}
+        return task_id
+
+    def update(self, task_id: int, fields: Dict) -> bool:
+        task = self._tasks.get(task_id)
+        if task is None:
+            return False
+        task.update(fields)
+        return True
+
+    def delete(self, task_id: int) -> bool:
+        return self._tasks.pop(task_id, None) is not None
+
+
+class JsonTaskStore(TaskStore):
+    """Хранилище в JSON-файлах: снимок (tasks.json) плюс журнал изменений (JSONL).
+
+    Каждое изменение дописывается в журнал одной строкой с fsync, а после
+    compact_every записей журнал в фоне сворачивается в новый снимок.
+    При старте состояние восстанавливается из снимка и журналов.
+    """
+
+    def __init__(self, path: str, compact_every: int = 1000):
+        self.path = path
+        self.journal_path = f"{path}.journal"
+        # Журнал, который сейчас сворачивается в снимок
+        self.compacting_path = f"{path}.journal.1"
+        # Счётчик ID хранится отдельно: после удаления последней задачи её ID не переиспользуется
+        self.meta_path = f"{path}.meta"
+        self._next_id = 1
+        self.compact_every = compact_every
+        self._lock = threading.Lock()
+        self._tasks: Dict[int, Dict] = {}
+        self._journal_records = 0
+        self._compaction: Optional[threading.Thread] = None
+
+        self._replay()
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+
+    def _replay(self):
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                self._next_id = json.load(f)["next_id"]
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            duplicates = []
+            for task in snapshot:
+                if task["id"] in self._tasks:
+                    duplicates.append(task)
+                else:
+                    self._tasks[task["id"]] = task
+            self._next_id = max(self._next_id, max(self._tasks, default=0) + 1)
+            if duplicates:
+                # Старые версии выдавали ID как len(tasks) + 1 и могли повторять их
+                for task in duplicates:
+                    logger.warning(f"Duplicate task ID {task['id']} in {self.path}, renumbered to {self._next_id}")
+                    task["id"] = self._next_id
+                    self._tasks[task["id"]] = task
+                    self._next_id += 1
+                self._write_snapshot(list(self._tasks.values()), self._next_id)
+        self._next_id = max(self._next_id, max(self._tasks, default=0) + 1)
+        for path in (self.compacting_path, self.journal_path):
+            if not os.path.exists(path):
+                continue
+            valid_size = 0
+            with open(path, "rb") as f:
+                for line_number, line in enumerate(f, 1):
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Оборванная последняя строка после падения процесса
+                        logger.warning(f"Skipping broken record {path}:{line_number}")
+                        break
+                    valid_size += len(line)
+                    self._apply(record)
+                    if path == self.journal_path:
+                        self._journal_records += 1
+            if path == self.journal_path and valid_size < os.path.getsize(path):
+                # Отрезаем битый хвост, чтобы новые записи не склеились с ним
+                os.truncate(path, valid_size)
+
+    def _apply(self, record: Dict):
+        op = record["op"]
+        if op == "put":
+            self._tasks[record["task"]["id"]] = record["task"]
+            self._next_id = max(self._next_id, record["task"]["id"] + 1)
+        elif op == "update":
+            task = self._tasks.get(record["id"])
+            if task is not None:
+                task.update(record["fields"])
+        elif op == "delete":
+            self._tasks.pop(record["id"], None)
+
+    def _append(self, *records: Dict):
+        """Дописываем записи в журнал (один fsync) и применяем их к состоянию в памяти (под self._lock)."""
+        self._journal.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        for record in records:
+            self._apply(record)
+        self._journal_records += len(records)
+        if self._journal_records >= self.compact_every:
+            self._start_compaction()
+
+    def insert_many(self, tasks: List[Dict]) -> List[int]:
+        with self._lock:
+            records = []
+            for task in tasks:
+                records.append({"op": "put", "task": {"id": self._next_id, **task}})
+                self._next_id += 1
+            self._append(*records)
+            return [record["task"]["id"] for record in records]
+
+    def _start_compaction(self):
+        """Переключаемся на новый журнал и сворачиваем старый в снимок в фоновом потоке."""
+        if self._compaction is not None and self._compaction.is_alive():
+            return
+        self._journal.close()
+        os.replace(self.journal_path, self.compacting_path)
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+        self._journal_records = 0
+        snapshot = [dict(task) for task in self._tasks.values()]
+        self._compaction = threading.Thread(
+            target=self._compact, args=(snapshot, self._next_id), daemon=True
+        )
+        self._compaction.start()
+
+    def _compact(self, snapshot: List[Dict], next_id: int):
+        try:
+            self._write_snapshot(snapshot, next_id)
+            os.remove(self.compacting_path)
+        except OSError as e:
+            logger.error(f"Failed to compact {self.journal_path}: {e}")
+
+    def _write_snapshot(self, tasks: List[Dict], next_id: int):
+        """Атомарно записываем счётчик ID и снимок: сначала во временный файл, затем переименовываем."""
+        for path, data, indent in ((self.meta_path, {"next_id": next_id}, None), (self.path, tasks, 4)):
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=indent)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+
+    @property
+    def next_id(self) -> int:
+        return self._next_id
+
+    def load_all(self, status: Optional[str] = None) -> List[Dict]:
+        with self._lock:
+            return [
+                dict(task) for task in self._tasks.values()
+                if status is None or task["status"] == status
+            ]
+
+    def save_all(self, tasks: List[Dict]):
+        # Полная перезапись: сразу пишем снимок и начинаем журнал заново
+        with self._lock:
+            if self._compaction is not None:
+                self._compaction.join()
+            self._next_id = max([self._next_id] + [task["id"] + 1 for task in tasks])
+            self._write_snapshot(tasks, self._next_id)
+            self._journal.truncate(0)
+            if os.path.exists(self.compacting_path):
+                os.remove(self.compacting_path)
+            self._journal_records = 0
+            self._tasks = {task["id"]: dict(task) for task in tasks}
+
+    def get(self, task_id: int) -> Optional[Dict]:
+        with self._lock:
+            task = self._tasks.get(task_id)
+            return dict(task) if task else None
+
+    def insert(self, task: Dict) -> int:
+        with self._lock:
+            task_id = self._next_id
+            self._append({"op": "put", "task": {"id": task_id, **task}})
+            return task_id
+
+    def update(self, task_id: int, fields: Dict) -> bool:
+        with self._lock:
+            if task_id not in self._tasks:
+                return False
+            self._append({"op": "update", "id": task_id, "fields": fields})
+            return True
+
+    def delete(self, task_id: int) -> bool:
+        with self._lock:
+            if task_id not in self._tasks:
+                return False
+            self._append({"op": "delete", "id": task_id})
+            return True
+
+    def apply_changes(self, changes: Dict[int, Optional[Dict]]):
+        with self._lock:
+            records = [
+                {"op": "delete", "id": task_id} if fields is None else {"op": "update", "id": task_id, "fields": fields}
+                for task_id, fields in changes.items() if task_id in self._tasks
+            ]
+            if records:
+                self._append(*records)
+
+    def close(self):
+        if self._compaction is not None:
+            self._compaction.join()
+        with self._lock:
+            self._journal.close()
+
+
+class SQLiteTaskStore(TaskStore):
+    """Хранилище в SQLite (WAL) с индексами по статусу и типу расписания."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    message TEXT NOT NULL,
+                    channel_id TEXT NOT NULL,
+                    schedule_type TEXT NOT NULL,
+                    schedule_time TEXT,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    last_sent_date TEXT,
+                    extra TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status);
+                CREATE INDEX IF NOT EXISTS idx_tasks_schedule_type ON tasks (schedule_type);
+            """)
+        self._data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    @staticmethod
+    def _row_to_task(row: sqlite3.Row) -> Dict:
+        task = {column: row[column] for column in TASK_COLUMNS}
+        if row["extra"]:
+            task.update(json.loads(row["extra"]))
+        return task
+
+    @staticmethod
+    def _task_to_params(task: Dict) -> Dict:
+        params = {column: task.get(column) for column in TASK_COLUMNS}
+        params["status"] = params["status"] or "pending"
+        extra = {key: value for key, value in task.items() if key not in TASK_COLUMNS}
+        params["extra"] = json.dumps(extra, ensure_ascii=False) if extra else None
+        return params
+
+    def load_all(self, status: Optional[str] = None) -> List[Dict]:
+        with self._lock:
+            if status is None:
+                rows = self._conn.execute("SELECT * FROM tasks ORDER BY id").fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT * FROM tasks WHERE status = ? ORDER BY id", (status,)
+                ).fetchall()
+        return [self._row_to_task(row) for row in rows]
+
+    def has_external_changes(self) -> bool:
+        # data_version меняется, только когда коммитит другое соединение
+        with self._lock:
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        changed = data_version != self._data_version
+        self._data_version = data_version
+        return changed
+
+    def save_all(self, tasks: List[Dict]):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM tasks")
+            self._insert_many(tasks)
+
+    def _insert_many(self, tasks: List[Dict]):
+        self._conn.executemany(
+            "INSERT INTO tasks (id, message, channel_id, schedule_type, schedule_time, status, "
+            "last_sent_date, extra) VALUES (:id, :message, :channel_id, :schedule_type, "
+            ":schedule_time, :status, :last_sent_date, :extra)",
+            [self._task_to_params(task) for task in tasks]
+        )
+
+    def iter_all(self, status: Optional[str] = None) -> Iterator[Dict]:
+        # Читаем страницами по ID, не удерживая блокировку между страницами
+        last_id = 0
+        while True:
+            with self._lock:
+                if status is None:
+                    rows = self._conn.execute(
+                        "SELECT * FROM tasks WHERE id > ? ORDER BY id LIMIT ?", (last_id, ITER_PAGE_SIZE)
+                    ).fetchall()
+                else:
+                    rows = self._conn.execute(
+                        "SELECT * FROM tasks WHERE id > ? AND status = ? ORDER BY id LIMIT ?",
+                        (last_id, status, ITER_PAGE_SIZE)
+                    ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield self._row_to_task(row)
+            last_id = rows[-1]["id"]
+
+    def get(self, task_id: int) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
+        return self._row_to_task(row) if row else None
+
+    def insert(self, task: Dict) -> int:
+        return self.insert_many([task])[0]
+
+    def insert_many(self, tasks: List[Dict]) -> List[int]:
+        params = [self._task_to_params(task) for task in tasks]
+        # Вся пачка — одна транзакция; ID нужны по одному, поэтому не executemany
+        with self._lock, self._conn:
+            return [
+                self._conn.execute(
+                    "INSERT INTO tasks (message, channel_id, schedule_type, schedule_time, status, "
+                    "last_sent_date, extra) VALUES (:message, :channel_id, :schedule_type, "
+                    ":schedule_time, :status, :last_sent_date, :extra)",
+                    task_params
+                ).lastrowid
+                for task_params in params
+            ]
+
+    def update(self, task_id: int, fields: Dict) -> bool:
+        with self._lock, self._conn:
+            return self._update(task_id, fields)
+
+    def _update(self, task_id: int, fields: Dict) -> bool:
+        # Пересчёт extra требует всей строки, поэтому читаем её в той же транзакции
+        row = self._conn.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
+        if row is None:
+            return False
+        task = self._row_to_task(row)
+        task.update(fields)
+        params = self._task_to_params(task)
+        self._conn.execute(
+            "UPDATE tasks SET message = :message, channel_id = :channel_id, "
+            "schedule_type = :schedule_type, schedule_time = :schedule_time, status = :status, "
+            "last_sent_date = :last_sent_date, extra = :extra WHERE id = :id",
+            params
+        )
+        return True
+
+    def delete(self, task_id: int) -> bool:
+        with self._lock, self._conn:
+            cursor = self._conn.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
+            return cursor.rowcount > 0
+
+    def apply_changes(self, changes: Dict[int, Optional[Dict]]):
+        with self._lock, self._conn:
+            for task_id, fields in changes.items():
+                if fields is None:
+                    self._conn.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
+                else:
+                    self._update(task_id, fields)
+
+    def migrate_from_json(self, json_path: str) -> int:
+        """Однократный перенос задач из tasks.json; файл переименовывается в *.migrated."""
+        if not os.path.exists(json_path):
+            return 0
+        with self._lock:
+            has_rows = self._conn.execute("SELECT 1 FROM tasks LIMIT 1").fetchone()
+        if has_rows:
+            logger.warning(f"{json_path} found, but {self.path} already has tasks; skipping migration")
+            return 0
+
+        json_store = JsonTaskStore(json_path)
+        tasks = json_store.load_all()
+        json_store.close()
+        with self._lock, self._conn:
+            self._insert_many(tasks)
+            # Сохраняем счётчик ID, чтобы ID удалённых задач не выдавались повторно. Строки счётчика
+            # нет, пока в таблицу ничего не вставляли (пустой tasks.json), а name в sqlite_sequence
+            # не уникален, поэтому INSERT OR REPLACE не подходит
+            last_id = json_store.next_id - 1
+            updated = self._conn.execute(
+                "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'tasks'", (last_id,)
+            ).rowcount
+            if not updated:
+                self._conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('tasks', ?)", (last_id,))
+        os.replace(json_path, f"{json_path}.migrated")
+        for path in (json_store.journal_path, json_store.compacting_path, json_store.meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+        logger.info(f"Migrated {len(tasks)} tasks from {json_path} to {self.path}")
+        return len(tasks)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
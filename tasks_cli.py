@@ -0,0 +1,217 @@
+"""Массовый импорт и выгрузка задач в JSONL и CSV.
+
+Запуск:
+    python tasks_cli.py import tasks.jsonl [--batch-size 1000] [--dry-run]
+    python tasks_cli.py export tasks.csv [--status pending] [--channel -100123]
+
+Файлы читаются и пишутся потоком, строка за строкой: в памяти держится только текущая
+пачка. Каждая строка проверяется моделью TaskRow; строки с ошибками пропускаются и
+перечисляются в stderr с номером строки, остальные пишутся пачками (одна транзакция
+хранилища на пачку) через utils.add_tasks. "-" вместо пути — stdin/stdout.
+"""
+import argparse
+import csv
+import json
+import sys
+
+from contextlib import nullcontext
+from typing import ContextManager, Dict, Iterator, List, Literal, Optional, TextIO, Tuple
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator, model_validator
+
+import utils
+from media import MAX_ALBUM_SIZE, MEDIA_TYPES
+from schedules import CATCH_UP_POLICIES, SCHEDULE_TYPES, compile_schedule
+
+FORMATS = ("jsonl", "csv")
+
+# Колонки CSV при выгрузке; списки (targets через ";", media — JSON) кодируются в одну ячейку
+CSV_COLUMNS = ("id", "message", "channel_id", "schedule_type", "schedule_time", "status",
+               "last_sent_date", "targets", "media", "catch_up")
+
+
+class MediaItem(BaseModel):
+    type: Literal[MEDIA_TYPES]
+    file_id: Optional[str] = None
+    path: Optional[str] = None  # Локальный файл, загружается один раз (см. media.FileIdCache)
+
+    @model_validator(mode="after")
+    def _check_source(self):
+        if bool(self.file_id) == bool(self.path):
+            raise ValueError("media item needs exactly one of file_id and path")
+        return self
+
+
+class TaskRow(BaseModel):
+    """Строка импорта: те же поля, что у utils.add_task. Служебные поля выгрузки (id и т.п.) игнорируются."""
+
+    model_config = ConfigDict(extra="ignore")
+
+    message: str = ""
+    channel_id: str
+    schedule_type: Literal[SCHEDULE_TYPES]
+    schedule_time: Optional[str] = None
+    targets: Optional[List[str]] = None
+    media: Optional[List[MediaItem]] = Field(default=None, max_length=MAX_ALBUM_SIZE)
+    catch_up: Optional[Literal[CATCH_UP_POLICIES]] = None
+    status: Optional[str] = None  # Из выгрузки: импортируются только задачи, ожидающие отправки
+
+    @field_validator("channel_id", "schedule_time", mode="before")
+    @classmethod
+    def _to_str(cls, value):
+        # В JSON ID канала и интервал часто записаны числами
+        return str(value) if isinstance(value, int) else value
+
+    @field_validator("targets", mode="before")
+    @classmethod
+    def _targets_to_str(cls, value):
+        return [str(target) for target in value] if isinstance(value, list) else value
+
+    @model_validator(mode="after")
+    def _check_task(self):
+        compile_schedule(self.schedule_type, self.schedule_time)
+        if not self.message and not self.media:
+            raise ValueError("task needs a message or media")
+        return self
+
+    def to_task(self) -> Dict:
+        """Аргументы для utils.add_task."""
+        return {
+            "message": self.message,
+            "channel_id": self.channel_id,
+            "schedule_type": self.schedule_type,
+            "schedule_time": self.schedule_time,
+            "targets": self.targets,
+            "media": [item.model_dump(exclude_none=True) for item in self.media] if self.media else None,
+            "catch_up": self.catch_up,
+        }
+
+
+def detect_format(path: str, fmt: Optional[str]) -> str:
+    if fmt:
+        return fmt
+    return "csv" if path.lower().endswith(".csv") else "jsonl"
+
+
+def open_file(path: str, mode: str, fmt: str) -> ContextManager[TextIO]:
+    if path == "-":
+        return nullcontext(sys.stdin if mode == "r" else sys.stdout)
+    # Переводы строк внутри ячеек csv обрабатывает сам
+    return open(path, mode, encoding="utf-8", newline="" if fmt == "csv" else None)
+
+
+def read_rows(file: TextIO, fmt: str) -> Iterator[Tuple[int, object]]:
+    """Номер строки и сырая строка: текст для JSONL, словарь ячеек для CSV."""
+    if fmt == "jsonl":
+        for line_no, line in enumerate(file, 1):
+            if line.strip():
+                yield line_no, line
+        return
+    reader = csv.DictReader(file)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def parse_row(raw, fmt: str) -> TaskRow:
+    """ValueError (в том числе ValidationError), если строка некорректна."""
+    if fmt == "jsonl":
+        return TaskRow.model_validate_json(raw)
+    row = {key: value for key, value in raw.items() if key and value not in ("", None)}
+    if "targets" in row:
+        row["targets"] = [target.strip() for target in row["targets"].split(";") if target.strip()]
+    if "media" in row:
+        row["media"] = json.loads(row["media"])
+    return TaskRow.model_validate(row)
+
+
+def describe_error(error: ValueError) -> str:
+    if isinstance(error, ValidationError):
+        return "; ".join(
+            f"{'.'.join(map(str, item['loc'])) or 'row'}: {item['msg']}" for item in error.errors()
+        )
+    return str(error)
+
+
+def import_tasks(file: TextIO, fmt: str, batch_size: int, dry_run: bool = False) -> Dict[str, int]:
+    summary = {"imported": 0, "skipped": 0, "errors": 0}
+    batch: List[Dict] = []
+
+    def flush():
+        if batch and not dry_run:
+            utils.add_tasks(batch)
+        summary["imported"] += len(batch)
+        batch.clear()
+
+    for line_no, raw in read_rows(file, fmt):
+        try:
+            row = parse_row(raw, fmt)
+        except ValueError as e:
+            summary["errors"] += 1
+            print(f"line {line_no}: {describe_error(e)}", file=sys.stderr)
+            continue
+        if row.status not in (None, "pending"):
+            # Выполненные задачи из выгрузки не создаём заново, иначе они отправятся ещё раз
+            summary["skipped"] += 1
+            continue
+        batch.append(row.to_task())
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+    return summary
+
+
+def export_tasks(file: TextIO, fmt: str, status: Optional[str] = None, channel_id: Optional[str] = None) -> int:
+    count = 0
+    if fmt == "jsonl":
+        for task in utils.iter_tasks(status, channel_id):
+            file.write(json.dumps(task, ensure_ascii=False) + "\n")
+            count += 1
+        return count
+    writer = csv.DictWriter(file, fieldnames=CSV_COLUMNS, extrasaction="ignore")
+    writer.writeheader()
+    for task in utils.iter_tasks(status, channel_id):
+        row = dict(task)
+        row["targets"] = ";".join(task.get("targets") or [])
+        row["media"] = json.dumps(task["media"], ensure_ascii=False) if task.get("media") else ""
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Bulk import and export of tasks (JSONL or CSV)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser("import", help="Add tasks from a file")
+    import_parser.add_argument("path", help="Input file, '-' for stdin")
+    import_parser.add_argument("--format", choices=FORMATS, help="Default: by file extension, else jsonl")
+    import_parser.add_argument("--batch-size", type=int, default=1000, help="Tasks per store transaction")
+    import_parser.add_argument("--dry-run", action="store_true", help="Only validate, write nothing")
+
+    export_parser = commands.add_parser("export", help="Write tasks to a file")
+    export_parser.add_argument("path", help="Output file, '-' for stdout")
+    export_parser.add_argument("--format", choices=FORMATS, help="Default: by file extension, else jsonl")
+    export_parser.add_argument("--status", help="Only tasks with this status")
+    export_parser.add_argument("--channel", help="Only tasks of this channel")
+    args = parser.parse_args(argv)
+
+    fmt = detect_format(args.path, args.format)
+    store = utils.get_store()
+    try:
+        if args.command == "import":
+            with open_file(args.path, "r", fmt) as file:
+                summary = import_tasks(file, fmt, max(1, args.batch_size), args.dry_run)
+            json.dump(summary, sys.stderr, ensure_ascii=False)
+            print(file=sys.stderr)
+            if summary["errors"]:
+                sys.exit(1)
+        else:
+            with open_file(args.path, "w", fmt) as file:
+                count = export_tasks(file, fmt, args.status, args.channel)
+            print(f"Exported {count} tasks", file=sys.stderr)
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
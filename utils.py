@@ -1,13 +1,24 @@
-import json
-import os
-import asyncio
 import logging
+import time
 
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, List, Dict, Optional
+
+from config import get_optional_config, StorageConfig
+from repository import TaskRepository
+from schedules import CATCH_UP_POLICIES, Schedule, compile_schedule
+from storage import TaskStore, JsonTaskStore, SQLiteTaskStore
 
 TASKS_FILE = "tasks.json"
 
+# Подписчики на изменения задач (планировщик и т.п.), получают ID задачи
+_change_listeners: List[Callable[[int], None]] = []
+
+_store: Optional[TaskStore] = None
+_repository: Optional[TaskRepository] = None
+# Поток, в котором бот пишет задачи в хранилище (см. start_write_behind)
+_io_executor: Optional[ThreadPoolExecutor] = None
+
 logger = logging.getLogger(__name__)
 
 logging.basicConfig(
@@ -15,99 +26,208 @@ logging.basicConfig(
     format='%(filename)s:%(lineno)d #%(levelname)-8s '
            '[%(asctime)s] - %(name)s - %(message)s')
 
-def load_tasks() -> List[Dict]:
-    """Загружаем задачи из JSON."""
-    if os.path.exists(TASKS_FILE):
-        with open(TASKS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return []
+def create_store() -> TaskStore:
+    """Создаём хранилище задач по секции storage из config.yaml."""
+    storage_config = get_optional_config(StorageConfig, "storage")
+    if storage_config.backend == "json":
+        return JsonTaskStore(TASKS_FILE, storage_config.compact_every)
+    if storage_config.backend == "sqlite":
+        store = SQLiteTaskStore(storage_config.path)
+        store.migrate_from_json(TASKS_FILE)
+        return store
+    raise ValueError(f"Unknown storage backend: {storage_config.backend}")
+
+def get_store() -> TaskStore:
+    """Хранилище задач процесса (создаётся при первом обращении)."""
+    global _store
+    if _store is None:
+        _store = create_store()
+    return _store
+
+def set_store(store: Optional[TaskStore]):
+    """Подменяем хранилище задач (например, в скриптах миграции)."""
+    global _store, _repository
+    _store = store
+    _repository = None
+
+def get_repository() -> TaskRepository:
+    """Общий репозиторий задач процесса: хендлеры и планировщик читают задачи из памяти."""
+    global _repository
+    if _repository is None:
+        _repository = TaskRepository(get_store())
+    return _repository
+
+def start_write_behind():
+    """Переводим репозиторий бота на отложенную запись в отдельном потоке.
+
+    Вызывается из запущенного цикла событий; окно объединения изменений — storage.write_delay.
+    """
+    global _io_executor
+    if _io_executor is None:
+        _io_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="task-store")
+        get_repository().start_write_behind(_io_executor, get_optional_config(StorageConfig, "storage").write_delay)
+
+async def flush_tasks():
+    """Дожидаемся записи всех изменений задач в хранилище (точка надёжности)."""
+    await get_repository().flush()
+
+async def stop_write_behind():
+    """Записываем оставшиеся изменения и останавливаем поток записи (при завершении бота)."""
+    global _io_executor
+    if _io_executor is None:
+        return
+    try:
+        await flush_tasks()
+    finally:
+        get_repository().stop_write_behind()
+        _io_executor.shutdown(wait=True)
+        _io_executor = None
+
+async def refresh_tasks() -> bool:
+    """Перечитываем задачи, если хранилище менял другой процесс (чтение — вне цикла событий)."""
+    return await get_repository().refresh()
+
+def get_synced_repository() -> TaskRepository:
+    """Репозиторий с учётом изменений, сделанных другими процессами."""
+    repository = get_repository()
+    repository.sync()
+    return repository
+
+def subscribe_task_changes(listener: Callable[[int], None]):
+    """Подписываемся на добавление, редактирование и удаление задач."""
+    if listener not in _change_listeners:
+        _change_listeners.append(listener)
+
+def unsubscribe_task_changes(listener: Callable[[int], None]):
+    """Отписываемся от изменений задач."""
+    if listener in _change_listeners:
+        _change_listeners.remove(listener)
+
+def _notify_task_changed(task_id: int):
+    """Сообщаем подписчикам, что задача изменилась."""
+    for listener in list(_change_listeners):
+        listener(task_id)
+
+def load_tasks(status: Optional[str] = None, channel_id: Optional[str] = None) -> List[Dict]:
+    """Загружаем задачи (все или по статусу и/или каналу)."""
+    return [record.to_dict() for record in get_synced_repository().find(status, channel_id)]
 
 def save_tasks(tasks: List[Dict]):
-    """Сохраняем задачи в JSON."""
-    with open(TASKS_FILE, "w", encoding="utf-8") as f:
-        json.dump(tasks, f, ensure_ascii=False, indent=4)
-
-def add_task(message: str, channel_id: str, schedule_type: str, schedule_time: Optional[str] = None) -> int:
-    """Добавляем новую задачу и возвращаем её ID."""
-    tasks = load_tasks()
-    task_id = len(tasks) + 1
-    
+    """Сохраняем весь список задач."""
+    get_repository().replace_all(tasks)
+
+def get_task(task_id: int) -> Optional[Dict]:
+    """Получаем задачу по ID."""
+    record = get_synced_repository().get(task_id)
+    return record.to_dict() if record else None
+
+def get_schedule(task_id: int) -> Optional[Schedule]:
+    """Скомпилированное расписание задачи из репозитория (None — задачи нет или расписание некорректно)."""
+    record = get_repository().get(task_id)
+    return record.schedule if record is not None else None
+
+def update_task(task_id: int, **fields):
+    """Обновляем служебные поля задачи (статус, дату отправки) без уведомления подписчиков."""
+    get_repository().update(task_id, fields)
+
+def _new_task(message: str, channel_id: str, schedule_type: str, schedule_time: Optional[str] = None,
+              targets: Optional[List[str]] = None, media: Optional[List[Dict]] = None,
+              catch_up: Optional[str] = None) -> Dict:
+    compile_schedule(schedule_type, schedule_time)  # ValueError, если расписание некорректно
+    if catch_up is not None and catch_up not in CATCH_UP_POLICIES:
+        raise ValueError(f"Unknown catch-up policy: {catch_up!r}")
     new_task = {
-        "id": task_id,
         "message": message,
         "channel_id": channel_id,
-        "schedule_type": schedule_type,  # "immediate", "delayed", "daily"
-        "schedule_time": schedule_time,  # Для daily — только "HH:MM:SS", для других — полный формат или None
+        "schedule_type": schedule_type,  # "immediate", "delayed", "daily", "weekly", "interval", "cron"
+        "schedule_time": schedule_time,  # Формат зависит от типа, см. schedules.compile_schedule
         "status": "pending",
-        "last_sent_date": None  # Для отслеживания последнего отправления
+        "last_sent_date": None,  # Для отслеживания последнего отправления
+        "created_at": time.time()  # От него отсчитывается первое срабатывание интервальной задачи
     }
-    tasks.append(new_task)
-    save_tasks(tasks)
+    if targets:
+        new_task["targets"] = list(targets)
+    if media:
+        new_task["media"] = [dict(item) for item in media]
+    if catch_up is not None:
+        new_task["catch_up"] = catch_up
+    return new_task
+
+def add_task(message: str, channel_id: str, schedule_type: str, schedule_time: Optional[str] = None,
+             targets: Optional[List[str]] = None, media: Optional[List[Dict]] = None,
+             catch_up: Optional[str] = None) -> int:
+    """Добавляем новую задачу и возвращаем её ID.
+
+    targets — адресаты рассылки (ID каналов и "group:<имя>"); channel_id тогда — основной канал,
+    по нему задача фильтруется в меню и распределяется между воркерами.
+    media — вложения ({"type": "photo", "file_id": ...} или {"type": ..., "path": ...}),
+    message тогда — подпись; несколько вложений отправляются альбомом.
+    catch_up — что делать со срабатываниями, пропущенными за простой бота ("skip", "coalesce",
+    "replay"); по умолчанию — политика из секции catch_up конфига.
+    """
+    task_id = get_repository().add(
+        _new_task(message, channel_id, schedule_type, schedule_time, targets, media, catch_up)
+    )
+    _notify_task_changed(task_id)
+    return task_id
+
+async def add_task_async(message: str, channel_id: str, schedule_type: str, schedule_time: Optional[str] = None,
+                         targets: Optional[List[str]] = None, media: Optional[List[Dict]] = None,
+                         catch_up: Optional[str] = None) -> int:
+    """То же, что add_task, но без блокировки цикла событий записью в хранилище."""
+    task_id = await get_repository().add_async(
+        _new_task(message, channel_id, schedule_type, schedule_time, targets, media, catch_up)
+    )
+    _notify_task_changed(task_id)
     return task_id
 
+def add_tasks(tasks: Iterable[Dict]) -> List[int]:
+    """Добавляем пачку задач одной транзакцией хранилища (массовый импорт) и возвращаем их ID.
+
+    Каждая задача — словарь с аргументами add_task. Если репозиторий в этом процессе ещё
+    не создан (скрипт tasks_cli.py), пишем прямо в хранилище, не загружая все задачи в память;
+    запущенный бот подхватит их при следующей синхронизации.
+    """
+    new_tasks = [_new_task(**task) for task in tasks]
+    if _repository is None:
+        return get_store().insert_many(new_tasks)
+    task_ids = get_repository().add_many(new_tasks)
+    for task_id in task_ids:
+        _notify_task_changed(task_id)
+    return task_ids
+
+def iter_tasks(status: Optional[str] = None, channel_id: Optional[str] = None) -> Iterator[Dict]:
+    """Задачи по одной в порядке ID (для выгрузки); без репозитория — потоком из хранилища."""
+    if _repository is not None:
+        yield from load_tasks(status, channel_id)
+        return
+    for task in get_store().iter_all(status):
+        if channel_id is None or task["channel_id"] == channel_id:
+            yield task
+
 def edit_task(task_id: int, new_message: Optional[str] = None, new_schedule_time: Optional[str] = None):
     """Редактируем задачу по ID."""
-    tasks = load_tasks()
-    for task in tasks:
-        if task["id"] == task_id:
-            if new_message:
-                task["message"] = new_message
-            if new_schedule_time:
-                task["schedule_time"] = new_schedule_time
-            break
-    save_tasks(tasks)
+    fields = {}
+    if new_message:
+        fields["message"] = new_message
+    if new_schedule_time:
+        task = get_repository().get(task_id)
+        if task is not None:
+            compile_schedule(task.schedule_type, new_schedule_time)
+        fields["schedule_time"] = new_schedule_time
+    if fields and get_repository().update(task_id, fields):
+        _notify_task_changed(task_id)
 
 def delete_task(task_id: int):
     """Удаляем задачу по ID."""
-    tasks = load_tasks()
-    tasks = [task for task in tasks if task["id"] != task_id]
-    save_tasks(tasks)
-
-async def task_scheduler(bot):
-    """Планировщик: проверяет задачи и отправляет сообщения."""
-    while True:
-        tasks = load_tasks()
-        current_time = datetime.now()
-        
-        for task in tasks:
-            if task["status"] != "pending":
-                continue
-                
-            schedule_time = task["schedule_time"]
-            schedule_type = task["schedule_type"]
-            
-            if schedule_type == "immediate":
-                await bot.send_message(chat_id=task["channel_id"], text=task["message"])
-                task["status"] = "done"
-            
-            elif schedule_type == "delayed" and schedule_time:
-                scheduled = datetime.strptime(schedule_time, "%Y-%m-%d %H:%M:%S")
-                if current_time >= scheduled:
-                    await bot.send_message(chat_id=task["channel_id"], text=task["message"])
-                    task["status"] = "done"
-            
-            elif schedule_type == "daily" and schedule_time:
-                # Для daily schedule_time хранит только время в формате "HH:MM:SS"
-                scheduled = datetime.strptime(schedule_time, "%H:%M:%S")
-                current_time_only = current_time.time()
-                scheduled_time_only = scheduled.time()
-                
-                # Проверяем, отправлялось ли сообщение сегодня
-                last_sent_date = task.get("last_sent_date")
-                current_date = current_time.date().isoformat()
-                
-                # Если сообщение уже отправлено сегодня, пропускаем до следующего дня
-                if last_sent_date == current_date:
-                    continue
-                
-                # Проверяем, наступило ли время для отправки
-                if (current_time_only.hour > scheduled_time_only.hour or 
-                    (current_time_only.hour == scheduled_time_only.hour and 
-                     current_time_only.minute >= scheduled_time_only.minute)):
-                    await bot.send_message(chat_id=task["channel_id"], text=task["message"])
-                    # Обновляем дату последнего отправления
-                    task["last_sent_date"] = current_date
-                    # Для "daily" статус не меняем, чтобы повторялось каждый день
-
-        save_tasks(tasks)  # Обновляем статусы
-        await asyncio.sleep(60)  # Проверяем каждую минуту
\ No newline at end of file
+    if get_repository().delete(task_id):
+        _notify_task_changed(task_id)
+
+def requeue_task(task_id: int) -> bool:
+    """Возвращаем задачу из списка ошибок в расписание."""
+    task = get_repository().get(task_id)
+    if task is None or task.status != "failed":
+        return False
+    get_repository().update(task_id, {"status": "pending", "last_error": None})
+    _notify_task_changed(task_id)
+    return True
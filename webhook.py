@@ -0,0 +1,92 @@
+import asyncio
+import hmac
+import logging
+
+from typing import Optional, Set
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import setup_application
+from aiohttp import web
+
+from config import WebhookConfig
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookHandler:
+    """Принимает апдейты от Telegram, проверяет секрет и обрабатывает их в фоне с ограничением параллельности."""
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token: Optional[str], max_concurrent_updates: int):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.secret_token = secret_token
+        self._semaphore = asyncio.Semaphore(max_concurrent_updates)
+        self._tasks: Set[asyncio.Task] = set()
+
+    def _verify_secret(self, request: web.Request) -> bool:
+        if not self.secret_token:
+            return True
+        return hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret_token)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not self._verify_secret(request):
+            return web.Response(status=401, text="Unauthorized")
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400, text="Bad Request")
+
+        # Если обработчики заняты, Telegram подождёт ответа — так нагрузка остаётся ограниченной
+        await self._semaphore.acquire()
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update: dict):
+        try:
+            await self.dispatcher.feed_raw_update(self.bot, update)
+        except Exception as e:
+            logger.error(f"Error while handling update {update.get('update_id')}: {e}")
+        finally:
+            self._semaphore.release()
+
+    async def shutdown(self):
+        """Дожидаемся апдейтов, которые ещё обрабатываются."""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+async def health(request: web.Request) -> web.Response:
+    return web.Response(text="ok")
+
+
+async def run_webhook(dispatcher: Dispatcher, bot: Bot, webhook_config: WebhookConfig):
+    """Запускаем aiohttp-сервер для вебхука и регистрируем его в Telegram."""
+    secret_token = webhook_config.secret_token.get_secret_value() if webhook_config.secret_token else None
+    handler = WebhookHandler(dispatcher, bot, secret_token, webhook_config.max_concurrent_updates)
+
+    app = web.Application()
+    app.router.add_post(webhook_config.path, handler.handle)
+    app.router.add_get("/healthz", health)
+    setup_application(app, dispatcher, bot=bot)
+
+    await bot.set_webhook(
+        url=webhook_config.url.rstrip("/") + webhook_config.path,
+        secret_token=secret_token,
+        allowed_updates=dispatcher.resolve_used_update_types(),
+        drop_pending_updates=True,
+    )
+    logger.info(f"Webhook set, listening on {webhook_config.host}:{webhook_config.port}{webhook_config.path}")
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, webhook_config.host, webhook_config.port)
+    await site.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await handler.shutdown()
+        await runner.cleanup()